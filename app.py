@@ -4,14 +4,18 @@ import tkinter as tk
 from tkinter import ttk  # Import ttk for themed widgets
 from tkinter import filedialog, messagebox
 from tkinter.ttk import Style # Import Style for theme configuration
-from PIL import Image, ImageTk, Image as PILImage # Use alias
-import json
+from lazy_imports import LazyModule
+# PIL is only needed once an image is shown, so it's imported on first use
+PILImage = LazyModule("PIL.Image")
+ImageTk = LazyModule("PIL.ImageTk")
+import math
 import re # For input validation
 import os # Added for default filename
 
 # >>> Placeholder for send_token - replace with your actual import <<<
-def send_token(cookie_id, image_path, data, map_name, x_scale=1.0, y_scale=1.0):
+def send_token(cookie_id, image_path, data, map_name, x_scale=1.0, y_scale=1.0, cleanup=None):
     print("--- MOCK send_token ---")
+    print(f"Wall Clean-up: {cleanup}")
     print(f"Cookie: {cookie_id}")
     print(f"Image Path: {image_path}")
     print(f"Map Name: {map_name}")
@@ -28,22 +32,15 @@ def send_token(cookie_id, image_path, data, map_name, x_scale=1.0, y_scale=1.0):
 # --- End Placeholder ---
 
 
-# Import shapely (optional)
-try:
-    from shapely.geometry import Polygon
-    from shapely.ops import unary_union
-    SHAPELY_AVAILABLE = True
-except ImportError:
-    SHAPELY_AVAILABLE = False
-    print("Warning: Shapely library not found. Polygon merging will be disabled.")
-
-# Import KDTree (optional)
-try:
-    from scipy.spatial import KDTree
-    KDTREE_AVAILABLE = True
-except ImportError:
-    KDTREE_AVAILABLE = False
-    print("Warning: scipy.spatial.KDTree not found. Line merging might be slower.")
+import line_backends
+import wall_detection
+import wall_io
+from detection_cache import DetectionCache, cached_detect_walls, image_digest
+from gradient_canny import CachedEdgeStage
+import roi_detection
+import scene_export
+from prepare_wall_packet import DEFAULT_CLEANUP, MIN_DISTANCE
+from wall_editor import PICK_RADIUS, SNAP_RADIUS, WallEditor
 
 
 # --- Dark Theme Colors ---
@@ -57,11 +54,16 @@ COLOR_BUTTON_TEXT = "#FFFFFF"
 COLOR_CANVAS_BG = "#4A4A4A"
 COLOR_POLYGON = "#FF6B6B"    # Reddish color for polygons
 COLOR_LINE = "#4ECDC4"       # Teal color for lines
+COLOR_ROI = "#FFD166"        # Yellow color for detection regions
+COLOR_SELECTED = "#C77DFF"   # Purple color for selected walls while editing
 COLOR_DISABLED_TEXT = "#888888" # Color for disabled text/widgets
 COLOR_ENTRY_BG = "#555555" # Slightly different background for Entry
 COLOR_ENTRY_TEXT = "#F0F0F0"
 COLOR_ENTRY_BORDER = "#777777" # Border for Entry widget focus
 
+EDIT_TOOLS = ["Off", "Select", "Delete", "Split", "Draw"]
+WALL_TILE = 128 # The edited walls overlay is drawn in tiles of this size (px)
+
 class WallLineDetectorApp:
     def __init__(self, master):
         self.master = master
@@ -90,7 +92,35 @@ class WallLineDetectorApp:
         self.lines = []
 
         # OpenCV Tools
-        self.lsd = cv2.createLineSegmentDetector(cv2.LSD_REFINE_STD)
+        self._lsd = None # Line detector, created on first detection (see lsd)
+        # Preallocated stage outputs, reused by every run on the same image size
+        self.buffers = wall_detection.BufferPool()
+        # Caches the blurred image so Canny threshold changes skip morphology + blur
+        self.edge_stage = CachedEdgeStage(buffers=self.buffers)
+
+        # Persistent cache of detection results (keyed by image content + params)
+        try:
+            self.detection_cache = DetectionCache()
+        except OSError as e:
+            print(f"Warning: Detection cache disabled: {e}")
+            self.detection_cache = None
+        self.img_digest = None # Content hash of self.img, computed once per load
+
+        # Regions of interest with their own detection params, spliced into the full-image result
+        self.region_detector = roi_detection.RegionDetector()
+        self.region_controls = []   # Per region: control values that differ from the global ones
+        self.base_detection = None  # (polygons, lines, edges) of the last full-image run
+        self.global_params = None
+        self.global_controls = None
+        self.edit_target = None     # None = global params, else index of the region being tuned
+        self._loading_controls = False
+        self._roi_drag = None       # Canvas coords where the current region drag started
+        self.canvas_views = {}      # tk image attr -> (x offset, y offset, x scale, y scale) of the shown image
+
+        # Hand edits of the detected walls (see wall_editor), created when an edit tool is first used
+        self.wall_editor = None
+        self.wall_selection = np.empty(0, dtype=np.int64) # Selected wall ids
+        self._edit_drag = None      # Canvas coords where the current edit drag started
 
         # Styling
         self.style = Style(self.master)
@@ -165,6 +195,12 @@ class WallLineDetectorApp:
         # Create UI
         self.create_widgets()
 
+    @property
+    def lsd(self):
+        if self._lsd is None:
+            self._lsd = wall_detection.create_line_detector()
+        return self._lsd
+
     def create_widgets(self):
         # --- Control Panel (Left - Column 0) ---
         control_frame = ttk.Frame(self.master, padding="15 15 15 15")
@@ -266,6 +302,15 @@ class WallLineDetectorApp:
                                      start_row_idx=row_idx)
         row_idx = add_slider_control('canny2', "Canny Thresh 2", 0, 500, 150, parent_frame=control_frame,
                                      start_row_idx=row_idx)
+        row_idx = add_slider_control('min_blob', "Min Edge Blob", 0, 200, 0, parent_frame=control_frame,
+                                     start_row_idx=row_idx) # Edge blobs with fewer pixels are dropped as noise
+        ttk.Label(control_frame, text="Line Detector").grid(row=row_idx, column=0, sticky="w", padx=(5, 10))
+        self.line_backend_var = tk.StringVar(value="lsd")
+        backend_combo = ttk.Combobox(control_frame, state="readonly", textvariable=self.line_backend_var,
+                                     values=line_backends.available_backends(), width=12)
+        backend_combo.grid(row=row_idx, column=1, columnspan=2, sticky="ew", padx=5, pady=1)
+        backend_combo.bind("<<ComboboxSelected>>", self.process_image_debounced)
+        row_idx += 1
         row_idx = add_separator(control_frame, row_idx)  # Use helper
         ttk.Label(control_frame, text="Polygon option", style='Bold.TLabel').grid(row=row_idx, column=0, columnspan=3,
                                                                            sticky="w", pady=(0, 5))
@@ -296,14 +341,14 @@ class WallLineDetectorApp:
                                                 command=self.process_image_debounced)
         self.poly_merge_check.grid(row=row_idx, column=0, columnspan=3, sticky="w", padx=5, pady=1)
         # Place disabled label near checkbox if needed
-        if not SHAPELY_AVAILABLE:
+        if not wall_detection.SHAPELY_AVAILABLE:
             ttk.Label(control_frame, text="(Requires Shapely)", font="-size 8", foreground=COLOR_DISABLED_TEXT).grid(
                 row=row_idx, column=1, columnspan=2, sticky='e', padx=5)
         row_idx += 1
         row_idx = add_slider_control('poly_thresh', "Poly Thresh", 1, 100, 20, parent_frame=control_frame,
                                      start_row_idx=row_idx)
 
-        if not SHAPELY_AVAILABLE:
+        if not wall_detection.SHAPELY_AVAILABLE:
             self.merge_polygons_var.set(False)
             self.poly_merge_check.config(state=tk.DISABLED)
             widgets = self.slider_widgets.get('poly_thresh')
@@ -313,6 +358,51 @@ class WallLineDetectorApp:
 
         row_idx = add_separator(control_frame, row_idx)  # Use helper
 
+        # --- Regions (per-region detection params) ---
+        ttk.Label(control_frame, text="Regions", style='Bold.TLabel').grid(row=row_idx, column=0, columnspan=3,
+                                                                           sticky="w", pady=(0, 5))
+        row_idx += 1
+        self.roi_draw_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(control_frame, text="Draw Region (drag on image)", variable=self.roi_draw_var).grid(
+            row=row_idx, column=0, columnspan=3, sticky="w", padx=5, pady=1)
+        row_idx += 1
+        ttk.Label(control_frame, text="Sliders edit").grid(row=row_idx, column=0, sticky="w", padx=(5, 10))
+        self.roi_target_combo = ttk.Combobox(control_frame, state="readonly", values=["Global"], width=12)
+        self.roi_target_combo.current(0)
+        self.roi_target_combo.grid(row=row_idx, column=1, columnspan=2, sticky="ew", padx=5, pady=1)
+        self.roi_target_combo.bind("<<ComboboxSelected>>", self.select_edit_target)
+        row_idx += 1
+        self.remove_region_button = ttk.Button(control_frame, text="Remove Region", command=self.remove_region)
+        self.remove_region_button.grid(row=row_idx, column=0, columnspan=3, padx=5, pady=3, sticky="ew")
+        row_idx += 1
+
+        row_idx = add_separator(control_frame, row_idx)  # Use helper
+
+        # --- Wall Editing (click / drag on the overlay canvas) ---
+        ttk.Label(control_frame, text="Edit Walls", style='Bold.TLabel').grid(row=row_idx, column=0, columnspan=3,
+                                                                              sticky="w", pady=(0, 5))
+        row_idx += 1
+        ttk.Label(control_frame, text="Tool").grid(row=row_idx, column=0, sticky="w", padx=(5, 10))
+        self.edit_tool_var = tk.StringVar(value="Off")
+        edit_tool_combo = ttk.Combobox(control_frame, state="readonly", textvariable=self.edit_tool_var,
+                                       values=EDIT_TOOLS, width=12)
+        edit_tool_combo.grid(row=row_idx, column=1, columnspan=2, sticky="ew", padx=5, pady=1)
+        edit_tool_combo.bind("<<ComboboxSelected>>", self.select_edit_tool)
+        row_idx += 1
+        self.delete_walls_button = ttk.Button(control_frame, text="Delete Selected", command=self.delete_selected_walls)
+        self.delete_walls_button.grid(row=row_idx, column=0, columnspan=3, padx=5, pady=3, sticky="ew")
+        row_idx += 1
+        self.undo_button = ttk.Button(control_frame, text="Undo", command=self.undo_wall_edit, state=tk.DISABLED)
+        self.undo_button.grid(row=row_idx, column=0, padx=5, pady=3, sticky="ew")
+        self.redo_button = ttk.Button(control_frame, text="Redo", command=self.redo_wall_edit, state=tk.DISABLED)
+        self.redo_button.grid(row=row_idx, column=1, columnspan=2, padx=5, pady=3, sticky="ew")
+        row_idx += 1
+        self.edit_status_label = ttk.Label(control_frame, text="Not editing")
+        self.edit_status_label.grid(row=row_idx, column=0, columnspan=3, padx=5, pady=(0, 5), sticky="w")
+        row_idx += 1
+
+        row_idx = add_separator(control_frame, row_idx)  # Use helper
+
         # --- JSON Export Buttons (in Control Panel) ---
         ttk.Label(control_frame, text="File Export", style='Bold.TLabel').grid(row=row_idx, column=0, columnspan=3,
                                                                                sticky="w", pady=(0, 5))
@@ -325,6 +415,11 @@ class WallLineDetectorApp:
                                                  command=lambda: self.export_json(save_polygons=True, save_lines=False))
         self.export_polygons_button.grid(row=row_idx, column=0, columnspan=3, padx=5, pady=3, sticky="ew")
         row_idx += 1
+        # Whole scene document for Foundry's "Import Data", no live connection needed
+        self.export_scene_button = ttk.Button(control_frame, text="Export Foundry Scene (JSON)",
+                                              command=self.export_foundry_scene)
+        self.export_scene_button.grid(row=row_idx, column=0, columnspan=3, padx=5, pady=3, sticky="ew")
+        row_idx += 1
 
         control_frame.rowconfigure(row_idx, weight=1)  # Push controls up
 
@@ -349,6 +444,13 @@ class WallLineDetectorApp:
                                                                                             sticky="ew", pady=(0, 5))
         self.canvas = tk.Canvas(original_canvas_frame, width=400, height=400, bg=COLOR_CANVAS_BG, highlightthickness=0)
         self.canvas.grid(row=1, column=0, sticky="nsew")
+        self.canvas.bind("<ButtonPress-1>", self.on_canvas_press)
+        self.canvas.bind("<B1-Motion>", self.on_canvas_drag)
+        self.canvas.bind("<ButtonRelease-1>", self.on_canvas_release)
+        # Edit shortcuts (the canvas takes focus when clicked)
+        self.canvas.bind("<Delete>", lambda event: self.delete_selected_walls())
+        self.canvas.bind("<Control-z>", lambda event: self.undo_wall_edit())
+        self.canvas.bind("<Control-y>", lambda event: self.redo_wall_edit())
 
         # --- Export/Foundry Panel (Right - Column 3) ---
         export_panel = ttk.Frame(self.master, padding="15 15 15 15")
@@ -400,6 +502,33 @@ class WallLineDetectorApp:
 
         row_idx_export = add_export_separator(row_idx_export)  # Use helper
 
+        # --- Wall clean-up applied to the walls sent / exported to Foundry (prepare_walls stages) ---
+        ttk.Label(export_panel, text="Wall Clean-up").grid(row=row_idx_export, column=0, columnspan=3, sticky="w")
+        row_idx_export += 1
+        self.dedup_walls_var = tk.BooleanVar(value=bool(DEFAULT_CLEANUP.get("dedup_tolerance")))
+        ttk.Checkbutton(export_panel, text="Drop Duplicate Walls", variable=self.dedup_walls_var).grid(
+            row=row_idx_export, column=0, columnspan=3, sticky="w")
+        row_idx_export += 1
+
+        self.cleanup_entries = {}
+        def add_cleanup_entry(key, label_text, default, current_row_idx, cast=float):
+            # Numeric clean-up setting, 0 = stage off
+            ttk.Label(export_panel, text=label_text).grid(row=current_row_idx, column=0, columnspan=2, sticky="w")
+            entry = ttk.Entry(export_panel, width=8)
+            entry.insert(0, str(default or 0))
+            entry.grid(row=current_row_idx, column=2, sticky="ew", pady=1)
+            self.cleanup_entries[key] = (entry, cast)
+            return current_row_idx + 1
+
+        row_idx_export = add_cleanup_entry("split_tolerance", "Split / Snap Tolerance (px)",
+                                           DEFAULT_CLEANUP.get("split_tolerance"), row_idx_export)
+        row_idx_export = add_cleanup_entry("fuse_tolerance", "Fuse Collinear Walls (px)",
+                                           DEFAULT_CLEANUP.get("fuse_tolerance"), row_idx_export)
+        row_idx_export = add_cleanup_entry("max_walls", "Max Walls (budget)",
+                                           DEFAULT_CLEANUP.get("max_walls"), row_idx_export, cast=int)
+
+        row_idx_export = add_export_separator(row_idx_export)  # Use helper
+
         # --- Change: Make Buttons span all 3 columns and use sticky="ew" ---
         self.create_wall_from_line_button = ttk.Button(export_panel, text="Send Walls (Lines)",
                                                        command=self.create_wall_from_line)
@@ -421,6 +550,7 @@ class WallLineDetectorApp:
     def handle_slider_change(self, slider_value, widget_name):
         """Called when a slider is moved."""
         self.update_value_display(widget_name)
+        if self._loading_controls: return # Sliders are being restored, nothing changed
         self.process_image_debounced()
 
     def handle_entry_change(self, event, widget_name):
@@ -501,35 +631,49 @@ class WallLineDetectorApp:
         self._debounce_timer = self.master.after(250, self.process_image) # 250ms delay
 
     # --- Core Processing ---
+    def get_detection_params(self):
+        """Reads the detection sliders and converts them to wall_detection parameter units."""
+        close_morph = int(round(float(self.slider_widgets['close_morph']['scale'].get())))
+        thresh1 = int(round(float(self.slider_widgets['canny1']['scale'].get())))
+        thresh2 = int(round(float(self.slider_widgets['canny2']['scale'].get())))
+        min_blob = int(round(float(self.slider_widgets['min_blob']['scale'].get())))
+        # Epsilon value is percentage * 10 on slider, so divide by 1000 (10 * 100)
+        epsilon_scale_val = float(self.slider_widgets['epsilon']['scale'].get())
+        epsilon_percent = epsilon_scale_val / 1000.0 # Convert slider val (0-1000) to percentage (0-1.0)
+
+        blur_factor = int(round(float(self.slider_widgets['blur']['scale'].get())))
+        kernel_size = max(1, 2 * blur_factor + 1) # Ensure odd kernel size > 0
+
+        morph_factor = int(round(float(self.slider_widgets['hat_morph']['scale'].get())))
+        morph_size = 2 * morph_factor + 1 if morph_factor > 0 else 0 # Morph size (0 if factor is 0)
+
+        min_area = int(round(float(self.slider_widgets['area']['scale'].get())))
+
+        do_merge_lines = self.merge_lines_var.get()
+        line_merge_thresh = round(float(self.slider_widgets['line_thresh']['scale'].get()))
+
+        do_merge_polygons = self.merge_polygons_var.get() and wall_detection.SHAPELY_AVAILABLE
+        poly_merge_thresh = 0
+        if wall_detection.SHAPELY_AVAILABLE: # Avoid error if disabled
+             poly_merge_thresh = round(float(self.slider_widgets['poly_thresh']['scale'].get()))
+
+        return wall_detection.make_params(
+            close_morph=close_morph, morph_size=morph_size, kernel_size=kernel_size,
+            canny1=thresh1, canny2=thresh2, min_component=min_blob, epsilon=epsilon_percent, min_area=min_area,
+            merge_lines=bool(do_merge_lines), line_thresh=line_merge_thresh,
+            merge_polygons=bool(do_merge_polygons), poly_thresh=poly_merge_thresh,
+            line_backend=self.line_backend_var.get())
+
     def process_image(self, event=None):
         self._debounce_timer = None
         if self.img is None: return
+        if not self.confirm_discard_edits():
+            self.select_edit_target() # Put the controls back on the kept walls' values
+            return
 
         # Retrieve parameters
         try:
-            close_morph = int(round(float(self.slider_widgets['close_morph']['scale'].get())))
-            thresh1 = int(round(float(self.slider_widgets['canny1']['scale'].get())))
-            thresh2 = int(round(float(self.slider_widgets['canny2']['scale'].get())))
-            # Epsilon value is percentage * 10 on slider, so divide by 1000 (10 * 100)
-            epsilon_scale_val = float(self.slider_widgets['epsilon']['scale'].get())
-            epsilon_percent = epsilon_scale_val / 1000.0 # Convert slider val (0-1000) to percentage (0-1.0)
-
-            blur_factor = int(round(float(self.slider_widgets['blur']['scale'].get())))
-            kernel_size = max(1, 2 * blur_factor + 1) # Ensure odd kernel size > 0
-
-            morph_factor = int(round(float(self.slider_widgets['hat_morph']['scale'].get())))
-            morph_size = 2 * morph_factor + 1 if morph_factor > 0 else 0 # Morph size (0 if factor is 0)
-
-            min_area = int(round(float(self.slider_widgets['area']['scale'].get())))
-
-            do_merge_lines = self.merge_lines_var.get()
-            line_merge_thresh = round(float(self.slider_widgets['line_thresh']['scale'].get()))
-
-            do_merge_polygons = self.merge_polygons_var.get() and SHAPELY_AVAILABLE
-            poly_merge_thresh = 0
-            if SHAPELY_AVAILABLE: # Avoid error if disabled
-                 poly_merge_thresh = round(float(self.slider_widgets['poly_thresh']['scale'].get()))
-
+            params = self.get_detection_params()
         except (ValueError, tk.TclError, KeyError) as e:
             print(f"Warning: Error getting slider value during processing: {e}")
             # Attempt to update displays even if params failed, might show old results
@@ -540,77 +684,286 @@ class WallLineDetectorApp:
 
         # --- Image Processing Core ---
         try:
-            if close_morph > 0:
-                structuring = cv2.getStructuringElement(cv2.MORPH_CROSS, (close_morph, close_morph))
-                strutuing_img = cv2.morphologyEx(self.img, cv2.MORPH_CLOSE, structuring)
+            if self.edit_target is None or self.base_detection is None:
+                # Global params changed: full-image run.
+                # Repeat runs on the same image + params are served from the on-disk cache
+                poly_list, line_list, edges, cache_hit = cached_detect_walls(
+                    self.img, params, cache=self.detection_cache, img_digest=self.img_digest, lsd=self.lsd,
+                    edge_stage=self.edge_stage, buffers=self.buffers)
+                if cache_hit:
+                    print("Detection results loaded from cache.")
+                self.base_detection = (poly_list, line_list, edges)
+                self.global_params = params
+                self.global_controls = self.get_control_values()
             else:
-                strutuing_img = self.img.copy()
-
-            if morph_size > 0:
-                M = cv2.getStructuringElement(cv2.MORPH_RECT, (9, 9))
-                hat = cv2.morphologyEx(strutuing_img, cv2.MORPH_TOPHAT, M)
-            else:
-                hat = strutuing_img.copy()
-
-
-            gray = cv2.cvtColor(hat, cv2.COLOR_BGR2GRAY)
-            blurred = cv2.GaussianBlur(gray, (kernel_size, kernel_size), 0)
-            edges = cv2.Canny(blurred, thresh1, thresh2)
-
-            edges_for_poly = edges.copy()
-
-
-            # *** Store the intermediate image for the processed view ***
-            self.intermediate_processed_img = edges_for_poly.copy()
-
-            # Polygon detection (using edges_for_poly)
-            contours_raw, _ = cv2.findContours(edges_for_poly, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            poly_list = []
-            for cnt in contours_raw:
-                if len(cnt) < 3: continue # Need at least 3 points for a polygon
-                perimeter = cv2.arcLength(cnt, True)
-                if perimeter <= 0: continue # Avoid division by zero for epsilon calc
-
-                # Calculate epsilon based on perimeter
-                epsilon = epsilon_percent * perimeter
-                approx = cv2.approxPolyDP(cnt, epsilon, True) # True for closed polygons
-
-                # Check area and validity AFTER approximation
-                if len(approx) >= 3 and cv2.contourArea(approx) > min_area:
-                     poly_list.append(approx)
-
-            if do_merge_polygons:
-                poly_list = self.merge_polygons(poly_list, poly_merge_thresh)
-            self.contours = poly_list
-
-            # Line detection (using the original 'edges' before morphology for potentially cleaner lines)
-            # Adjust LSD parameters if needed (e.g., _scale, _sigma_scale) - using defaults here
-            detected_lines = self.lsd.detect(edges) # Use 'edges' not 'edges_for_poly'
-            line_list = []
-            if detected_lines is not None and detected_lines[0] is not None:
-                min_line_length_sq = 5**2 # Filter very short lines (e.g., less than 5 pixels)
-                for dline in detected_lines[0]:
-                    x1, y1, x2, y2 = map(int, dline[0])
-                    if (x2-x1)**2 + (y2-y1)**2 >= min_line_length_sq:
-                        line_list.append((x1, y1, x2, y2))
+                # Region params changed: only that region is recomputed
+                index = self.edit_target
+                overrides = {k: v for k, v in params.items() if v != self.global_params[k]}
+                self.region_detector.set_overrides(index, overrides)
+                self.region_controls[index] = {k: v for k, v in self.get_control_values().items()
+                                               if v != self.global_controls.get(k)}
 
-            if do_merge_lines:
-                line_list = self.merge_lines(line_list, line_merge_thresh)
-            self.lines = line_list
-
-            # Update counts
-            self.poly_count_label.config(text=f"Polygons: {len(self.contours)}")
-            self.line_count_label.config(text=f"Lines: {len(self.lines)}")
-
-            # Update BOTH displays
-            self.update_display() # Updates the original + overlays canvas
-            self.display_intermediate_on_canvas(self.intermediate_processed_img) # Update the processed view canvas
+            self.compose_regions()
 
         except Exception as e:
             messagebox.showerror("Processing Error", f"An error occurred during image processing:\n{e}", parent=self.master)
             print(f"Processing error details: {e}") # Log detailed error
 
 
+    def compose_regions(self):
+        """Splices the region results into the last full-image result and refreshes the views."""
+        if self.base_detection is None: return
+        poly_list, line_list, edges = self.base_detection
+        if self.region_detector.regions:
+            # The base edge map is kept for the next region pass, paste regions into a pooled copy
+            base_edges = edges
+            edges = self.buffers.get("regions", base_edges.shape, base_edges.dtype)
+            np.copyto(edges, base_edges)
+            self.region_detector.lsd = self.lsd
+            poly_list, line_list, recomputed = self.region_detector.compose(
+                self.img, self.global_params, poly_list, line_list, edges)
+            if recomputed:
+                print(f"Recomputed {recomputed} region(s).")
+
+        # *** Store the intermediate image for the processed view ***
+        # (may be a pool buffer: it's only read until the next run overwrites it)
+        self.intermediate_processed_img = edges
+
+        self.contours = poly_list
+        self.lines = line_list
+
+        # New detection results replace the hand-edited walls (confirm_discard_edits asked first)
+        if self.wall_editor is not None:
+            self.reset_wall_editor()
+        if self.edit_tool_var.get() != "Off":
+            self.ensure_wall_editor(redraw=False) # Keep editing, now on the new walls
+
+        # Update counts
+        self.poly_count_label.config(text=f"Polygons: {len(self.contours)}")
+        self.line_count_label.config(text=f"Lines: {len(self.lines)}")
+
+        # Update BOTH displays
+        self.update_display() # Updates the original + overlays canvas
+        self.display_intermediate_on_canvas(self.intermediate_processed_img) # Update the processed view canvas
+
+    # --- Regions ---
+
+    def get_control_values(self):
+        """Raw values of the detection controls (sliders + merge checkboxes)."""
+        values = {name: float(w['scale'].get()) for name, w in self.slider_widgets.items()
+                  if name not in ('x_scale_factor', 'y_scale_factor')}
+        values['merge_lines'] = self.merge_lines_var.get()
+        values['merge_polygons'] = self.merge_polygons_var.get()
+        values['line_backend'] = self.line_backend_var.get()
+        return values
+
+    def set_control_values(self, values):
+        """Restores controls from get_control_values() without triggering processing."""
+        self._loading_controls = True
+        try:
+            for name, value in values.items():
+                if name == 'merge_lines': self.merge_lines_var.set(value)
+                elif name == 'merge_polygons': self.merge_polygons_var.set(value)
+                elif name == 'line_backend': self.line_backend_var.set(value)
+                elif name in self.slider_widgets:
+                    self.slider_widgets[name]['scale'].set(value)
+                    self.update_value_display(name)
+        finally:
+            self._loading_controls = False
+
+    def refresh_region_list(self):
+        names = ["Global"] + [f"Region {i + 1}" for i in range(len(self.region_detector.regions))]
+        self.roi_target_combo.config(values=names)
+        self.roi_target_combo.current(0 if self.edit_target is None else self.edit_target + 1)
+
+    def select_edit_target(self, event=None):
+        index = self.roi_target_combo.current()
+        self.edit_target = None if index <= 0 else index - 1
+        if self.global_controls is not None:
+            values = dict(self.global_controls)
+            if self.edit_target is not None:
+                values.update(self.region_controls[self.edit_target])
+            self.set_control_values(values)
+        self.update_display()
+
+    def add_region(self, rect):
+        if not self.confirm_discard_edits(): return
+        self.region_detector.add_region(rect)
+        self.region_controls.append({})
+        self.edit_target = len(self.region_detector.regions) - 1
+        self.refresh_region_list()
+        self.select_edit_target()
+        self.compose_regions()
+
+    def remove_region(self):
+        if self.edit_target is None:
+            messagebox.showinfo("Info", "Select a region to remove first.", parent=self.master)
+            return
+        if not self.confirm_discard_edits(): return
+        self.region_detector.remove_region(self.edit_target)
+        del self.region_controls[self.edit_target]
+        self.edit_target = None
+        self.refresh_region_list()
+        self.select_edit_target()
+        self.compose_regions()
+
+    def clear_regions(self):
+        self.region_detector.clear()
+        self.region_controls = []
+        self.base_detection = None
+        self.edit_target = None
+        self.refresh_region_list()
+
+    def canvas_to_image(self, x, y):
+        """Main canvas coordinates -> (resized) image pixel coordinates."""
+        view = self.canvas_views.get('tk_img')
+        if view is None: return None
+        x_pos, y_pos, sx, sy = view
+        return (x - x_pos) * sx, (y - y_pos) * sy
+
+    def on_canvas_press(self, event):
+        self.canvas.focus_set() # So the edit shortcuts reach the canvas
+        point = (self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+        if self.roi_draw_var.get():
+            if self.base_detection is None: return
+            self._roi_drag = point
+        elif self.edit_tool_var.get() != "Off" and self.ensure_wall_editor() is not None:
+            self._edit_drag = point
+
+    def on_canvas_drag(self, event):
+        x, y = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
+        if self._edit_drag is not None:
+            self.canvas.delete("edit_drag")
+            x0, y0 = self._edit_drag
+            tool = self.edit_tool_var.get()
+            if tool == "Draw":
+                self.canvas.create_line(x0, y0, x, y, fill=COLOR_LINE, width=2, tags="edit_drag")
+            elif tool in ("Select", "Delete"):
+                self.canvas.create_rectangle(x0, y0, x, y, outline=COLOR_SELECTED, dash=(4, 2), tags="edit_drag")
+            return
+        if self._roi_drag is None: return
+        self.canvas.delete("roi_drag")
+        x0, y0 = self._roi_drag
+        self.canvas.create_rectangle(x0, y0, x, y, outline=COLOR_ROI, dash=(4, 2), width=2, tags="roi_drag")
+
+    def on_canvas_release(self, event):
+        if self._edit_drag is not None:
+            self.finish_wall_edit(event)
+            return
+        if self._roi_drag is None: return
+        self.canvas.delete("roi_drag")
+        start = self.canvas_to_image(*self._roi_drag)
+        end = self.canvas_to_image(self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+        self._roi_drag = None
+        if start is None or end is None: return
+        x0, y0, x1, y1 = roi_detection.clip_rect((start[0], start[1], end[0], end[1]), self.img.shape)
+        if x1 - x0 < 4 or y1 - y0 < 4: return # Too small, probably just a click
+        self.add_region((x0, y0, x1, y1))
+
+    # --- Wall Editing ---
+
+    def select_edit_tool(self, event=None):
+        if self.edit_tool_var.get() == "Off": return
+        self.roi_draw_var.set(False) # Canvas drags edit walls now, not regions
+        if self.ensure_wall_editor() is None:
+            print("Warning: detect walls before editing them.")
+
+    def ensure_wall_editor(self, redraw=True):
+        """Editable copy of the current walls, created the first time an edit tool is used."""
+        if self.wall_editor is None and self.base_detection is not None:
+            # Same walls as an unedited export, so editing doesn't change the wall count
+            self.wall_editor = WallEditor.from_walls(self.contours, self.lines, min_distance=MIN_DISTANCE,
+                                                     scale=self.export_scale())
+            self.wall_selection = np.empty(0, dtype=np.int64)
+            self.update_edit_status()
+            if redraw:
+                self.update_display() # Overlay switches to the editable walls
+        return self.wall_editor
+
+    def confirm_discard_edits(self):
+        """True if the walls may be re-detected; asks first when they were edited by hand."""
+        if self.wall_editor is None or not self.wall_editor.edited:
+            return True
+        return messagebox.askyesno(
+            "Discard Wall Edits",
+            f"Re-detecting replaces the walls and discards {len(self.wall_editor.undo_stack)} hand edit(s).\nContinue?",
+            parent=self.master)
+
+    def reset_wall_editor(self):
+        self.wall_editor = None
+        self.wall_selection = np.empty(0, dtype=np.int64)
+        self._edit_drag = None
+        self.update_edit_status()
+
+    def update_edit_status(self):
+        editor = self.wall_editor
+        if editor is None:
+            self.edit_status_label.config(text="Not editing")
+        else:
+            self.edit_status_label.config(text=f"Walls: {len(editor)}, selected: {len(self.wall_selection)}, "
+                                               f"edits: {len(editor.undo_stack)}")
+        self.undo_button.config(state=tk.NORMAL if editor is not None and editor.undo_stack else tk.DISABLED)
+        self.redo_button.config(state=tk.NORMAL if editor is not None and editor.redo_stack else tk.DISABLED)
+
+    def finish_wall_edit(self, event):
+        """Applies the current tool to the click / drag that just ended."""
+        self.canvas.delete("edit_drag")
+        start_canvas = self._edit_drag
+        end_canvas = (self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+        self._edit_drag = None
+        start, end = self.canvas_to_image(*start_canvas), self.canvas_to_image(*end_canvas)
+        editor = self.wall_editor
+        if start is None or end is None or editor is None: return
+        # Pick distances are in screen pixels, whatever the zoom
+        _, _, sx, sy = self.canvas_views['tk_img']
+        zoom = max(sx, sy)
+        click = math.hypot(end_canvas[0] - start_canvas[0], end_canvas[1] - start_canvas[1]) < 4
+        tool = self.edit_tool_var.get()
+        if tool == "Draw":
+            if click: return
+            h, w = self.img.shape[:2]
+            (x0, y0), (x1, y1) = (editor.snap(min(max(x, 0), w - 1), min(max(y, 0), h - 1), SNAP_RADIUS * zoom)
+                                  for x, y in (start, end))
+            self.apply_wall_edit(editor.add([(x0, y0, x1, y1)]))
+        elif tool == "Split":
+            self.apply_wall_edit(editor.split(editor.nearest(*end, PICK_RADIUS * zoom), *end))
+        else:
+            if click:
+                wall = editor.nearest(*end, PICK_RADIUS * zoom)
+                ids = [] if wall is None else [wall]
+            else:
+                ids = editor.ids_in_rect(start[0], start[1], end[0], end[1])
+            if tool == "Delete":
+                self.apply_wall_edit(editor.delete(ids))
+            else:
+                self.set_wall_selection(ids, add=bool(event.state & 0x0001)) # Shift adds to the selection
+
+    def set_wall_selection(self, ids, add=False):
+        ids = np.asarray(ids, dtype=np.int64)
+        previous = self.wall_selection
+        self.wall_selection = np.union1d(previous, ids) if add else np.unique(ids)
+        self.redraw_walls(np.setxor1d(previous, self.wall_selection)) # Only walls whose highlight changed
+        self.update_edit_status()
+
+    def apply_wall_edit(self, edit):
+        """Shows an edit (or undo / redo) by redrawing just the walls it touched."""
+        if edit is None: return
+        self.wall_selection = self.wall_selection[self.wall_editor.alive[self.wall_selection]]
+        self.redraw_walls(np.concatenate([edit.removed, edit.added]))
+        self.update_edit_status()
+
+    def delete_selected_walls(self):
+        if self.wall_editor is not None:
+            self.apply_wall_edit(self.wall_editor.delete(self.wall_selection))
+
+    def undo_wall_edit(self):
+        if self.wall_editor is not None:
+            self.apply_wall_edit(self.wall_editor.undo())
+
+    def redo_wall_edit(self):
+        if self.wall_editor is not None:
+            self.apply_wall_edit(self.wall_editor.redo())
+
     # --- Methods (Load, Clear, Resize, Merge, Display, Save, Export) ---
 
     def load_image(self):
@@ -638,6 +991,10 @@ class WallLineDetectorApp:
                  print("Warning: Could not accurately determine canvas size, using default 400x400.")
 
             self.img = self.resize_image(img_bgr, int(canvas_max_width), int(canvas_max_height))
+            del img_bgr # Don't keep the full-size decode alive through the first detection
+            self.img_digest = image_digest(self.img)
+            self.edge_stage.invalidate()
+            self.clear_regions()
             h, w = self.img.shape[:2]
             print(f"Original image: {self.original_image_dims[0]}x{self.original_image_dims[1]}")
             print(f"Resized image to: {w}x{h} for display.")
@@ -659,6 +1016,7 @@ class WallLineDetectorApp:
         except Exception as e:
             messagebox.showerror("Error Loading Image", f"Failed to load image:\n{e}", parent=self.master)
             self.img = None
+            self.img_digest = None
             self.original_image_dims = (0, 0)
             self.clear_canvas()
 
@@ -699,6 +1057,7 @@ class WallLineDetectorApp:
         self.lines = []
         self.poly_count_label.config(text="Polygons: 0")
         self.line_count_label.config(text="Lines: 0")
+        self.reset_wall_editor()
 
     def resize_image(self, img, max_width, max_height):
         """Resizes image to fit within max dimensions, preserving aspect ratio. Does not scale up."""
@@ -716,140 +1075,12 @@ class WallLineDetectorApp:
             img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
         return img
 
-    # --- Merge Logic (merge_lines, merge_polygons) - Keep as is ---
-    # (merge_lines and merge_polygons methods remain unchanged)
+    # --- Merge Logic (merge_lines, merge_polygons) - see wall_detection ---
     def merge_lines(self, lines, threshold):
-        n = len(lines); parent = list(range(n))
-        if n <= 1: return lines
-        def find(i):
-            if parent[i] == i: return i
-            parent[i] = find(parent[i]); return parent[i]
-        def union(i, j):
-            root_i, root_j = find(i), find(j)
-            if root_i != root_j: parent[root_j] = root_i
-        endpoints = []; threshold_sq = threshold * threshold
-        for i, (x1, y1, x2, y2) in enumerate(lines):
-            endpoints.extend([(x1, y1, i), (x2, y2, i)])
-        global KDTREE_AVAILABLE # Allow modification
-        if KDTREE_AVAILABLE:
-            try:
-                pts = np.array([(pt[0], pt[1]) for pt in endpoints])
-                if len(pts) < 2: return lines # KDTree needs at least 2 points
-                tree = KDTree(pts); pairs = tree.query_pairs(r=threshold)
-                for i, j in pairs:
-                    li, lj = endpoints[i][2], endpoints[j][2]
-                    if li != lj: union(li, lj)
-            except Exception as e: print(f"KDTree error: {e}. Fallback."); KDTREE_AVAILABLE = False
-        # Fallback or if KDTree is not available
-        if not KDTREE_AVAILABLE:
-            for i in range(len(endpoints)):
-                x1, y1, li = endpoints[i]
-                for j in range(i + 1, len(endpoints)):
-                    x2, y2, lj = endpoints[j]
-                    if li != lj and ((x1 - x2)**2 + (y1 - y2)**2 < threshold_sq): union(li, lj)
-        # Group lines and find representative line for each group
-        groups = {}; merged_lines = []
-        for i in range(n): groups.setdefault(find(i), []).append(i)
-        for group_indices in groups.values():
-            if not group_indices: continue
-            group_points = []
-            for idx in group_indices: group_points.extend([(lines[idx][0], lines[idx][1]), (lines[idx][2], lines[idx][3])])
-            if not group_points: continue
-            max_dist_sq = -1; best_pair = (group_points[0], group_points[0])
-            # Use convex hull to find the most distant points in the group as the new line ends
-            if len(group_points) > 1:
-                hull_points = cv2.convexHull(np.array(group_points, dtype=np.float32))
-                if hull_points is not None and len(hull_points) > 1:
-                     # Ensure hull_points is a list of points [[x,y], [x,y], ...]
-                     hull_pts_list = hull_points.squeeze().tolist()
-                     if isinstance(hull_pts_list[0], (int, float)): # Handle single point hull case
-                        pts_to_check = [hull_pts_list] if len(hull_pts_list) == 2 else []
-                     elif isinstance(hull_pts_list[0], list):
-                         pts_to_check = hull_pts_list
-                     else: pts_to_check = [] # Unexpected format
-
-                     for i in range(len(pts_to_check)):
-                         for j in range(i + 1, len(pts_to_check)):
-                             p1, p2 = pts_to_check[i], pts_to_check[j]
-                             dist_sq = (p1[0] - p2[0])**2 + (p1[1] - p2[1])**2
-                             if dist_sq > max_dist_sq: max_dist_sq = dist_sq; best_pair = (tuple(p1), tuple(p2))
-                else: # Fallback if convex hull fails (e.g., collinear points)
-                     for i in range(len(group_points)):
-                         for j in range(i + 1, len(group_points)):
-                             p1, p2 = group_points[i], group_points[j]
-                             dist_sq = (p1[0] - p2[0])**2 + (p1[1] - p2[1])**2
-                             if dist_sq > max_dist_sq: max_dist_sq = dist_sq; best_pair = (p1, p2)
-
-            merged_line = tuple(map(int, best_pair[0])) + tuple(map(int, best_pair[1]))
-            # Ensure line has non-zero length after merging/rounding
-            if merged_line[0] != merged_line[2] or merged_line[1] != merged_line[3]:
-                merged_lines.append(merged_line)
-        return merged_lines
+        return wall_detection.merge_lines(lines, threshold)
 
     def merge_polygons(self, polygons, threshold):
-        if not SHAPELY_AVAILABLE or len(polygons) <= 1: return polygons
-        shapely_polys = []
-        for poly_np in polygons:
-             pts = poly_np.squeeze()
-             if pts.ndim == 2 and pts.shape[0] >= 3: # Check shape before creating Polygon
-                 try:
-                     p = Polygon(pts)
-                     if not p.is_valid: p = p.buffer(0) # Attempt to fix invalid polygon
-                     if p.is_valid and not p.is_empty: shapely_polys.append(p)
-                 except Exception as e: print(f"Shapely poly creation error: {e} for points {pts}"); continue
-             # else: print(f"Skipping invalid polygon shape: ndim={pts.ndim}, shape={pts.shape}") # Debugging
-        if not shapely_polys: return []
-        try:
-            # Buffer polygons outward
-            buffered = [p.buffer(threshold, join_style=2) for p in shapely_polys if p.is_valid] # Use LINESTRING join style
-            if not buffered: return []
-
-            # Merge overlapping buffered polygons
-            merged_buffered = unary_union(buffered)
-            if merged_buffered.is_empty: return []
-
-            final_polys_shapely = []
-            geoms_to_process = []
-            # Handle different geometry types resulting from union
-            if merged_buffered.geom_type == 'Polygon': geoms_to_process = [merged_buffered]
-            elif merged_buffered.geom_type == 'MultiPolygon': geoms_to_process = list(merged_buffered.geoms)
-            elif merged_buffered.geom_type == 'GeometryCollection':
-                # Extract only Polygons or MultiPolygons from the collection
-                geoms_to_process = [g for g in merged_buffered.geoms if g.geom_type in ('Polygon', 'MultiPolygon')]
-            # else: print(f"Unexpected geometry type after union: {merged_buffered.geom_type}") # Debugging
-
-            # Buffer inward and collect final valid polygons
-            for geom in geoms_to_process:
-                 # Debuffer (buffer inward)
-                 debuffered = geom.buffer(-threshold, join_style=2)
-                 if debuffered.is_empty: continue
-
-                 if debuffered.geom_type == 'Polygon':
-                     if debuffered.is_valid and not debuffered.is_empty:
-                         final_polys_shapely.append(debuffered)
-                 elif debuffered.geom_type == 'MultiPolygon':
-                      # Add valid polygons from the multipolygon
-                     final_polys_shapely.extend(p for p in debuffered.geoms if p.geom_type == 'Polygon' and p.is_valid and not p.is_empty)
-                 # else: print(f"Unexpected geometry type after debuffer: {debuffered.geom_type}") # Debugging
-
-
-            merged_contours_np = []
-            min_final_area = 1.0 # Minimum area for a polygon to be kept after merging/debuffering
-            for p in final_polys_shapely:
-                if p.is_valid and not p.is_empty and p.geom_type == 'Polygon' and p.area > min_final_area:
-                    # Get exterior coordinates, convert to int32, reshape for OpenCV
-                    coords = np.array(p.exterior.coords, dtype=np.int32)
-                    # Ensure we have enough points and correct shape
-                    if len(coords) >= 4: # Need at least 3 points + closing point from shapely
-                       # Reshape to OpenCV contour format: (N, 1, 2)
-                       # Exclude the last point (duplicate of the first) from shapely
-                       merged_contours_np.append(coords[:-1].reshape((-1, 1, 2)))
-                    # else: print(f"Skipping polygon with < 4 coords after merge: {len(coords)}") # Debugging
-            return merged_contours_np
-
-        except Exception as e:
-            print(f"Shapely merge/buffer error: {e}");
-            return polygons # Return original polygons on error
+        return wall_detection.merge_polygons(polygons, threshold)
     # --- End Merge Logic ---
 
     def update_display(self):
@@ -858,10 +1089,16 @@ class WallLineDetectorApp:
             self.clear_canvas() # Clear canvases if no image is loaded
             return
 
-        display_img = self.img.copy() # Start with the original resized image
+        # Start with the original resized image, drawn into a reused buffer
+        display_img = self.buffers.get('display', self.img.shape, self.img.dtype)
+        np.copyto(display_img, self.img)
+
+        if self.wall_editor is not None:
+            # Hand-edited walls replace the detected polygons / lines (regions are drawn with them)
+            self.paint_wall_tiles(display_img)
 
         # Draw Polygons if requested
-        if self.show_polygons_var.get() and self.contours:
+        elif self.show_polygons_var.get() and self.contours:
             try:
                 # Convert hex color string to BGR tuple for OpenCV
                 poly_color_rgb = tuple(int(COLOR_POLYGON.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))
@@ -871,7 +1108,7 @@ class WallLineDetectorApp:
                 print(f"Error drawing polygons: {e}")
 
         # Draw Lines if requested
-        if self.show_lines_var.get() and self.lines:
+        if self.wall_editor is None and self.show_lines_var.get() and self.lines:
             try:
                 line_color_rgb = tuple(int(COLOR_LINE.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))
                 line_color_bgr = line_color_rgb[::-1]
@@ -880,9 +1117,97 @@ class WallLineDetectorApp:
             except Exception as e:
                 print(f"Error drawing lines: {e}")
 
+        if self.wall_editor is None:
+            self.draw_regions(display_img)
+
         self.processed_img = display_img # Store the image with overlays
         self.display_image_on_canvas(display_img, self.canvas, 'tk_img') # Display on the main canvas
 
+    def draw_regions(self, img, offset=(0, 0)):
+        """Draws the detection regions, the one being edited thicker. offset: image position of img's top-left pixel."""
+        if not self.region_detector.regions: return
+        roi_color_bgr = tuple(int(COLOR_ROI.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))[::-1]
+        ox, oy = offset
+        for i, region in enumerate(self.region_detector.regions):
+            x0, y0, x1, y1 = region.rect
+            cv2.rectangle(img, (x0 - ox, y0 - oy), (x1 - 1 - ox, y1 - 1 - oy), roi_color_bgr,
+                          3 if i == self.edit_target else 1)
+
+    def draw_edited_walls(self, img, rect):
+        """Draws the editor's walls crossing rect = (x0, y0, x1, y1) into img, a view of that area.
+
+        Only the walls found through the editor's grid are drawn, selected ones highlighted.
+        """
+        editor = self.wall_editor
+        x0, y0, x1, y1 = rect
+        pad = 2 # Line thickness
+        ids = editor.ids_in_rect(x0 - pad, y0 - pad, x1 + pad, y1 + pad)
+        selected = np.isin(ids, self.wall_selection)
+        for subset, color in ((ids[~selected], COLOR_LINE), (ids[selected], COLOR_SELECTED)):
+            if not len(subset): continue
+            color_bgr = tuple(int(color.lstrip('#')[i:i+2], 16) for i in (0, 2, 4))[::-1]
+            pts = np.rint(editor.segments_by_id(subset) - [x0, y0, x0, y0]).astype(np.int32).reshape(-1, 2, 2)
+            cv2.polylines(img, list(pts), False, color_bgr, 2)
+
+    def paint_wall_tiles(self, img, rect=None):
+        """Repaints the WALL_TILE tiles of img covering rect (default: all): image, edited walls, regions.
+
+        OpenCV rasterizes a clipped line a little differently than the whole line,
+        so the overlay is always drawn tile by tile: a tile repainted after an edit
+        comes out exactly as in a full redraw.
+        """
+        h, w = self.img.shape[:2]
+        x0, y0, x1, y1 = rect or (0, 0, w, h)
+        show_walls = self.show_polygons_var.get() or self.show_lines_var.get()
+        for ty in range(y0 // WALL_TILE * WALL_TILE, y1, WALL_TILE):
+            for tx in range(x0 // WALL_TILE * WALL_TILE, x1, WALL_TILE):
+                tx1, ty1 = min(w, tx + WALL_TILE), min(h, ty + WALL_TILE)
+                tile = img[ty:ty1, tx:tx1]
+                np.copyto(tile, self.img[ty:ty1, tx:tx1])
+                if show_walls:
+                    self.draw_edited_walls(tile, (tx, ty, tx1, ty1))
+                self.draw_regions(tile, (tx, ty))
+
+    def redraw_walls(self, ids):
+        """Incremental overlay update: repaints only the tiles covered by the given walls."""
+        if self.processed_img is None or self.wall_editor is None: return
+        bounds = self.wall_editor.bounds(ids)
+        if bounds is None: return
+        h, w = self.img.shape[:2]
+        pad = 3 # Line thickness + rounding
+        x0, y0 = max(0, int(bounds[0]) - pad), max(0, int(bounds[1]) - pad)
+        x1, y1 = min(w, int(math.ceil(bounds[2])) + pad + 1), min(h, int(math.ceil(bounds[3])) + pad + 1)
+        if x0 >= x1 or y0 >= y1: return
+        self.paint_wall_tiles(self.processed_img, (x0, y0, x1, y1))
+        self.refresh_canvas_region((x0, y0, x1, y1)) # The rest of the tiles came out unchanged
+
+    def refresh_canvas_region(self, rect):
+        """Updates the part of the main canvas image showing rect of self.processed_img.
+
+        The shown image is a resized copy, so the matching canvas pixels (grown by
+        the LANCZOS filter reach) are resampled from a crop and copied into the
+        existing photo image in place.
+        """
+        view = self.canvas_views.get('tk_img')
+        if view is None or self.tk_img is None: return
+        _, _, sx, sy = view
+        h, w = self.processed_img.shape[:2]
+        new_w, new_h = self.tk_img.width(), self.tk_img.height()
+        resized = (new_w, new_h) != (w, h)
+        reach = 3 * max(sx, sy, 1.0) if resized else 0 # LANCZOS support, in image pixels
+        x0, y0, x1, y1 = rect
+        u0, v0 = max(0, int((x0 - reach) / sx)), max(0, int((y0 - reach) / sy))
+        u1, v1 = min(new_w, int(math.ceil((x1 + reach) / sx))), min(new_h, int(math.ceil((y1 + reach) / sy)))
+        if u0 >= u1 or v0 >= v1: return
+        cx0, cy0 = max(0, int(u0 * sx - reach)), max(0, int(v0 * sy - reach))
+        cx1, cy1 = min(w, int(math.ceil(u1 * sx + reach))), min(h, int(math.ceil(v1 * sy + reach)))
+        patch = PILImage.fromarray(cv2.cvtColor(self.processed_img[cy0:cy1, cx0:cx1], cv2.COLOR_BGR2RGB))
+        if resized:
+            patch = patch.resize((u1 - u0, v1 - v0), PILImage.Resampling.LANCZOS,
+                                 box=(u0 * sx - cx0, v0 * sy - cy0, u1 * sx - cx0, v1 * sy - cy0))
+        tk_patch = ImageTk.PhotoImage(image=patch)
+        self.canvas.tk.call(str(self.tk_img), "copy", str(tk_patch), "-to", u0, v0)
+
 
     def display_image_on_canvas(self, img_to_display, target_canvas, tk_image_attr_name):
         """Displays the given BGR or Grayscale image on the specified canvas, storing the TkImage."""
@@ -941,6 +1266,8 @@ class WallLineDetectorApp:
             x_pos = (target_canvas.winfo_reqwidth() - new_w) // 2 # Use reqwidth for centering
             y_pos = (target_canvas.winfo_reqheight() - new_h) // 2 # Use reqheight
             target_canvas.create_image(x_pos, y_pos, anchor=tk.NW, image=tk_image)
+            # Remember where the image landed so canvas clicks can be mapped back to pixels
+            self.canvas_views[tk_image_attr_name] = (x_pos, y_pos, im_pil.width / new_w, im_pil.height / new_h)
             # Update the canvas configuration to reflect the image size it's showing
             # target_canvas.config(width=new_w, height=new_h) # This might fight the grid layout, maybe remove
 
@@ -1008,6 +1335,9 @@ class WallLineDetectorApp:
              messagebox.showerror("Error", f"Invalid scale factor setting: {e}", parent=self.master)
              return None
 
+        cleanup = self.get_cleanup_settings()
+        if cleanup is None: return None
+
         return {
             "cookie_id": cookie_id,
             "map_name": map_name,
@@ -1018,14 +1348,31 @@ class WallLineDetectorApp:
             "original_height": self.original_image_dims[1],
             "resized_width": self.img.shape[1],
             "resized_height": self.img.shape[0],
+            "cleanup": cleanup,
         }
 
+    def get_cleanup_settings(self):
+        """prepare_walls() clean-up settings from the export panel, or None (after an error box) if invalid."""
+        cleanup = {}
+        if self.dedup_walls_var.get():
+            cleanup["dedup_tolerance"] = DEFAULT_CLEANUP.get("dedup_tolerance") or 1.0
+        for key, (entry, cast) in self.cleanup_entries.items():
+            try:
+                value = cast(entry.get() or 0)
+                if not value >= 0: raise ValueError("must be 0 or more")
+            except ValueError as e:
+                messagebox.showerror("Error", f"Invalid clean-up setting '{entry.get()}': {e}", parent=self.master)
+                return None
+            if value > 0:
+                cleanup[key] = value
+        return cleanup
+
 
     def create_wall_from_line(self):
         params = self._get_export_params()
         if not params: return
 
-        if not self.lines:
+        if not self.lines and not (self.wall_editor is not None and self.wall_editor.edited):
              messagebox.showwarning("Warning", "No lines detected to send.", parent=self.master)
              return
 
@@ -1039,7 +1386,7 @@ class WallLineDetectorApp:
         try:
             # Pass scaling factors to send_token
             send_token(params['cookie_id'], params['image_path'], data, params['map_name'],
-                       params['x_scale'], params['y_scale'])
+                       params['x_scale'], params['y_scale'], cleanup=params['cleanup'])
             messagebox.showinfo("Sent", f"Line data sent for map '{params['map_name']}'. Check Foundry VTT.", parent=self.master)
         except Exception as e:
              messagebox.showerror("Send Error", f"Failed to send line data:\n{e}", parent=self.master)
@@ -1049,12 +1396,12 @@ class WallLineDetectorApp:
         params = self._get_export_params()
         if not params: return
 
-        if not self.contours:
+        if not self.contours and not (self.wall_editor is not None and self.wall_editor.edited):
              messagebox.showwarning("Warning", "No polygons detected to send.", parent=self.master)
              return
 
-        warnings, data = self._export_data(True, False) # Only export polygons
-        if not data.get("polygons"):
+        warnings, data = self._export_data(True, False) # Only export polygons (edited walls come as lines)
+        if not (data.get("polygons") or data.get("lines")):
              messagebox.showerror("Error", "Failed to format polygon data for sending.", parent=self.master)
              return
 
@@ -1062,17 +1409,14 @@ class WallLineDetectorApp:
         try:
              # Pass scaling factors to send_token (even if polygons dont use them directly, API might)
             send_token(params['cookie_id'], params['image_path'], data, params['map_name'],
-                       params['x_scale'], params['y_scale'])
+                       params['x_scale'], params['y_scale'], cleanup=params['cleanup'])
             messagebox.showinfo("Sent", f"Polygon data sent for map '{params['map_name']}'. Check Foundry VTT.", parent=self.master)
         except Exception as e:
              messagebox.showerror("Send Error", f"Failed to send polygon data:\n{e}", parent=self.master)
 
 
-    def _export_data(self, save_polygons=True, save_lines=True):
-        """Prepares polygon and line data for export, converting coordinates if necessary."""
-        data = {}; warnings = []
-
-        # Calculate scaling factors needed to convert resized coordinates back to original
+    def export_scale(self):
+        """Scaling factors that convert resized image coordinates back to the original image."""
         resize_scale_x = 1.0
         resize_scale_y = 1.0
         if self.img is not None and self.original_image_dims[0] > 0 and self.original_image_dims[1] > 0:
@@ -1080,6 +1424,24 @@ class WallLineDetectorApp:
              resized_height = self.img.shape[0]
              if resized_width > 0: resize_scale_x = self.original_image_dims[0] / resized_width
              if resized_height > 0: resize_scale_y = self.original_image_dims[1] / resized_height
+        return resize_scale_x, resize_scale_y
+
+    def _export_data(self, save_polygons=True, save_lines=True):
+        """Prepares polygon and line data for export, converting coordinates if necessary."""
+        data = {}; warnings = []
+        resize_scale_x, resize_scale_y = self.export_scale()
+
+        if self.wall_editor is not None and self.wall_editor.edited:
+            # Hand-edited walls are plain segments: they go out as lines, whichever export was asked for
+            scale = np.array([resize_scale_x, resize_scale_y] * 2)
+            data["lines"] = [tuple(s) for s in np.rint(self.wall_editor.segments() * scale).astype(int).tolist()]
+            if save_polygons:
+                data["polygons"] = []
+                if not save_lines:
+                    warnings.append("Walls were edited by hand, they are exported as lines.")
+            if not data["lines"]:
+                warnings.append("Line export: All walls were deleted.")
+            return warnings, data
 
         # Prepare Polygon Data (scaled back to original image coordinates)
         if save_polygons:
@@ -1177,18 +1539,56 @@ class WallLineDetectorApp:
         path = filedialog.asksaveasfilename(
             initialfile=default_name,
             defaultextension=".json",
-            filetypes=[("JSON", "*.json")],
+            filetypes=[("JSON", "*.json"), ("Compact binary", "*" + wall_io.BINARY_EXT)],
             title="Save Wall Data (JSON)",
             parent=self.master
         )
         if path:
             try:
-                with open(path, "w") as f:
-                    json.dump(final_export_data, f, indent=4) # Use the data with metadata
+                # Streamed JSON, or packed int32 for a .fvw extension
+                wall_io.save_walls(path, final_export_data["walls"], final_export_data["metadata"])
                 messagebox.showinfo("Saved", f"Wall data saved successfully to\n{path}", parent=self.master)
             except Exception as e:
                 messagebox.showerror("Error Saving JSON", f"Could not save JSON data:\n{e}", parent=self.master)
 
+    def export_foundry_scene(self):
+        """Exports polygons and lines as a new Foundry Scene document (imported in one go with "Import Data")."""
+        if not self.filepath or self.img is None:
+            messagebox.showerror("Error", "Please load an image first.", parent=self.master)
+            return
+        warnings, data = self._export_data(True, True)
+        if warnings:
+            messagebox.showwarning("Export Warning", "\n".join(warnings), parent=self.master)
+        if not (data.get("polygons") or data.get("lines")):
+            messagebox.showinfo("Info", "Nothing to export.", parent=self.master)
+            return
+        try:
+            # Same scale sliders as the live "Send Walls" path
+            x_scale = float(self.slider_widgets['x_scale_factor']['scale'].get()) / 1000.0
+            y_scale = float(self.slider_widgets['y_scale_factor']['scale'].get()) / 1000.0
+        except (KeyError, ValueError, tk.TclError) as e:
+            messagebox.showerror("Error", f"Invalid scale factor setting: {e}", parent=self.master)
+            return
+        cleanup = self.get_cleanup_settings()
+        if cleanup is None: return
+
+        base, _ = os.path.splitext(os.path.basename(self.filepath))
+        path = filedialog.asksaveasfilename(
+            initialfile=f"{base}_scene.json",
+            defaultextension=".json",
+            filetypes=[("JSON", "*.json")],
+            title="Save Foundry Scene (JSON)",
+            parent=self.master
+        )
+        if not path: return
+        try:
+            count = scene_export.export_scene(data, self.filepath, path, name=self.map_name_entry.get() or base,
+                                              scale_x=x_scale, scale_y=y_scale, **cleanup)
+            messagebox.showinfo("Saved", f"Scene with {count} walls saved to\n{path}\n\n"
+                                "In Foundry, create a scene and use \"Import Data\" on it.", parent=self.master)
+        except Exception as e:
+            messagebox.showerror("Error Saving Scene", f"Could not save the scene:\n{e}", parent=self.master)
+
 # --- Main Execution ---
 if __name__ == "__main__":
     root = tk.Tk()
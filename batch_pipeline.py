@@ -0,0 +1,304 @@
+import argparse
+import glob
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import wall_detection
+import wall_io
+from core_budget import available_cores, opencv_threads, plan_parallelism, threads_per_worker
+from detection_service import fit_image, spec_from_query
+from watch_folder import IMAGE_EXTS
+
+# Batch detection as a pipeline of stages connected by bounded queues:
+#
+#   load (read + decode) -> detect -> merge -> write
+#
+# Every stage has its own worker threads, so disk I/O, decoding, detection and
+# serialization of different maps overlap. OpenCV releases the GIL in imread /
+# imdecode and the detection kernels, so threads are enough for the heavy stages
+# (same reasoning as param_sweep). Bounded queues keep at most
+# queue_size + workers maps in flight per stage.
+
+QUEUE_SIZE = 4
+
+_DONE = object() # End-of-stream marker passed down the queues
+
+
+class Stage:
+    def __init__(self, name, fn, workers=1, queue_size=QUEUE_SIZE):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.items = 0
+        self.errors = 0
+        self.busy = 0.0    # Seconds spent in fn, summed over workers
+        self.starved = 0.0 # Seconds waiting for input
+        self.blocked = 0.0 # Seconds waiting for room in the next queue
+
+    def report(self, elapsed):
+        capacity = elapsed * self.workers
+        return {"stage": self.name, "workers": self.workers, "items": self.items, "errors": self.errors,
+                "busy": self.busy, "utilization": self.busy / capacity if capacity > 0 else 0.0,
+                "starved": self.starved, "blocked": self.blocked}
+
+
+class Item:
+    """One map travelling through the pipeline. Stages read and add fields; error stops processing."""
+
+    def __init__(self, path):
+        self.path = path
+        self.error = None
+        self.data = {}
+
+
+class Pipeline:
+    """Runs items through the stages, each stage on its own thread pool.
+
+    Items come out in completion order. A stage that raises marks the item as
+    failed and later stages pass it through untouched.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.elapsed = 0.0
+
+    def _worker(self, stage, inbox, outbox, remaining):
+        while True:
+            start = time.perf_counter()
+            item = inbox.get()
+            waited = time.perf_counter() - start
+            if item is _DONE:
+                inbox.put(_DONE) # Let the other workers of this stage see it too
+                with stage.lock:
+                    stage.starved += waited
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    outbox.put(_DONE)
+                return
+            start = time.perf_counter()
+            processed = item.error is None
+            failed = False
+            if processed:
+                try:
+                    stage.fn(item)
+                except Exception as e:
+                    item.error = f"{stage.name}: {type(e).__name__}: {e}"
+                    failed = True
+            busy = time.perf_counter() - start
+            start = time.perf_counter()
+            outbox.put(item)
+            blocked = time.perf_counter() - start
+            with stage.lock:
+                stage.items += processed
+                stage.errors += failed
+                stage.busy += busy
+                stage.starved += waited
+                stage.blocked += blocked
+
+    def run(self, items):
+        """Generator yielding every Item once it has passed the last stage."""
+        queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        results = queue.Queue() # Drained by the caller, unbounded
+        threads = []
+        for i, stage in enumerate(self.stages):
+            outbox = queues[i + 1] if i + 1 < len(self.stages) else results
+            remaining = [stage.workers]
+            for _ in range(stage.workers):
+                t = threading.Thread(target=self._worker, args=(stage, queues[i], outbox, remaining), daemon=True)
+                t.start()
+                threads.append(t)
+
+        def feed():
+            for item in items:
+                queues[0].put(item)
+            queues[0].put(_DONE)
+
+        start = time.perf_counter()
+        threading.Thread(target=feed, daemon=True).start()
+        while True:
+            item = results.get()
+            if item is _DONE: break
+            yield item
+        for t in threads:
+            t.join()
+        self.elapsed = time.perf_counter() - start
+
+    def report(self):
+        return [stage.report(self.elapsed) for stage in self.stages]
+
+
+# --- Map batch stages ---
+
+def output_path(path, out_dir, ext=".json", root=None):
+    """<out_dir>/<path relative to root>_walls<ext>, so same-named maps of different folders don't collide."""
+    rel = os.path.relpath(path, root) if root else os.path.basename(path)
+    return os.path.join(out_dir, os.path.splitext(rel)[0] + "_walls" + ext)
+
+
+def collect_inputs(inputs):
+    """(paths, root) for map files, folders (images only) and glob patterns.
+
+    root is the deepest folder containing every input, outputs keep their path below it.
+    """
+    paths, roots = [], []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            roots.append(pattern)
+            paths += sorted(p for p in glob.glob(os.path.join(pattern, "*"))
+                            if os.path.isfile(p) and p.lower().endswith(IMAGE_EXTS))
+            continue
+        # Folder part before the first wildcard
+        head = pattern
+        while glob.has_magic(head):
+            head = os.path.dirname(head)
+        roots.append(head if glob.has_magic(pattern) else os.path.dirname(pattern))
+        paths += sorted(p for p in glob.glob(pattern) if os.path.isfile(p))
+    if not paths:
+        return [], None
+    root = os.path.commonpath([os.path.abspath(r or ".") for r in roots])
+    return [os.path.abspath(p) for p in paths], root
+
+
+def map_stages(params, out_dir, max_size=0, ext=".json", workers=None, queue_size=QUEUE_SIZE, root=None):
+    """The load / detect / merge / write stages for a batch of map files.
+
+    workers: {stage name: thread count}; detect defaults to one per core, the
+    others to one each (run_batch plans detect from the core budget).
+    root: outputs keep the map's path relative to it (see output_path).
+    """
+    params = wall_detection.make_params(**params)
+    # Detection runs without the merges, they have their own stage
+    detect_params = dict(params, merge_lines=False, merge_polygons=False)
+    local = threading.local()
+    workers = dict(workers or {})
+
+    def load(item):
+        with open(item.path, "rb") as f:
+            raw = f.read()
+        img = cv2.imdecode(np.frombuffer(raw, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError("could not decode image")
+        item.data["size"] = img.shape[1], img.shape[0]
+        item.data["img"] = fit_image(img, max_size)
+
+    def detect(item):
+        if not hasattr(local, "lsd"): # LSD instances aren't safe to share between threads
+            local.lsd = wall_detection.create_line_detector(params["line_backend"])
+        img = item.data.pop("img") # Release the image as soon as it's used
+        polygons, lines, _ = wall_detection.detect_walls(img, detect_params, lsd=local.lsd)
+        item.data.update(polygons=polygons, lines=lines, work_size=(img.shape[1], img.shape[0]))
+
+    def merge(item):
+        polygons, lines = item.data["polygons"], item.data["lines"]
+        if params["merge_polygons"] and wall_detection.SHAPELY_AVAILABLE:
+            polygons = wall_detection.merge_polygons(polygons, params["poly_thresh"])
+        if params["merge_lines"]:
+            lines = wall_detection.merge_lines(lines, params["line_thresh"])
+        # Back to original image coordinates, like the GUI export
+        (width, height), (work_w, work_h) = item.data["size"], item.data["work_size"]
+        scale = np.array([width / work_w, height / work_h])
+        item.data["polygons"] = [np.rint(np.asarray(p).reshape(-1, 2) * scale).astype(np.int32) for p in polygons]
+        item.data["lines"] = np.rint(np.asarray(lines, dtype=np.float64).reshape(-1, 4) * np.tile(scale, 2)).astype(np.int32)
+
+    def write(item):
+        metadata = {"source_file": item.path,
+                    "original_dimensions": {"width": item.data["size"][0], "height": item.data["size"][1]}}
+        item.data["output"] = output_path(item.path, out_dir, ext, root)
+        os.makedirs(os.path.dirname(item.data["output"]), exist_ok=True)
+        wall_io.save_walls(item.data["output"], item.data, metadata)
+
+    return [
+        Stage("load", load, workers.get("load", 1), queue_size),
+        Stage("detect", detect, workers.get("detect", available_cores()), queue_size),
+        Stage("merge", merge, workers.get("merge", 1), queue_size),
+        Stage("write", write, workers.get("write", 1), queue_size),
+    ]
+
+
+def run_batch(paths, params, out_dir, max_size=0, ext=".json", workers=None, queue_size=QUEUE_SIZE, serial=False,
+              root=None):
+    """Processes every map in paths. Returns (items, stage reports, elapsed seconds).
+
+    serial=True runs the same stages one map at a time in the calling thread,
+    as a baseline for the pipelined run. root: see map_stages.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    workers = dict(workers or {})
+    # Maps in flight vs. OpenCV threads per map, from the core budget
+    plan = plan_parallelism(len(paths), max_size * max_size if max_size else None)
+    workers.setdefault("detect", plan.workers)
+    threads = plan.threads if workers["detect"] == plan.workers else threads_per_worker(workers["detect"])
+    stages = map_stages(params, out_dir, max_size, ext, workers, queue_size, root)
+    items = [Item(p) for p in paths]
+    if not serial:
+        pipeline = Pipeline(stages)
+        with opencv_threads(threads):
+            done = list(pipeline.run(items))
+        return done, pipeline.report(), pipeline.elapsed
+
+    start = time.perf_counter()
+    for item in items:
+        for stage in stages:
+            if item.error is not None: break
+            t = time.perf_counter()
+            try:
+                stage.fn(item)
+            except Exception as e:
+                item.error = f"{stage.name}: {type(e).__name__}: {e}"
+                stage.errors += 1
+            stage.busy += time.perf_counter() - t
+            stage.items += 1
+    elapsed = time.perf_counter() - start
+    for stage in stages:
+        stage.workers = 1
+    return items, [stage.report(elapsed) for stage in stages], elapsed
+
+
+def print_report(reports, elapsed, count):
+    print(f"{count} maps in {elapsed:.2f}s ({count / elapsed if elapsed else 0:.2f} maps/s)")
+    print(f"  {'stage':<8}{'workers':>8}{'items':>7}{'busy s':>9}{'util':>7}{'starved s':>11}{'blocked s':>11}")
+    for r in reports:
+        print(f"  {r['stage']:<8}{r['workers']:>8}{r['items']:>7}{r['busy']:>9.2f}{r['utilization'] * 100:>6.0f}%"
+              f"{r['starved']:>11.2f}{r['blocked']:>11.2f}")
+    slowest = max(reports, key=lambda r: r["busy"] / r["workers"])
+    print(f"  Bottleneck: {slowest['stage']} ({slowest['busy'] / slowest['workers']:.2f}s of work per worker)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pipelined batch wall detection (load / detect / merge / write).")
+    parser.add_argument("inputs", nargs="+", help="Map files, folders or glob patterns")
+    parser.add_argument("--out", default="walls", help="Output folder")
+    parser.add_argument("--format", choices=("json", "fvw"), default="json")
+    parser.add_argument("--max-size", type=int, default=0, help="Downscale maps to fit this size (0 = full size)")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="Depth of each stage's input queue")
+    for name in ("load", "detect", "merge", "write"):
+        parser.add_argument(f"--{name}-workers", type=int, default=None)
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="Detection parameter, e.g. --param merge_lines=1 (repeatable)")
+    parser.add_argument("--serial", action="store_true", help="Run the stages one map at a time, for comparison")
+    args = parser.parse_args()
+
+    paths, root = collect_inputs(args.inputs)
+    if not paths: raise SystemExit("No input files.")
+    try:
+        params = spec_from_query({k: [v] for k, v in (p.split("=", 1) for p in args.param)})["params"]
+    except (ValueError, KeyError) as e:
+        raise SystemExit(f"Bad --param: {e}")
+    workers = {name: getattr(args, f"{name}_workers") for name in ("load", "detect", "merge", "write")
+               if getattr(args, f"{name}_workers")}
+
+    items, reports, elapsed = run_batch(paths, params, args.out, args.max_size,
+                                        ".json" if args.format == "json" else wall_io.BINARY_EXT,
+                                        workers, args.queue_size, args.serial, root)
+    for item in items:
+        if item.error:
+            print(f"Failed {item.path}: {item.error}")
+    print_report(reports, elapsed, len(items))
@@ -0,0 +1,288 @@
+import argparse
+import math
+import time
+
+import cv2
+import numpy as np
+
+import wall_detection
+from roi_detection import region_padding
+from wall_graph import cell_pairs, connected_components
+
+# Coarse-to-fine detection: a cheap pass on a pyramid level finds where walls can
+# be, and the full-resolution stages only run on patches around those spots. Open
+# floor (most of a dungeon map) never reaches the full-resolution Canny / LSD.
+
+COARSE_LEVEL = 2        # pyrDown steps for the candidate pass (2 = quarter size)
+COARSE_THRESHOLD = 0.5  # Canny thresholds are scaled by this on the coarse level, so faint walls still show up
+PATCH = 64              # Full-resolution patch size (px), the unit of the active mask
+MARGIN = 16             # Candidate edges are grown by this much (full-resolution px) before picking patches
+LINE_TILE = 512         # Lines are detected per tile of active patches (multiple of PATCH)
+LINE_PAD = 16           # Context around a line tile; lines are clipped back to the tile
+WHOLE_LINES = 0.9       # Above this active tile fraction, lines run once over the whole edge map
+STITCH_DISTANCE = 2.0   # Pieces of one line cut at a tile border are joined if their cut ends are this close
+STITCH_ANGLE = 3.0      # ... and their directions differ by less than this (degrees)
+
+
+def coarse_params(params, level):
+    """Detection parameters for the pyramid level: kernels shrink with the image, thresholds drop."""
+    factor = 2 ** level
+    close_morph = params["close_morph"] // factor
+    return dict(params, close_morph=close_morph if close_morph >= 2 else 0,
+                morph_size=params["morph_size"] // factor, kernel_size=3,
+                canny1=params["canny1"] * COARSE_THRESHOLD, canny2=params["canny2"] * COARSE_THRESHOLD)
+
+
+def candidate_patches(img, params, level=COARSE_LEVEL, patch=PATCH, margin=MARGIN):
+    """Boolean grid (rows, cols) of the patch x patch full-resolution patches that may hold walls."""
+    factor = 2 ** level
+    if patch % factor:
+        raise ValueError(f"Patch size {patch} must be a multiple of the pyramid factor {factor}.")
+    small = img
+    for _ in range(level):
+        small = cv2.pyrDown(small)
+    small_params = coarse_params(params, level)
+    edges = wall_detection.detect_edges(wall_detection.preprocess(small, small_params), small_params)
+    grow = math.ceil(margin / factor)
+    if grow:
+        edges = cv2.dilate(edges, cv2.getStructuringElement(cv2.MORPH_RECT, (2 * grow + 1, 2 * grow + 1)))
+
+    # Max over each patch; pyrDown rounds up, so the coarse grid covers the whole image
+    h, w = img.shape[:2]
+    rows, cols = -(-h // patch), -(-w // patch)
+    cell = patch // factor
+    grid = np.zeros((rows * cell, cols * cell), dtype=np.uint8)
+    ch, cw = min(edges.shape[0], grid.shape[0]), min(edges.shape[1], grid.shape[1])
+    grid[:ch, :cw] = edges[:ch, :cw]
+    return grid.reshape(rows, cell, cols, cell).max(axis=(1, 3)) > 0
+
+
+def patch_rects(active, patch, shape):
+    """Covers the active patches with rectangles: runs along each row, stacked while
+    consecutive rows repeat the same run. Rectangles are clipped to the image."""
+    h, w = shape[:2]
+    rects = []
+    open_runs = {} # (c0, c1) -> first row
+    for r in range(active.shape[0] + 1):
+        runs = set()
+        if r < active.shape[0]:
+            row = np.concatenate(([False], active[r], [False]))
+            change = np.flatnonzero(row[1:] != row[:-1]).tolist()
+            runs = set(zip(change[0::2], change[1::2]))
+        for run in [run for run in open_runs if run not in runs]:
+            r0 = open_runs.pop(run)
+            rects.append((run[0] * patch, r0 * patch, min(w, run[1] * patch), min(h, r * patch)))
+        for run in runs:
+            open_runs.setdefault(run, r)
+    return rects
+
+
+def refine_edges(img, params, rects):
+    """Full-resolution edge map that is computed inside rects only (zero elsewhere).
+
+    Each rectangle is run with roi_detection.region_padding context, so the edges
+    inside it match a full-image run except for hysteresis / component effects
+    across the padding.
+    """
+    h, w = img.shape[:2]
+    edges = np.zeros((h, w), dtype=np.uint8)
+    pad = region_padding(params)
+    for x0, y0, x1, y1 in rects:
+        px0, py0, px1, py1 = max(0, x0 - pad), max(0, y0 - pad), min(w, x1 + pad), min(h, y1 + pad)
+        blurred = wall_detection.preprocess(img[py0:py1, px0:px1], params)
+        crop = wall_detection.detect_edges(blurred, params)
+        edges[y0:y1, x0:x1] = crop[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+    return edges
+
+
+def clip_segments(segments, rect):
+    """Clips segments (N x 4) to rect (x0, y0, x1, y1), Liang-Barsky.
+
+    Returns (clipped segments, index of the source segment, start cut, end cut);
+    the cut flags mark ends that were moved onto the rectangle border.
+    """
+    x0, y0, x1, y1 = rect
+    sx, sy = segments[:, 0], segments[:, 1]
+    dx, dy = segments[:, 2] - sx, segments[:, 3] - sy
+    t0 = np.zeros(len(segments))
+    t1 = np.ones(len(segments))
+    ok = np.ones(len(segments), dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q in ((-dx, sx - x0), (dx, x1 - sx), (-dy, sy - y0), (dy, y1 - sy)):
+            parallel = p == 0
+            ok &= ~(parallel & (q < 0))
+            r = q / p
+            t0 = np.where(~parallel & (p < 0), np.maximum(t0, r), t0)
+            t1 = np.where(~parallel & (p > 0), np.minimum(t1, r), t1)
+    keep = np.flatnonzero(ok & (t0 < t1))
+    t0, t1 = t0[keep, None], t1[keep, None]
+    start, step = segments[keep, :2], segments[keep, 2:] - segments[keep, :2]
+    clipped = np.hstack([start + t0 * step, start + t1 * step])
+    return clipped, keep, t0[:, 0] > 0, t1[:, 0] < 1
+
+
+def stitch_segments(segments, tiles, cut_start, cut_end, distance=STITCH_DISTANCE, max_angle=STITCH_ANGLE):
+    """Joins the pieces of lines that were cut at tile borders.
+
+    Two pieces from different tiles are chained when a cut end of one is within
+    distance of a cut end of the other and their directions agree within
+    max_angle degrees. Each chain becomes one segment spanning its extreme ends
+    along the longest piece's direction. Uncut segments are returned unchanged.
+    """
+    points = segments.reshape(-1, 2)
+    cut = np.flatnonzero(np.column_stack([cut_start, cut_end]).ravel())
+    if len(cut) < 2:
+        return segments
+    vectors = segments[:, 2:] - segments[:, :2]
+    lengths = np.hypot(vectors[:, 0], vectors[:, 1])
+    units = vectors / np.maximum(lengths, 1e-9)[:, None]
+    min_cos = math.cos(math.radians(max_angle))
+
+    pair_a, pair_b = [], []
+    for a, b in cell_pairs(np.floor(points[cut] / distance).astype(np.int64)):
+        a, b = cut[a], cut[b]
+        sa, sb = a // 2, b // 2
+        close = (np.sum((points[a] - points[b]) ** 2, axis=1) <= distance * distance) & \
+                (tiles[sa] != tiles[sb]) & (np.abs(np.sum(units[sa] * units[sb], axis=1)) >= min_cos)
+        pair_a.append(sa[close]); pair_b.append(sb[close])
+    if not pair_a:
+        return segments
+    a, b = np.concatenate(pair_a), np.concatenate(pair_b)
+    if not len(a):
+        return segments
+    labels = connected_components(len(segments), a, b)
+    sizes = np.bincount(labels, minlength=len(segments))
+    single = sizes[labels] == 1
+    joined = []
+    order = np.argsort(labels[~single], kind="stable")
+    members = np.flatnonzero(~single)[order]
+    groups = np.split(members, np.flatnonzero(np.diff(labels[members])) + 1)
+    for group in groups:
+        longest = group[np.argmax(lengths[group])]
+        ends = segments[group].reshape(-1, 2)
+        along = (ends - segments[longest, :2]) @ units[longest]
+        joined.append(np.concatenate([ends[np.argmin(along)], ends[np.argmax(along)]]))
+    return np.vstack([segments[single]] + [np.array(joined)])
+
+
+def _line_detector(lsd, backend):
+    if lsd is None or getattr(lsd, "requested", lsd.name) != backend:
+        lsd = wall_detection.create_line_detector(backend)
+    return lsd
+
+
+def refine_lines(edges, active, patch, params, lsd=None, tile=LINE_TILE):
+    """Line segments on the sparse edge map, detected per tile that holds active patches.
+
+    The line detectors cost time per pixel even on empty input, so skipping
+    inactive tiles is where the savings come from. Lines are clipped to their tile
+    and pieces cut at tile borders are stitched back together afterwards. Same
+    length filter and merging as wall_detection.extract_lines.
+    """
+    lsd = _line_detector(lsd, params["line_backend"])
+    h, w = edges.shape
+    per_tile = max(1, tile // patch)
+    rows, cols = -(-active.shape[0] // per_tile), -(-active.shape[1] // per_tile)
+    grid = np.zeros((rows * per_tile, cols * per_tile), dtype=bool)
+    grid[:active.shape[0], :active.shape[1]] = active
+    tiles = grid.reshape(rows, per_tile, cols, per_tile).any(axis=(1, 3))
+    tile_px = per_tile * patch
+
+    if tiles.mean() >= WHOLE_LINES:
+        segments = np.asarray(list(lsd.detect(edges)), dtype=np.float64).reshape(-1, 4)
+    else:
+        pieces, owners, cut_start, cut_end = [], [], [], []
+        for index, (r, c) in enumerate(zip(*np.nonzero(tiles))):
+            rect = (c * tile_px, r * tile_px, min(w, (c + 1) * tile_px), min(h, (r + 1) * tile_px))
+            px0, py0 = max(0, rect[0] - LINE_PAD), max(0, rect[1] - LINE_PAD)
+            px1, py1 = min(w, rect[2] + LINE_PAD), min(h, rect[3] + LINE_PAD)
+            found = np.asarray(list(lsd.detect(edges[py0:py1, px0:px1])), dtype=np.float64).reshape(-1, 4)
+            if not len(found): continue
+            clipped, _, starts, ends = clip_segments(found + [px0, py0, px0, py0], rect)
+            pieces.append(clipped); owners.append(np.full(len(clipped), index))
+            cut_start.append(starts); cut_end.append(ends)
+        if not pieces:
+            return wall_detection.finish_lines([], params)
+        segments = stitch_segments(np.vstack(pieces), np.concatenate(owners),
+                                   np.concatenate(cut_start), np.concatenate(cut_end))
+
+    # Integer coordinates and the minimum length, like detect_line_segments
+    segments = segments.astype(np.int64)
+    lengths_sq = (segments[:, 2] - segments[:, 0]) ** 2 + (segments[:, 3] - segments[:, 1]) ** 2
+    line_list = [tuple(s) for s in segments[lengths_sq >= wall_detection.MIN_LINE_LENGTH ** 2].tolist()]
+    return wall_detection.finish_lines(line_list, params)
+
+
+def coarse_to_fine_detect(img, params, lsd=None, level=COARSE_LEVEL, patch=PATCH, margin=MARGIN):
+    """Wall detection that only runs the full-resolution stages near candidate walls.
+
+    Returns (polygons, lines, edges, active) like wall_detection.detect_walls, plus
+    the boolean patch grid that was refined. Inside the active patches the edge map
+    is the full-resolution one (see refine_edges); walls the coarse pass misses entirely are
+    lost. Small blob filtering sees blobs cut at the mask border as smaller.
+    """
+    params = wall_detection.make_params(**params)
+    active = candidate_patches(img, params, level, patch, margin)
+    edges = refine_edges(img, params, patch_rects(active, patch, img.shape))
+    edges = wall_detection.filter_components(edges, params)
+    polygons = wall_detection.extract_polygons(edges, params)
+    lines = refine_lines(edges, active, patch, params, lsd)
+    return polygons, lines, edges, active
+
+
+def edge_recall(full_edges, edges):
+    """Fraction of the full-resolution edge pixels that the coarse-to-fine run kept."""
+    total = np.count_nonzero(full_edges)
+    return np.count_nonzero(full_edges & edges) / total if total else 1.0
+
+
+def line_coverage(reference, lines, tolerance=2.0, shape=None):
+    """Fraction of the reference lines' length that lies within tolerance of lines (rasterized)."""
+    h, w = shape
+    drawn = np.zeros((h, w), dtype=np.uint8)
+    for x1, y1, x2, y2 in lines:
+        cv2.line(drawn, (int(x1), int(y1)), (int(x2), int(y2)), 255, 1)
+    size = 2 * int(math.ceil(tolerance)) + 1
+    drawn = cv2.dilate(drawn, cv2.getStructuringElement(cv2.MORPH_RECT, (size, size)))
+    wanted = np.zeros((h, w), dtype=np.uint8)
+    for x1, y1, x2, y2 in reference:
+        cv2.line(wanted, (int(x1), int(y1)), (int(x2), int(y2)), 255, 1)
+    total = np.count_nonzero(wanted)
+    return np.count_nonzero(wanted & drawn) / total if total else 1.0
+
+
+if __name__ == "__main__":
+    from detection_service import spec_from_query
+
+    parser = argparse.ArgumentParser(description="Coarse-to-fine wall detection, compared to a full-resolution run.")
+    parser.add_argument("image")
+    parser.add_argument("--level", type=int, default=COARSE_LEVEL, help="Pyramid level of the candidate pass")
+    parser.add_argument("--patch", type=int, default=PATCH, help="Full-resolution patch size (px)")
+    parser.add_argument("--margin", type=int, default=MARGIN, help="Growth of the candidate regions (px)")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="Detection parameter, e.g. --param close_morph=0 (repeatable)")
+    parser.add_argument("--compare", action="store_true", help="Also run full-resolution detection and compare")
+    args = parser.parse_args()
+
+    try:
+        params = spec_from_query({k: [v] for k, v in (p.split("=", 1) for p in args.param)})["params"]
+    except (ValueError, KeyError) as e:
+        raise SystemExit(f"Bad argument: {e}")
+    params = wall_detection.make_params(**params)
+    img = cv2.imread(args.image)
+    if img is None: raise SystemExit(f"Can't read {args.image}")
+    lsd = wall_detection.create_line_detector(params["line_backend"])
+
+    start = time.perf_counter()
+    polygons, lines, edges, active = coarse_to_fine_detect(img, params, lsd, args.level, args.patch, args.margin)
+    fast = time.perf_counter() - start
+    print(f"Coarse-to-fine: {fast:.2f}s, {active.mean():.1%} of {active.size} patches refined, "
+          f"{len(polygons)} polygons, {len(lines)} lines")
+    if args.compare:
+        start = time.perf_counter()
+        full_polygons, full_lines, full_edges = wall_detection.detect_walls(img, params, lsd)
+        full = time.perf_counter() - start
+        print(f"Full resolution: {full:.2f}s, {len(full_polygons)} polygons, {len(full_lines)} lines "
+              f"({full / fast:.1f}x slower)")
+        print(f"Edge pixels kept: {edge_recall(full_edges, edges):.2%}; full-resolution line length covered: "
+              f"{line_coverage(full_lines, lines, shape=edges.shape):.2%}")
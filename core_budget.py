@@ -0,0 +1,170 @@
+import argparse
+import math
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import cv2
+
+import wall_detection
+from shared_image import map_shared
+
+# How a core budget is split: `workers` parallel jobs (processes or threads),
+# each running OpenCV with `threads` internal threads.
+Plan = namedtuple("Plan", ["workers", "threads"])
+
+# Share of detect_walls that runs on OpenCV's thread count (blur, morphology,
+# Canny). Contour tracing, polygon approximation and LSD are single threaded, so on typical maps this is small and
+# running more maps at once beats more threads per map.
+# measure_parallel_fraction() gives the value for a given image.
+PARALLEL_FRACTION = 0.2
+PIXELS_PER_THREAD = 250_000 # Below this an extra OpenCV thread costs more than it saves
+
+
+def available_cores():
+    """Cores this process may run on (respects CPU affinity / container limits)."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+
+def threads_per_worker(workers, cores=None):
+    """OpenCV threads each of `workers` parallel jobs gets without oversubscribing."""
+    return max(1, (cores or available_cores()) // max(1, workers))
+
+
+def configure_worker(threads):
+    """Process pool initializer: caps OpenCV's internal thread pool for this worker."""
+    cv2.setNumThreads(max(1, threads))
+
+
+@contextmanager
+def opencv_threads(threads):
+    """Temporarily sets OpenCV's thread count for the current process."""
+    previous = cv2.getNumThreads()
+    cv2.setNumThreads(max(1, threads))
+    try:
+        yield
+    finally:
+        cv2.setNumThreads(previous)
+
+
+def useful_threads(threads, pixels=None):
+    """OpenCV threads that actually speed up one image of this size."""
+    return threads if pixels is None else max(1, min(threads, pixels // PIXELS_PER_THREAD))
+
+
+def estimate_time(jobs, workers, threads, pixels=None, parallel_fraction=PARALLEL_FRACTION):
+    """Relative makespan of `jobs` equal jobs run by `workers` with `threads` each (1.0 = one job, one thread)."""
+    per_job = (1 - parallel_fraction) + parallel_fraction / useful_threads(threads, pixels)
+    return math.ceil(jobs / workers) * per_job
+
+
+def plan_parallelism(jobs, pixels=None, cores=None, parallel_fraction=PARALLEL_FRACTION):
+    """Picks the workers x threads split of the core budget with the lowest estimated makespan.
+
+    Many jobs -> one single-threaded worker per core (inter-op); few jobs on big
+    images -> the spare cores go to OpenCV inside each job (intra-op). Ties go
+    to more workers, which also hides I/O.
+    """
+    cores = cores or available_cores()
+    jobs = max(1, jobs)
+    best = None
+    for workers in range(min(jobs, cores), 0, -1):
+        threads = threads_per_worker(workers, cores)
+        cost = estimate_time(jobs, workers, threads, pixels, parallel_fraction)
+        if best is None or cost < best[0] - 1e-9:
+            best = (cost, Plan(workers, useful_threads(threads, pixels)))
+    return best[1]
+
+
+def _init_pool_worker(threads, initializer, initargs):
+    configure_worker(threads)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def process_pool(plan, initializer=None, initargs=()):
+    """ProcessPoolExecutor following plan: plan.workers processes with plan.threads OpenCV threads each."""
+    return ProcessPoolExecutor(max_workers=plan.workers, initializer=_init_pool_worker,
+                               initargs=(plan.threads, initializer, initargs))
+
+
+# --- Measurements ---
+
+def measure_parallel_fraction(img, params=None, repeats=3):
+    """Share of detect_walls time spent in the stages OpenCV parallelizes, measured single threaded."""
+    params = wall_detection.make_params(**(params or {}))
+    lsd = wall_detection.create_line_detector(params["line_backend"])
+    best_parallel = best_total = None
+    with opencv_threads(1):
+        for _ in range(max(1, repeats)):
+            start = time.perf_counter()
+            edges = wall_detection.detect_edges(wall_detection.preprocess(img, params), params)
+            parallel = time.perf_counter() - start
+            edges = wall_detection.filter_components(edges, params)
+            contours_raw = wall_detection.find_contours(edges)
+            mark = time.perf_counter()
+            wall_detection.approximate_polygons(contours_raw, params)
+            parallel += time.perf_counter() - mark
+            wall_detection.extract_lines(edges, params, lsd)
+            total = time.perf_counter() - start
+            best_parallel = parallel if best_parallel is None else min(best_parallel, parallel)
+            best_total = total if best_total is None else min(best_total, total)
+    return best_parallel / best_total if best_total > 0 else 0.0
+
+
+def _detect_job(img, params):
+    polygons, lines, _ = wall_detection.detect_walls(img, params)
+    return len(polygons) + len(lines)
+
+
+def benchmark_splits(img, jobs, cores=None, params=None, splits=None, parallel_fraction=None):
+    """Times `jobs` detections of img for each workers x threads split.
+
+    Defaults to the two extremes (one worker using every core, one single
+    threaded worker per core) and the planned split. Returns
+    [{"plan", "seconds", "planned"}], fastest first.
+    """
+    cores = cores or available_cores()
+    params = wall_detection.make_params(**(params or {}))
+    if parallel_fraction is None:
+        parallel_fraction = measure_parallel_fraction(img, params)
+    planned = plan_parallelism(jobs, img.shape[0] * img.shape[1], cores, parallel_fraction)
+    splits = list(dict.fromkeys(splits or [Plan(1, cores), Plan(min(jobs, cores), 1), planned]))
+    results = []
+    for plan in splits:
+        with process_pool(plan) as pool:
+            # Warm up the workers (imports, line detectors) before timing
+            map_shared(_detect_job, img, [params] * plan.workers, executor=pool)
+            start = time.perf_counter()
+            map_shared(_detect_job, img, [params] * jobs, executor=pool)
+            results.append({"plan": plan, "seconds": time.perf_counter() - start, "planned": plan == planned})
+    return sorted(results, key=lambda r: r["seconds"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare workers x OpenCV threads splits of the core budget.")
+    parser.add_argument("image")
+    parser.add_argument("--jobs", type=int, default=None, help="Detections to run (default: 2 per core)")
+    parser.add_argument("--cores", type=int, default=None, help="Core budget (default: all available)")
+    parser.add_argument("--split", action="append", default=[], metavar="WORKERSxTHREADS",
+                        help="Extra split to time, e.g. --split 4x4 (repeatable)")
+    args = parser.parse_args()
+
+    img = cv2.imread(args.image)
+    if img is None: raise SystemExit(f"Could not read image {args.image}")
+    cores = args.cores or available_cores()
+    jobs = args.jobs or 2 * cores
+    fraction = measure_parallel_fraction(img)
+    planned = plan_parallelism(jobs, img.shape[0] * img.shape[1], cores, fraction)
+    print(f"{cores} cores, {jobs} jobs on {img.shape[1]}x{img.shape[0]}; "
+          f"OpenCV-parallel share of detection {fraction:.0%}; plan {planned.workers}x{planned.threads}")
+    extra = [Plan(*map(int, s.lower().split("x"))) for s in args.split]
+    splits = list(dict.fromkeys([Plan(1, cores), Plan(min(jobs, cores), 1), planned] + extra))
+    for r in benchmark_splits(img, jobs, cores, splits=splits, parallel_fraction=fraction):
+        plan = r["plan"]
+        print(f"  {plan.workers:>3} workers x {plan.threads:>2} threads  {r['seconds']:7.2f}s  "
+              f"{jobs / r['seconds']:6.2f} maps/s{'  <- planned' if r['planned'] else ''}")
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from wall_detection import DETECTION_VERSION, detect_walls
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "fvtt_wall_creator")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024 # 512 MB
+CACHE_EXT = ".npz"
+
+
+def image_digest(img):
+    """Content hash of a decoded image (pixels + shape + dtype). Compute once per loaded image."""
+    h = hashlib.blake2b(digest_size=20)
+    h.update(str((img.shape, img.dtype.str)).encode())
+    h.update(np.ascontiguousarray(img).data)
+    return h.hexdigest()
+
+
+def cache_key(img_digest, params, version=DETECTION_VERSION):
+    """Key for one detection run: image content + parameter set + detection code version."""
+    h = hashlib.blake2b(digest_size=20)
+    h.update(img_digest.encode())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+    h.update(str(version).encode())
+    return h.hexdigest()
+
+
+def pack_polygons(polygons):
+    """List of (N, 1, 2) contours -> flat (M, 2) int32 point buffer + (P + 1,) offsets."""
+    offsets = np.zeros(len(polygons) + 1, dtype=np.int64)
+    if polygons:
+        offsets[1:] = np.cumsum([len(p) for p in polygons])
+        points = np.concatenate([np.asarray(p, dtype=np.int32).reshape(-1, 2) for p in polygons])
+    else:
+        points = np.empty((0, 2), dtype=np.int32)
+    return points, offsets
+
+
+def unpack_polygons(points, offsets):
+    return [points[offsets[i]:offsets[i + 1]].reshape(-1, 1, 2) for i in range(len(offsets) - 1)]
+
+
+class DetectionCache:
+    """Persistent, size-bounded LRU cache of detection results (polygons, lines, edge map).
+
+    Entries are stored as one .npz per key. The file mtime is the LRU clock: it is
+    refreshed on every hit, and the oldest entries are evicted once the directory
+    grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_EXT)
+
+    def get(self, key):
+        """Returns (polygons, lines, edges) or None on a miss."""
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                polygons = unpack_polygons(data["poly_points"], data["poly_offsets"])
+                lines = [tuple(line) for line in data["lines"].tolist()]
+                edges_shape = tuple(data["edges_shape"])
+                edges = None
+                if edges_shape:
+                    count = edges_shape[0] * edges_shape[1]
+                    edges = (np.unpackbits(data["edges_bits"], count=count) * 255).astype(np.uint8).reshape(edges_shape)
+            os.utime(path) # Mark as recently used
+            return polygons, lines, edges
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Cache read error for {key}: {e}. Dropping entry.")
+            self._remove(path)
+            return None
+
+    def put(self, key, polygons, lines, edges=None):
+        points, offsets = pack_polygons(polygons)
+        lines_arr = np.asarray(lines, dtype=np.int32).reshape(-1, 4)
+        if edges is not None:
+            edges_bits = np.packbits(edges.ravel() > 0) # 1 bit per pixel
+            edges_shape = np.asarray(edges.shape[:2], dtype=np.int64)
+        else:
+            edges_bits = np.empty(0, dtype=np.uint8)
+            edges_shape = np.empty(0, dtype=np.int64)
+
+        # Write to a temp file and rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, poly_points=points, poly_offsets=offsets, lines=lines_arr,
+                         edges_bits=edges_bits, edges_shape=edges_shape)
+            os.replace(tmp_path, self._path(key))
+        except Exception as e:
+            print(f"Cache write error for {key}: {e}")
+            self._remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(CACHE_EXT): continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        if total <= self.max_bytes: return
+        entries.sort() # Oldest first
+        for _, size, path in entries:
+            if total <= self.max_bytes: break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(CACHE_EXT):
+                self._remove(os.path.join(self.cache_dir, name))
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def cached_detect_walls(img, params, cache=None, img_digest=None, lsd=None, edge_stage=None, buffers=None):
+    """detect_walls() through the cache. Returns (polygons, lines, edges, hit)."""
+    if cache is None:
+        return detect_walls(img, params, lsd, edge_stage, buffers) + (False,)
+    if img_digest is None:
+        img_digest = image_digest(img)
+    key = cache_key(img_digest, params)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached + (True,)
+    polygons, lines, edges = detect_walls(img, params, lsd, edge_stage, buffers)
+    cache.put(key, polygons, lines, edges)
+    return polygons, lines, edges, False
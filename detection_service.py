@@ -0,0 +1,550 @@
+import argparse
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import cv2
+import numpy as np
+
+import line_backends
+import wall_detection
+import wall_io
+from core_budget import available_cores, threads_per_worker
+from coarse_to_fine import coarse_to_fine_detect
+from detection_cache import DEFAULT_CACHE_DIR, DetectionCache, cached_detect_walls
+from memory_budget import budget_detect, format_size, parse_size
+from prepare_wall_packet import iter_packet_frames, prepare_walls
+from shared_image import KIND_MMAP, KIND_SHM, SharedImage, attach_image, detach_image
+
+# Local HTTP service running detection jobs on a bounded process pool.
+#
+#   POST   /jobs               JSON job spec, or raw image bytes with the spec as query parameters
+#   GET    /jobs               status of every known job
+#   GET    /jobs/<id>          status (?wait=seconds blocks until the job finishes or the time is up)
+#   GET    /jobs/<id>/result   wall JSON in the export format, streamed
+#   GET    /jobs/<id>/packet   Foundry modifyDocument frames, one per line (jobs with a scene_id)
+#   DELETE /jobs/<id>          cancels a job that hasn't started yet
+#
+# JSON job spec: {"path": "map.png", "params": {...detection params...}, "max_size": 2000,
+#                 "memory_budget": "1G", "coarse_level": 2,
+#                 "packet": {"scene_id": "...", "width": 4000, "height": 3000, ...prepare_walls cleanup...}}
+#
+# With a memory_budget (bytes or "1G"-style) the job runs through memory_budget.budget_detect:
+# scale / tiles are picked so the worker's RSS stays under it, and the detection cache is skipped.
+# With a coarse_level (pyramid level, 0 = off) the job runs through coarse_to_fine.coarse_to_fine_detect,
+# which only refines patches near candidate walls; also uncached, and ignored under a memory_budget.
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+QUEUE_SIZE = 16                 # Jobs allowed to wait for a worker, on top of the running ones
+KEEP_JOBS = 200                 # Finished jobs kept for polling; the oldest are forgotten first
+MAX_UPLOAD = 256 * 1024 * 1024  # 256 MB
+STREAM_CHUNK = 64 * 1024
+MAX_WAIT = 60                   # Cap for ?wait= long polling (seconds)
+NON_NEGATIVE_PARAMS = ("close_morph", "morph_size", "canny1", "canny2", "min_component", "min_extent", "epsilon",
+                       "line_thresh", "poly_thresh")
+CLEANUP_KEYS = ("min_distance", "fuse_tolerance", "split_tolerance", "dedup_tolerance", "parallel_distance",
+                "max_walls")
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+# --- Worker process side ---
+
+_detectors = {}
+_cache = None
+
+
+def init_worker(cache_dir, cv_threads):
+    global _cache
+    # Each worker only gets its share of the cores (core_budget.threads_per_worker)
+    cv2.setNumThreads(cv_threads)
+    if cache_dir:
+        _cache = DetectionCache(cache_dir)
+
+
+def _detector(backend):
+    # One line detector per backend and process, reused across jobs
+    if backend not in _detectors:
+        _detectors[backend] = wall_detection.create_line_detector(backend)
+    return _detectors[backend]
+
+
+def read_image(path=None, data=None):
+    if data is not None:
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    else:
+        img = cv2.imread(path)
+    if img is None:
+        raise ValueError(f"Could not decode image {path or '(upload)'}")
+    return img
+
+
+def fit_image(img, max_size):
+    """Downscales img to fit max_size x max_size (0 = keep full size). Never scales up."""
+    if not max_size: return img
+    scale = min(max_size / img.shape[1], max_size / img.shape[0], 1.0)
+    if scale >= 1.0: return img
+    size = (max(1, int(img.shape[1] * scale)), max(1, int(img.shape[0] * scale)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+
+def publish_upload(data):
+    """Upload bytes as a SharedImage, so workers map them instead of getting a pickled copy."""
+    raw = np.frombuffer(data, dtype=np.uint8)
+    try:
+        return SharedImage(raw, kind=KIND_SHM)
+    except OSError:
+        return SharedImage(raw, kind=KIND_MMAP) # e.g. /dev/shm too small in a container
+
+
+def run_job(spec, data=None, upload=None):
+    """Detection (and packet preparation, if requested) for one job. Runs in a worker process.
+
+    The image is spec["path"], data (encoded bytes) or upload (ImageHandle of a
+    publish_upload() buffer). Returns {"metadata", "polygons", "lines"} in original
+    image coordinates, plus "walls" (Nx4, scene coordinates) when the spec has a
+    "packet" section.
+    """
+    if upload is not None:
+        data = attach_image(upload)
+        try:
+            return run_job(spec, data)
+        finally:
+            del data
+            detach_image(upload)
+    start = time.perf_counter()
+    params = wall_detection.make_params(**spec.get("params", {}))
+    memory_plan = None
+    if spec.get("memory_budget"):
+        polygons, lines, memory_plan, (width, height) = budget_detect(
+            params, parse_size(spec["memory_budget"]), spec.get("path"), data, spec.get("max_size"),
+            lsd=_detector(params["line_backend"]))
+        cache_hit = False
+    else:
+        img = read_image(spec.get("path"), data)
+        height, width = img.shape[:2]
+        work = fit_image(img, spec.get("max_size"))
+        del img
+        if spec.get("coarse_level"):
+            polygons, lines, _, _ = coarse_to_fine_detect(work, params, _detector(params["line_backend"]),
+                                                          level=spec["coarse_level"])
+            cache_hit = False
+        else:
+            polygons, lines, _, cache_hit = cached_detect_walls(work, params, cache=_cache,
+                                                                lsd=_detector(params["line_backend"]))
+
+        # Back to original image coordinates, like the GUI export
+        scale = np.array([width / work.shape[1], height / work.shape[0]])
+        polygons = [np.rint(np.asarray(p).reshape(-1, 2) * scale).astype(np.int32) for p in polygons]
+        lines = np.rint(np.asarray(lines, dtype=np.float64).reshape(-1, 4) * np.tile(scale, 2)).astype(np.int32)
+    result = {
+        "metadata": {"source_file": spec.get("path") or spec.get("name"),
+                     "original_dimensions": {"width": width, "height": height},
+                     "params": params, "cache_hit": cache_hit},
+        "polygons": polygons,
+        "lines": lines,
+    }
+    if memory_plan is not None:
+        result["metadata"]["memory_plan"] = memory_plan._asdict()
+
+    packet = spec.get("packet")
+    if packet:
+        proportion_x = packet["width"] / width if packet.get("width") else 1
+        proportion_y = packet["height"] / height if packet.get("height") else 1
+        cleanup = {k: packet[k] for k in CLEANUP_KEYS if packet.get(k) is not None}
+        result["walls"] = prepare_walls({"polygons": polygons, "lines": lines}, proportion_x, proportion_y, **cleanup)
+    result["metadata"]["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+# --- Job bookkeeping (server process) ---
+
+class Job:
+    def __init__(self, job_id, spec):
+        self.id = job_id
+        self.spec = spec
+        self.submitted = time.time()
+        self.finished = None
+        self.future = None
+
+    # state, result and error all come from the future, so they agree as soon as
+    # it is done (the done-callback that stamps finished may still be pending)
+    @property
+    def state(self):
+        f = self.future
+        if f.cancelled(): return "cancelled"
+        if f.done(): return "failed" if f.exception() is not None else "done"
+        return "running" if f.running() else "queued"
+
+    @property
+    def result(self):
+        f = self.future
+        if not f.done() or f.cancelled() or f.exception() is not None: return None
+        return f.result()
+
+    @property
+    def error(self):
+        f = self.future
+        if not f.done() or f.cancelled(): return None
+        e = f.exception()
+        return f"{type(e).__name__}: {e}" if e is not None else None
+
+    def _finish(self, future):
+        self.finished = time.time()
+
+    def status(self):
+        status = {"id": self.id, "state": self.state, "submitted": self.submitted, "finished": self.finished,
+                  "source": self.spec.get("path") or self.spec.get("name")}
+        error, result = self.error, self.result
+        if error:
+            status["error"] = error
+        if result is not None:
+            status["polygons"] = len(result["polygons"])
+            status["lines"] = len(result["lines"])
+            status["seconds"] = result["metadata"]["seconds"]
+            if "walls" in result:
+                status["walls"] = len(result["walls"])
+        return status
+
+
+def check_params(params):
+    """Detection params with their values checked against DEFAULT_PARAMS. Raises KeyError / ValueError."""
+    if not isinstance(params, dict):
+        raise ValueError("'params' must be a JSON object.")
+    params = wall_detection.make_params(**params) # Raises KeyError on unknown parameters
+    for key, value in params.items():
+        default = wall_detection.DEFAULT_PARAMS[key]
+        if isinstance(default, bool):
+            ok = isinstance(value, bool)
+        elif isinstance(default, int):
+            ok = isinstance(value, int) and not isinstance(value, bool)
+        elif isinstance(default, float):
+            ok = isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+        else:
+            ok = isinstance(value, type(default))
+        if not ok:
+            raise ValueError(f"Parameter '{key}' must be of type {type(default).__name__}, got {value!r}.")
+    for key in NON_NEGATIVE_PARAMS:
+        if params[key] < 0:
+            raise ValueError(f"Parameter '{key}' must be 0 or more.")
+    if params["kernel_size"] < 1 or params["kernel_size"] % 2 == 0:
+        raise ValueError("Parameter 'kernel_size' must be a positive odd number.")
+    if params["line_backend"] not in line_backends.BACKENDS:
+        raise ValueError(f"Unknown line backend: {params['line_backend']}")
+    return params
+
+
+def validate_spec(spec, image_root=None, upload=False):
+    """Checks a job spec up front, so bad requests fail on submit rather than in a worker."""
+    if not isinstance(spec, dict):
+        raise ValueError("Job spec must be a JSON object.")
+    check_params(spec.get("params", {}))
+    if not upload:
+        path = spec.get("path")
+        if not path:
+            raise ValueError("Job needs an image upload or a 'path'.")
+        if image_root:
+            path = os.path.realpath(os.path.join(image_root, path))
+            if os.path.commonpath([path, os.path.realpath(image_root)]) != os.path.realpath(image_root):
+                raise ValueError("Path is outside the image root.")
+            spec["path"] = path
+        if not os.path.isfile(spec["path"]):
+            raise ValueError(f"No such image: {spec['path']}")
+    if spec.get("memory_budget") is not None:
+        parse_size(spec["memory_budget"]) # Raises ValueError on a bad size
+    if spec.get("coarse_level") is not None:
+        if not isinstance(spec["coarse_level"], int) or not 0 <= spec["coarse_level"] <= 4:
+            raise ValueError("'coarse_level' must be an integer from 0 to 4.")
+    packet = spec.get("packet")
+    if packet is not None:
+        if not isinstance(packet, dict) or not packet.get("scene_id"):
+            raise ValueError("'packet' needs a 'scene_id'.")
+        unknown = set(packet) - set(CLEANUP_KEYS) - {"scene_id", "width", "height"}
+        if unknown:
+            raise KeyError(f"Unknown packet settings: {', '.join(sorted(unknown))}")
+    return spec
+
+
+class DetectionService:
+    """Job queue in front of a process pool.
+
+    At most workers jobs run at once and queue_size more may wait; submit() raises
+    QueueFull beyond that instead of letting the backlog grow without bound.
+    """
+
+    def __init__(self, workers=None, queue_size=QUEUE_SIZE, cache_dir=DEFAULT_CACHE_DIR, keep=KEEP_JOBS,
+                 image_root=None, memory_budget=None):
+        self.workers = workers or available_cores()
+        self.queue_size = queue_size
+        self.keep = keep
+        self.image_root = image_root
+        # Total RSS budget (bytes), shared evenly by the workers; jobs may ask for less
+        self.job_budget = memory_budget // self.workers if memory_budget else None
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                            initargs=(cache_dir, threads_per_worker(self.workers)))
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+
+    def pending(self):
+        return sum(1 for job in self.jobs.values() if not job.future.done())
+
+    def submit(self, spec, data=None):
+        spec = validate_spec(spec, self.image_root, upload=data is not None)
+        if self.job_budget:
+            requested = parse_size(spec["memory_budget"]) if spec.get("memory_budget") else self.job_budget
+            spec["memory_budget"] = min(requested, self.job_budget)
+        # Uploads go to the workers through shared memory, only the handle is pickled
+        shared = publish_upload(data) if data is not None else None
+        try:
+            with self.lock:
+                if self.pending() >= self.workers + self.queue_size:
+                    raise QueueFull(f"{self.pending()} jobs pending, try again later.")
+                job = Job(uuid.uuid4().hex[:12], spec)
+                if shared is None:
+                    job.future = self.executor.submit(run_job, spec)
+                else:
+                    job.future = self.executor.submit(run_job, spec, None, shared.acquire())
+                    job.future.add_done_callback(shared.release)
+                self.jobs[job.id] = job
+                self._evict()
+        finally:
+            if shared is not None: shared.close() # Freed once the job has released it
+        job.future.add_done_callback(job._finish)
+        return job
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.future.done()]
+        for job_id in finished[:max(0, len(self.jobs) - self.keep)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        return job is not None and job.future.cancel()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+# --- HTTP front end ---
+
+class _ChunkedWriter:
+    """Text stream that sends everything written to it as HTTP/1.1 chunks."""
+
+    def __init__(self, wfile, size=STREAM_CHUNK):
+        self.wfile = wfile
+        self.size = size
+        self.parts = []; self.buffered = 0
+
+    def write(self, text):
+        self.parts.append(text); self.buffered += len(text)
+        if self.buffered >= self.size:
+            self.flush()
+
+    def flush(self):
+        data = "".join(self.parts).encode()
+        self.parts = []; self.buffered = 0
+        if data:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def close(self):
+        self.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def _query_value(text, default):
+    # Query parameters arrive as strings, convert them to the type of the default
+    if isinstance(default, bool):
+        return text.lower() in ("1", "true", "yes", "on")
+    if isinstance(default, (int, float)):
+        return float(text) if isinstance(default, float) or "." in text else int(text)
+    return text
+
+
+def spec_from_query(query):
+    """Job spec for an upload, from query parameters (detection params, max_size, scene_id, ...)."""
+    spec = {"params": {}}
+    packet = {}
+    for key, values in query.items():
+        value = values[-1]
+        if key in wall_detection.DEFAULT_PARAMS:
+            spec["params"][key] = _query_value(value, wall_detection.DEFAULT_PARAMS[key])
+        elif key in ("max_size", "coarse_level"):
+            spec[key] = int(value)
+        elif key == "memory_budget":
+            spec[key] = parse_size(value)
+        elif key == "name":
+            spec[key] = value
+        elif key == "scene_id":
+            packet[key] = value
+        elif key in ("width", "height") + CLEANUP_KEYS:
+            packet[key] = float(value)
+        else:
+            raise KeyError(f"Unknown query parameter: {key}")
+    if packet:
+        spec["packet"] = packet
+    return spec
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    service = None # Set by make_server
+
+    def log_message(self, format, *args):
+        print(f"[{self.log_date_time_string()}] {self.address_string()} {format % args}")
+
+    def _send_json(self, code, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, code, message, headers=None):
+        self._send_json(code, {"error": message}, headers)
+
+    def _route(self):
+        """(job id, action, query) for /jobs[/<id>[/<action>]]; job id is "" for /jobs itself, None elsewhere."""
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        if not parts or parts[0] != "jobs" or len(parts) > 3:
+            return None, None, parse_qs(url.query)
+        job_id = parts[1] if len(parts) > 1 else ""
+        action = parts[2] if len(parts) > 2 else None
+        return job_id, action, parse_qs(url.query)
+
+    def _find_job(self, job_id):
+        job = self.service.get(job_id)
+        if job is None:
+            self._error(404, f"No such job: {job_id}")
+        return job
+
+    def do_POST(self):
+        job_id, action, query = self._route()
+        if job_id != "":
+            return self._error(404, "POST to /jobs to submit a job.")
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            return self._error(411, "Content-Length required.")
+        if length > MAX_UPLOAD:
+            return self._error(413, f"Upload larger than {MAX_UPLOAD} bytes.")
+        body = self.rfile.read(length)
+        try:
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                job = self.service.submit(json.loads(body))
+            else:
+                job = self.service.submit(spec_from_query(query), data=body)
+        except QueueFull as e:
+            return self._error(503, str(e), {"Retry-After": "5"})
+        except (ValueError, KeyError, TypeError) as e:
+            return self._error(400, str(e).strip("'\""))
+        self._send_json(202, job.status(), {"Location": f"/jobs/{job.id}"})
+
+    def do_GET(self):
+        job_id, action, query = self._route()
+        if job_id == "":
+            return self._send_json(200, [job.status() for job in self.service.list()])
+        if job_id is None:
+            return self._error(404, "Not found.")
+        job = self._find_job(job_id)
+        if job is None: return
+        if action is None:
+            if "wait" in query:
+                try:
+                    seconds = _query_value(query["wait"][-1], 0.0)
+                except ValueError:
+                    seconds = -1
+                if not seconds >= 0: # Also false for NaN
+                    return self._error(400, "'wait' must be a number of seconds, 0 or more.")
+                wait([job.future], timeout=min(seconds, MAX_WAIT))
+            return self._send_json(200, job.status())
+        if action not in ("result", "packet"):
+            return self._error(404, "Not found.")
+        if not job.future.done():
+            return self._error(409, f"Job is {job.state}.", {"Retry-After": "1"})
+        result = job.result
+        if result is None:
+            return self._send_json(409, job.status())
+        if action == "packet" and "walls" not in result:
+            return self._error(404, "Job was submitted without a 'packet' section.")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json" if action == "result" else "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        out = _ChunkedWriter(self.wfile)
+        if action == "result":
+            wall_io.write_walls_json(out, result, result["metadata"])
+        else:
+            for frame in iter_packet_frames(result["walls"], job.spec["packet"]["scene_id"]):
+                out.write(frame + "\n")
+        out.close()
+
+    def do_DELETE(self):
+        job_id, action, _ = self._route()
+        if not job_id or action is not None:
+            return self._error(404, "Not found.")
+        job = self._find_job(job_id)
+        if job is None: return
+        if not self.service.cancel(job_id):
+            return self._error(409, f"Job is {job.state}, only queued jobs can be cancelled.")
+        self._send_json(200, job.status())
+
+
+def make_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    handler = type("BoundServiceHandler", (ServiceHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local HTTP service running wall detection jobs on a process pool.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Interface to listen on (default: localhost only)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per core)")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="Jobs allowed to wait for a worker")
+    parser.add_argument("--image-root", default=None, help="Resolve 'path' jobs under this folder and refuse others")
+    parser.add_argument("--no-cache", action="store_true", help="Don't use the on-disk detection cache")
+    parser.add_argument("--memory-budget", default=None, metavar="SIZE",
+                        help="RSS budget of all workers together, e.g. 2G; jobs are scaled / tiled to fit")
+    args = parser.parse_args()
+
+    try:
+        memory_budget = parse_size(args.memory_budget) if args.memory_budget else None
+    except ValueError as e:
+        raise SystemExit(f"Bad --memory-budget: {e}")
+    service = DetectionService(workers=args.workers, queue_size=args.queue_size,
+                               cache_dir=None if args.no_cache else DEFAULT_CACHE_DIR, image_root=args.image_root,
+                               memory_budget=memory_budget)
+    server = make_server(service, args.host, args.port)
+    print(f"Detection service on http://{args.host}:{args.port} ({service.workers} workers, "
+          f"queue of {service.queue_size}"
+          f"{', ' + format_size(service.job_budget) + ' per job' if service.job_budget else ''})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
@@ -0,0 +1,108 @@
+import cv2
+import numpy as np
+
+import wall_detection
+
+TG22 = 13573 # tan(22.5 deg) in Q15, same constant cv2.Canny uses
+
+PREPROCESS_KEYS = ("close_morph", "morph_size", "kernel_size")
+
+
+def gradient_candidates(blurred):
+    """Sobel gradients + non-maximum suppression, as in cv2.Canny (L1 norm, aperture 3).
+
+    Returns a uint16 map holding the L1 gradient magnitude at pixels that are local
+    maxima along their gradient direction and 0 everywhere else. It depends only on
+    the blurred image, never on the hysteresis thresholds.
+    """
+    dx = cv2.Sobel(blurred, cv2.CV_16S, 1, 0, ksize=3, borderType=cv2.BORDER_REPLICATE).astype(np.int32)
+    dy = cv2.Sobel(blurred, cv2.CV_16S, 0, 1, ksize=3, borderType=cv2.BORDER_REPLICATE).astype(np.int32)
+    mag = np.abs(dx) + np.abs(dy)
+
+    # Zero-padded magnitude so neighbour lookups at the border compare against 0
+    p = np.pad(mag, 1)
+    h, w = mag.shape
+    def shifted(oy, ox):
+        return p[1 + oy:1 + oy + h, 1 + ox:1 + ox + w]
+
+    ax = np.abs(dx)
+    ay = np.abs(dy) << 15
+    tg22x = ax * TG22
+    tg67x = tg22x + (ax << 16)
+    horizontal = ay < tg22x
+    vertical = ay > tg67x
+    diagonal = ~(horizontal | vertical)
+    s = np.where((dx ^ dy) < 0, -1, 1)
+
+    nms = np.zeros(mag.shape, dtype=bool)
+    # Ties are broken like cv2.Canny: strictly greater than the "previous" neighbour
+    nms |= horizontal & (mag > shifted(0, -1)) & (mag >= shifted(0, 1))
+    nms |= vertical & (mag > shifted(-1, 0)) & (mag >= shifted(1, 0))
+    pos = diagonal & (s > 0)
+    nms |= pos & (mag > shifted(-1, -1)) & (mag > shifted(1, 1))
+    neg = diagonal & (s < 0)
+    nms |= neg & (mag > shifted(-1, 1)) & (mag > shifted(1, -1))
+    # L1 magnitude of 8-bit Sobel-3 gradients is at most 2040, fits in uint16
+    return np.where(nms, mag, 0).astype(np.uint16)
+
+
+def hysteresis(candidates, low, high):
+    """Vectorized hysteresis: keeps weak candidates 8-connected to a strong one.
+
+    Equivalent to the tracking step of cv2.Canny(blurred, low, high) for the
+    blurred image the candidates were computed from.
+    """
+    low, high = int(low), int(high)
+    if low > high: low, high = high, low
+    weak = cv2.compare(candidates, low, cv2.CMP_GT)
+    n_labels, labels = cv2.connectedComponents(weak, connectivity=8, ltype=cv2.CV_32S)
+    # Edge pixels are sparse, so only look at the weak ones from here on
+    idx = np.flatnonzero(weak)
+    weak_labels = labels.ravel()[idx]
+    keep = np.zeros(n_labels, dtype=bool)
+    keep[weak_labels[candidates.ravel()[idx] > high]] = True
+    keep[0] = False
+    edges = np.zeros(candidates.size, dtype=np.uint8)
+    edges[idx[keep[weak_labels]]] = 255
+    return edges.reshape(candidates.shape)
+
+
+class CachedEdgeStage:
+    """Preprocess + Canny with the threshold-independent work cached.
+
+    The blurred image is cached per preprocessing parameters, so when only
+    canny1/canny2 change the morphology and blur are skipped. With
+    cache_gradients=True the Sobel/non-maximum-suppression map is cached as well
+    and threshold changes only re-run hysteresis(). That is only a win on OpenCV
+    builds where cv2.Canny itself is slow (no SIMD / few threads); on a stock
+    build the one-off gradient pass costs ~10x a Canny call and hysteresis alone
+    is about as fast as the whole cv2.Canny, so it is off by default.
+    """
+
+    def __init__(self, cache_gradients=False, buffers=None):
+        self.cache_gradients = cache_gradients
+        self.buffers = buffers # Optional wall_detection.BufferPool
+        self.invalidate()
+
+    def invalidate(self):
+        self._img = None
+        self._preprocess_key = None
+        self._blurred = None
+        self._candidates = None
+
+    def blurred(self, img, params):
+        key = tuple(params[k] for k in PREPROCESS_KEYS)
+        if img is not self._img or key != self._preprocess_key or self._blurred is None:
+            self._blurred = wall_detection.preprocess(img, params, self.buffers)
+            self._img = img
+            self._preprocess_key = key
+            self._candidates = None
+        return self._blurred
+
+    def edges(self, img, params):
+        blurred = self.blurred(img, params)
+        if not self.cache_gradients:
+            return wall_detection.detect_edges(blurred, params, self.buffers)
+        if self._candidates is None:
+            self._candidates = gradient_candidates(blurred)
+        return hysteresis(self._candidates, params["canny1"], params["canny2"])
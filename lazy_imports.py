@@ -0,0 +1,107 @@
+import importlib
+import importlib.util
+import os
+import sys
+# argparse / subprocess are only needed by the benchmark and imported there,
+# this module is on every entry point's startup path
+
+
+def module_available(name):
+    """True if the module can be imported, checked without importing it.
+
+    Only the top-level package is looked up (find_spec on a submodule would
+    import its parent), so this is a cheap feature check, not a guarantee.
+    """
+    try:
+        return importlib.util.find_spec(name.split(".")[0]) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access.
+
+        cv2 = LazyModule("cv2")   # nothing imported yet
+        cv2.imread(path)          # cv2 is imported here, once
+    """
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            module = self.__dict__["_module"] = importlib.import_module(self._name)
+        return module
+
+    @property
+    def loaded(self):
+        return self.__dict__["_module"] is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}' ({'loaded' if self.loaded else 'not loaded'})>"
+
+
+# --- Import-time benchmark ---
+
+def import_times(module, python=sys.executable, cwd=None):
+    """Imports module in a fresh interpreter with -X importtime.
+
+    Returns (total_us, entries), entries being (self_us, cumulative_us, depth, name)
+    for every module imported, in import order.
+    """
+    import subprocess
+    proc = subprocess.run([python, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True,
+                          cwd=cwd or os.path.dirname(os.path.abspath(__file__)))
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr.strip().splitlines()[-1]}")
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line: continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    total = next((e[1] for e in reversed(entries) if e[3] == module), sum(e[0] for e in entries))
+    return total, entries
+
+
+def startup_time(python=sys.executable, cwd=None):
+    """Seconds from interpreter start to the first drawn app window (needs a display)."""
+    code = ("import time; t = time.perf_counter(); import tkinter as tk; import app; root = tk.Tk(); "
+            "app.WallLineDetectorApp(root); root.update(); print(time.perf_counter() - t); root.destroy()")
+    import subprocess
+    proc = subprocess.run([python, "-c", code], capture_output=True, text=True,
+                          cwd=cwd or os.path.dirname(os.path.abspath(__file__)))
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    return float(proc.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Import-time report for the app and CLI entry points.")
+    parser.add_argument("modules", nargs="*", default=["app", "prepare_wall_packet", "param_sweep"])
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list per module")
+    parser.add_argument("--window", action="store_true", help="Also time cold start to the first window")
+    args = parser.parse_args()
+
+    for name in args.modules:
+        try:
+            total, entries = import_times(name)
+        except RuntimeError as e:
+            print(f"{name}: {e}")
+            continue
+        print(f"import {name}: {total / 1000:.1f} ms")
+        # Direct dependencies only (depth 1), so nested packages aren't counted twice
+        direct = sorted((e for e in entries if e[2] == 1), key=lambda e: -e[1])
+        for self_us, cumulative_us, _, module in direct[:args.top]:
+            print(f"  {cumulative_us / 1000:8.1f} ms  {module}")
+    if args.window:
+        try:
+            print(f"Cold start to first window: {startup_time():.2f} s")
+        except RuntimeError as e:
+            print(f"Could not open a window: {e}")
@@ -0,0 +1,159 @@
+import cv2
+import numpy as np
+
+from wall_graph import fuse_walls
+
+# Probabilistic Hough settings
+HOUGH_THRESHOLD = 30    # Accumulator votes needed for a line
+HOUGH_MIN_LENGTH = 5
+HOUGH_MAX_GAP = 3       # Max gap (px) bridged between collinear edge pixels
+
+# Skeleton tracing settings
+SKELETON_DILATE = 3     # Edge dilation that turns the two edges of a stroke into one mask
+SKELETON_SIMPLIFY = 1.5 # Max deviation (px) of the traced walls from the skeleton
+
+
+class LSDBackend:
+    """OpenCV line segment detector (not built into some OpenCV versions)."""
+    name = "lsd"
+
+    @staticmethod
+    def available():
+        return hasattr(cv2, "createLineSegmentDetector")
+
+    def __init__(self):
+        self._lsd = cv2.createLineSegmentDetector(cv2.LSD_REFINE_STD)
+
+    def detect(self, edges):
+        detected = self._lsd.detect(edges)[0]
+        if detected is None:
+            return np.empty((0, 4), dtype=np.float32)
+        return detected.reshape(-1, 4)
+
+
+class HoughBackend:
+    """Probabilistic Hough transform (cv2.HoughLinesP), available in every build."""
+    name = "hough"
+
+    @staticmethod
+    def available():
+        return True
+
+    def __init__(self, threshold=HOUGH_THRESHOLD, min_length=HOUGH_MIN_LENGTH, max_gap=HOUGH_MAX_GAP):
+        self.threshold = threshold
+        self.min_length = min_length
+        self.max_gap = max_gap
+
+    def detect(self, edges):
+        lines = cv2.HoughLinesP(edges, 1, np.pi / 180, self.threshold, minLineLength=self.min_length,
+                                maxLineGap=self.max_gap)
+        if lines is None:
+            return np.empty((0, 4), dtype=np.float32)
+        return lines.reshape(-1, 4).astype(np.float32)
+
+
+class SkeletonBackend:
+    """Vectorizes the centerline of the wall strokes.
+
+    The edge map is dilated into a wall mask, thinned to a 1 px skeleton, and the
+    skeleton pixels are linked and fused into straight walls with wall_graph.
+    One wall per stroke instead of one per stroke side.
+    """
+    name = "skeleton"
+
+    @staticmethod
+    def available():
+        return True
+
+    def __init__(self, dilate=SKELETON_DILATE, simplify_tolerance=SKELETON_SIMPLIFY):
+        self.dilate = dilate
+        self.simplify_tolerance = simplify_tolerance
+
+    def wall_mask(self, edges):
+        if self.dilate <= 1:
+            return (edges > 0).astype(np.uint8)
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (self.dilate, self.dilate))
+        return (cv2.dilate(edges, kernel) > 0).astype(np.uint8)
+
+    def detect(self, edges):
+        skeleton = thin(self.wall_mask(edges))
+        links = skeleton_links(skeleton)
+        if not len(links):
+            return np.empty((0, 4), dtype=np.float32)
+        # Linked pixels share exact coordinates, so no snapping is needed
+        return fuse_walls(links, snap_tolerance=0, simplify_tolerance=self.simplify_tolerance).astype(np.float32)
+
+
+def _zhang_suen(mask):
+    """Zhang-Suen thinning of a 0/1 mask, vectorized over the whole image per sub-iteration."""
+    img = mask.astype(np.uint8).copy()
+    while True:
+        changed = False
+        for step in (0, 1):
+            p = np.pad(img, 1)
+            # Neighbours P2..P9, clockwise from north
+            n = [p[:-2, 1:-1], p[:-2, 2:], p[1:-1, 2:], p[2:, 2:], p[2:, 1:-1], p[2:, :-2], p[1:-1, :-2], p[:-2, :-2]]
+            count = sum(n)
+            transitions = sum((a == 0) & (b == 1) for a, b in zip(n, n[1:] + n[:1]))
+            p2, p4, p6, p8 = n[0], n[2], n[4], n[6]
+            if step == 0:
+                side = ((p2 & p4 & p6) == 0) & ((p4 & p6 & p8) == 0)
+            else:
+                side = ((p2 & p4 & p8) == 0) & ((p2 & p6 & p8) == 0)
+            remove = (img == 1) & (count >= 2) & (count <= 6) & (transitions == 1) & side
+            if remove.any():
+                img[remove] = 0
+                changed = True
+        if not changed:
+            return img
+
+
+def thin(mask):
+    """1 px skeleton of a 0/1 mask. Uses opencv-contrib's thinning when it is installed."""
+    if hasattr(cv2, "ximgproc"):
+        return (cv2.ximgproc.thinning(mask * 255) > 0).astype(np.uint8)
+    return _zhang_suen(mask)
+
+
+def skeleton_links(skeleton):
+    """Unit segments between 8-connected skeleton pixels, as an (N, 4) array.
+
+    A diagonal link is only added when no orthogonal path joins the two pixels
+    (m-adjacency), so corners don't turn into tiny triangles.
+    """
+    s = skeleton > 0
+    p = np.pad(s, 1)
+    right, down = p[1:-1, 2:], p[2:, 1:-1]
+    steps = (
+        (s & right, 1, 0),
+        (s & down, 0, 1),
+        (s & p[2:, 2:] & ~right & ~down, 1, 1),
+        (s & p[2:, :-2] & ~p[1:-1, :-2] & ~down, -1, 1),
+    )
+    parts = []
+    for linked, dx, dy in steps:
+        ys, xs = np.nonzero(linked)
+        parts.append(np.column_stack([xs, ys, xs + dx, ys + dy]))
+    return np.concatenate(parts).astype(np.float64)
+
+
+BACKENDS = {
+    LSDBackend.name: LSDBackend,
+    HoughBackend.name: HoughBackend,
+    SkeletonBackend.name: SkeletonBackend,
+}
+
+
+def create_backend(name):
+    if name not in BACKENDS:
+        raise KeyError(f"Unknown line backend: {name}")
+    return BACKENDS[name]()
+
+
+def available_backends():
+    """Names of the backends this OpenCV build provides, checked without creating them.
+
+    Builds that have the LSD constructor but refuse to run it still list "lsd";
+    wall_detection.create_line_detector falls back to Hough for those.
+    """
+    return [name for name, backend in BACKENDS.items() if backend.available()]
@@ -0,0 +1,402 @@
+import argparse
+import ctypes
+import ctypes.util
+import gc
+import io
+import os
+import struct
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+import roi_detection
+import wall_detection
+from lazy_imports import LazyModule, module_available
+
+# Detection within a fixed memory budget (e.g. a container's RSS limit).
+#
+# The peak footprint of every stage is estimated from the image size before
+# anything is decoded, then the largest processing scale (and, if needed, a tile
+# size) that keeps every stage under the budget is picked. The image is decoded
+# straight to that scale (and to grayscale when the parameters don't need
+# color), and every intermediate is dropped as soon as the next stage has it.
+
+PIL_AVAILABLE = module_available("PIL")
+PILImage = LazyModule("PIL.Image") # Only used for image sizes of formats parsed below
+
+# Extra bytes per working pixel allocated by each stage, measured with
+# measure_stage_bytes() (`python memory_budget.py map.png --measure`). LSD works
+# on a double-precision copy of the image, which makes line detection the peak.
+PREPROCESS_BYTES = 2        # gray + blurred; morphology adds one image copy per step on top
+CANNY_BYTES = 2             # edge map + Canny's internal map
+COMPONENTS_BYTES = 14       # int32 labels + union-find tables
+CONTOURS_BYTES = 2.5        # findContours' working copy + point storage
+LINE_BACKEND_BYTES = {"lsd": 24, "hough": 2, "skeleton": 36}
+RESULT_BYTES = 1.5          # Polygons / lines found, per pixel (generous, for very detailed maps)
+SAFETY = 1.15               # Headroom for allocator slack and estimation error
+
+SCALES = (1.0, 0.75, 0.5, 0.35, 0.25, 0.18, 0.125)  # Processing scales tried, largest first
+TILE_SIZES = (2048, 1024, 512)                      # Tile sizes tried at each scale, largest first
+
+MemoryPlan = namedtuple("MemoryPlan", ["scale", "tile", "color", "peak", "stage"])
+
+_SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+_REDUCED_FLAGS = {
+    (1, True): cv2.IMREAD_COLOR, (2, True): cv2.IMREAD_REDUCED_COLOR_2,
+    (4, True): cv2.IMREAD_REDUCED_COLOR_4, (8, True): cv2.IMREAD_REDUCED_COLOR_8,
+    (1, False): cv2.IMREAD_GRAYSCALE, (2, False): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    (4, False): cv2.IMREAD_REDUCED_GRAYSCALE_4, (8, False): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+def parse_size(text):
+    """'2G', '1500M', '512k' or a plain byte count -> bytes."""
+    text = str(text).strip().upper().removesuffix("B").removesuffix("I")
+    unit = text[-1:] if text[-1:] in _SIZE_UNITS else ""
+    value = float(text[:len(text) - len(unit)])
+    if value <= 0:
+        raise ValueError(f"Memory size must be positive: {text}")
+    return int(value * _SIZE_UNITS[unit])
+
+
+def format_size(size):
+    for unit in ("G", "M", "K"):
+        if size >= _SIZE_UNITS[unit]:
+            return f"{size / _SIZE_UNITS[unit]:.1f}{unit}"
+    return f"{int(size)}B"
+
+
+# --- Process memory ---
+
+_libc = None
+
+
+def release_memory():
+    """Hands freed heap memory back to the OS (glibc), so RSS follows what is actually in use.
+
+    Without it the large buffers freed by one stage can stay mapped and count
+    against the budget of the next one.
+    """
+    global _libc
+    gc.collect()
+    if _libc is None:
+        name = ctypes.util.find_library("c")
+        try:
+            _libc = ctypes.CDLL(name) if name else False
+        except OSError:
+            _libc = False
+    if _libc and hasattr(_libc, "malloc_trim"):
+        _libc.malloc_trim(0)
+
+
+def _proc_status(field):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def current_rss():
+    """Resident set size of this process in bytes (0 where /proc isn't available)."""
+    return _proc_status("VmRSS") or 0
+
+
+def peak_rss():
+    """Highest RSS of this process so far (since the last reset_peak_rss())."""
+    return _proc_status("VmHWM") or 0
+
+
+def reset_peak_rss():
+    """Restarts peak_rss() from the current RSS (Linux only). Returns False if unsupported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+# --- Image header ---
+
+def _jpeg_size(f):
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF: return None
+        while marker[1] == 0xFF: # Fill bytes
+            marker = marker[1:] + f.read(1)
+        length = struct.unpack(">H", f.read(2))[0]
+        if marker[1] in (0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF):
+            height, width = struct.unpack(">xHH", f.read(5))
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def image_info(path=None, data=None):
+    """(width, height, is_jpeg) from the file header without decoding, or None if unknown."""
+    f = io.BytesIO(data) if data is not None else open(path, "rb")
+    with f:
+        head = f.read(26)
+        if head.startswith(b"\x89PNG\r\n\x1a\n"):
+            return struct.unpack(">II", head[16:24]) + (False,)
+        if head.startswith(b"\xff\xd8"):
+            size = _jpeg_size(f)
+            return size + (True,) if size else None
+        if head.startswith(b"BM"):
+            width, height = struct.unpack("<ii", head[18:26])
+            return width, abs(height), False
+    if PIL_AVAILABLE:
+        try:
+            with PILImage.open(io.BytesIO(data) if data is not None else path) as im:
+                return im.width, im.height, im.format == "JPEG"
+        except Exception:
+            pass
+    return None
+
+
+# --- Footprint model ---
+
+def needs_color(params):
+    """Morphology runs on the color image; without it the pipeline only ever sees grayscale."""
+    return params["close_morph"] > 0 or params["morph_size"] > 0
+
+
+def _reduce_factor(scale):
+    # Largest JPEG DCT reduction (1/2, 1/4, 1/8) that still decodes at least `scale`
+    return next(r for r in (8, 4, 2, 1) if 1 / r >= scale)
+
+
+def decode_bytes(width, height, scale, color=True, jpeg=False):
+    """Peak bytes for decoding a width x height image at scale (see read_scaled).
+
+    OpenCV decodes into a buffer of its own and copies out of it, so a decode
+    peaks at twice its output. JPEGs are decoded reduced by libjpeg, other
+    formats at full size and then reduced.
+    """
+    channels = 3 if color else 1
+    full = width * height
+    r = _reduce_factor(scale)
+    decoded = full / (r * r)
+    if jpeg or r == 1:
+        peak = 2 * decoded
+    else:
+        peak = full + decoded
+    if 1 / r != scale:
+        peak = max(peak, decoded + full * scale * scale) # Resized the rest of the way
+    return channels * peak
+
+
+def stage_bytes(width, height, params, scale=1.0, tile=None, color=None, jpeg=False):
+    """Estimated peak bytes of every stage of a budgeted run: {stage: bytes}.
+
+    tile: tile size in working pixels (None = whole image at once). Tiled runs keep
+    the decoded image for all tiles; whole-image runs drop it after preprocessing.
+    """
+    color = needs_color(params) if color is None else color
+    channels = 3 if color else 1
+    work_w, work_h = max(1, int(width * scale)), max(1, int(height * scale))
+    pixels = work_w * work_h
+    if tile is None:
+        resident, step = 0, pixels
+    else:
+        pad = roi_detection.region_padding(params)
+        resident = channels * pixels
+        step = (min(tile, work_w) + 2 * pad) * (min(tile, work_h) + 2 * pad)
+    results = RESULT_BYTES * pixels
+    morph = channels * ((params["close_morph"] > 0) + 2 * (params["morph_size"] > 0))
+    stages = {
+        "decode": decode_bytes(width, height, scale, color, jpeg),
+        "preprocess": (resident or channels * pixels) + step * (morph + PREPROCESS_BYTES),
+        "edges": resident + step * (1 + CANNY_BYTES),
+        "contours": resident + step * (1 + CONTOURS_BYTES) + results,
+        "lines": resident + step * (1 + LINE_BACKEND_BYTES.get(params["line_backend"], 24)) + results,
+    }
+    if params["min_component"] > 0 or params["min_extent"] > 0:
+        stages["components"] = resident + step * (1 + COMPONENTS_BYTES)
+    return {name: int(size * SAFETY) for name, size in stages.items()}
+
+
+def plan_budget(width, height, params, budget, max_size=0, jpeg=False):
+    """Largest processing scale (then largest tile) whose estimated peak fits in budget bytes.
+
+    A full-resolution tiled run is preferred over a downscaled whole-image one.
+    If nothing fits, the smallest scale and tile are returned with a warning.
+    """
+    color = needs_color(params)
+    top = min(max_size / width, max_size / height, 1.0) if max_size else 1.0
+    scales = [top] + [s for s in SCALES if s < top]
+    plan = None
+    for scale in scales:
+        work = max(width, height) * scale
+        for tile in (None,) + tuple(t for t in TILE_SIZES if t < work):
+            stages = stage_bytes(width, height, params, scale, tile, color, jpeg)
+            stage = max(stages, key=stages.get)
+            plan = MemoryPlan(scale, tile, color, stages[stage], stage)
+            if plan.peak <= budget:
+                return plan
+    print(f"Warning: no processing scale fits {format_size(budget)}, "
+          f"using the smallest (estimated peak {format_size(plan.peak)}).")
+    return plan
+
+
+# --- Budgeted detection ---
+
+def read_scaled(path=None, data=None, scale=1.0, color=True, size=None):
+    """Decodes an image straight to scale (JPEG: reduced DCT decode) and to grayscale unless color.
+
+    Results match a full decode + INTER_AREA resize closely but not bit for bit;
+    grayscale decoding may differ from cvtColor by one grey level.
+    """
+    r = _reduce_factor(scale)
+    flag = _REDUCED_FLAGS[(r, color)]
+    if data is not None:
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+    else:
+        img = cv2.imread(path, flag)
+    if img is None:
+        raise ValueError(f"Could not decode image {path or '(upload)'}")
+    if size is not None and (img.shape[1], img.shape[0]) != size:
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    return img
+
+
+def _detect_whole(load, params, lsd):
+    # load() is only referenced by preprocess, so the decoded image is freed as soon as it's blurred
+    blurred = wall_detection.preprocess(load(), params)
+    edges = wall_detection.detect_edges(blurred, params)
+    del blurred
+    edges = wall_detection.filter_components(edges, params)
+    release_memory()
+    polygons = wall_detection.extract_polygons(edges, params)
+    release_memory()
+    lines = wall_detection.extract_lines(edges, params, lsd)
+    return polygons, lines
+
+
+def _detect_tiled(img, params, tile, lsd):
+    # Tiles without the merges, so walls are merged across tile borders afterwards
+    tile_params = dict(params, merge_lines=False, merge_polygons=False)
+    h, w = img.shape[:2]
+    polygons, lines = [], []
+    for y in range(0, h, tile):
+        for x in range(0, w, tile):
+            tile_polygons, tile_lines, _ = roi_detection.detect_in_rect(img, (x, y, x + tile, y + tile),
+                                                                        tile_params, lsd)
+            polygons += tile_polygons
+            lines += tile_lines
+            release_memory()
+    return polygons, lines
+
+
+def budget_detect(params, budget, path=None, data=None, max_size=0, lsd=None):
+    """Wall detection that stays within budget bytes of RSS (including what the process already uses).
+
+    Returns (polygons, lines, plan, (width, height)), walls in original image coordinates.
+    Tiled runs cut walls at tile borders like roi_detection.detect_in_rect, then
+    merge (if enabled) over the whole image.
+    """
+    params = wall_detection.make_params(**params)
+    info = image_info(path, data)
+    if info is None:
+        # Unknown header: decode once to learn the size, that decode is the floor
+        print("Warning: image size unknown before decoding, the decode itself is not budgeted.")
+        height, width = read_scaled(path, data, color=False).shape[:2]
+        jpeg = False
+    else:
+        width, height, jpeg = info
+    plan = plan_budget(width, height, params, budget - current_rss(), max_size, jpeg)
+    work_size = (max(1, int(width * plan.scale)), max(1, int(height * plan.scale)))
+    load = lambda: read_scaled(path, data, plan.scale, plan.color, work_size)
+
+    if plan.tile is None:
+        polygons, lines = _detect_whole(load, params, lsd)
+    else:
+        img = load()
+        polygons, lines = _detect_tiled(img, params, plan.tile, lsd)
+        del img
+        release_memory()
+        if params["merge_polygons"] and wall_detection.SHAPELY_AVAILABLE:
+            polygons = wall_detection.merge_polygons(polygons, params["poly_thresh"])
+        if params["merge_lines"]:
+            lines = wall_detection.merge_lines(lines, params["line_thresh"])
+
+    scale = np.array([width / work_size[0], height / work_size[1]])
+    polygons = [np.rint(np.asarray(p).reshape(-1, 2) * scale).astype(np.int32) for p in polygons]
+    lines = np.rint(np.asarray(lines, dtype=np.float64).reshape(-1, 4) * np.tile(scale, 2)).astype(np.int32)
+    release_memory()
+    return polygons, lines, plan, (width, height)
+
+
+def measure_stage_bytes(img, params, lsd=None):
+    """Measured peak bytes per pixel allocated by each stage on img (Linux), to recalibrate the constants."""
+    params = wall_detection.make_params(**params)
+    pixels = img.shape[0] * img.shape[1]
+    measured = {}
+
+    def run(name, fn):
+        release_memory()
+        if not reset_peak_rss(): raise OSError("Peak RSS can't be reset on this system.")
+        base = current_rss()
+        out = fn()
+        measured[name] = (peak_rss() - base) / pixels
+        return out
+
+    blurred = run("preprocess", lambda: wall_detection.preprocess(img, params))
+    edges = run("edges", lambda: wall_detection.detect_edges(blurred, params))
+    del blurred
+    run("components", lambda: wall_detection.filter_components(edges.copy(), dict(params, min_component=20)))
+    run("contours", lambda: wall_detection.find_contours(edges))
+    detector = lsd or wall_detection.create_line_detector(params["line_backend"])
+    run("lines", lambda: detector.detect(edges))
+    return measured
+
+
+if __name__ == "__main__":
+    from detection_service import spec_from_query
+
+    parser = argparse.ArgumentParser(description="Plan (and run) wall detection within a memory budget.")
+    parser.add_argument("image")
+    parser.add_argument("--budget", default="2G", help="RSS ceiling, e.g. 2G or 1500M (default: 2G)")
+    parser.add_argument("--max-size", type=int, default=0, help="Never process above this size (0 = full size)")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="Detection parameter, e.g. --param close_morph=0 (repeatable)")
+    parser.add_argument("--run", action="store_true", help="Run the detection and report the peak RSS")
+    parser.add_argument("--measure", action="store_true", help="Measure bytes per pixel of each stage on this image")
+    args = parser.parse_args()
+
+    try:
+        params = spec_from_query({k: [v] for k, v in (p.split("=", 1) for p in args.param)})["params"]
+        budget = parse_size(args.budget)
+    except (ValueError, KeyError) as e:
+        raise SystemExit(f"Bad argument: {e}")
+    params = wall_detection.make_params(**params)
+    info = image_info(args.image)
+    if info is None: raise SystemExit(f"Can't read the size of {args.image}")
+    width, height, jpeg = info
+    base = current_rss()
+    plan = plan_budget(width, height, params, budget - base, args.max_size, jpeg)
+    print(f"{width}x{height}{' JPEG' if jpeg else ''}, budget {format_size(budget)} "
+          f"({format_size(base)} already in use)")
+    print(f"Plan: scale {plan.scale:.3g}, {'tiles of ' + str(plan.tile) + 'px' if plan.tile else 'whole image'}, "
+          f"{'color' if plan.color else 'grayscale'} decode; estimated peak {format_size(plan.peak + base)} "
+          f"in {plan.stage}")
+    for stage, size in stage_bytes(width, height, params, plan.scale, plan.tile, plan.color, jpeg).items():
+        print(f"  {stage:<12}{format_size(size):>10}")
+
+    if args.measure:
+        img = read_scaled(args.image, scale=plan.scale, color=plan.color,
+                          size=(max(1, int(width * plan.scale)), max(1, int(height * plan.scale))))
+        for stage, per_pixel in measure_stage_bytes(img, params).items():
+            print(f"  measured {stage:<12}{per_pixel:6.2f} B/px")
+        del img
+    if args.run:
+        release_memory()
+        reset_peak_rss()
+        polygons, lines, plan, _ = budget_detect(params, budget, path=args.image, max_size=args.max_size)
+        print(f"{len(polygons)} polygons, {len(lines)} lines; peak RSS {format_size(peak_rss())} "
+              f"of {format_size(budget)}")
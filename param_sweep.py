@@ -0,0 +1,233 @@
+import argparse
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+import line_backends
+import wall_detection
+from core_budget import available_cores, opencv_threads, threads_per_worker
+
+# Parameters each shared stage depends on. Candidates that agree on these keys
+# reuse the same intermediate result instead of recomputing it.
+PREPROCESS_KEYS = ("close_morph", "morph_size", "kernel_size")
+EDGE_KEYS = PREPROCESS_KEYS + ("canny1", "canny2", "min_component", "min_extent", "line_backend")
+
+# metric name -> "max" or "min"
+DEFAULT_OBJECTIVES = {
+    "edge_coverage": "max",
+    "wall_count": "min",
+    "fragment_ratio": "min",
+}
+
+# Numeric parameters that can be swept from the command line
+SWEEP_KEYS = ("close_morph", "kernel_size", "canny1", "canny2", "min_component", "min_extent", "epsilon", "min_area",
+              "line_thresh")
+
+FRAGMENT_LENGTH = 10 # Walls shorter than this (px) count as fragments
+COVERAGE_THICKNESS = 3 # Wall stroke width used when measuring edge coverage
+
+
+def param_grid(base=None, **ranges):
+    """Cartesian product of the given parameter ranges on top of base (or DEFAULT_PARAMS)."""
+    base = wall_detection.make_params(**(base or {}))
+    keys = list(ranges)
+    return [dict(base, **dict(zip(keys, values))) for values in itertools.product(*(ranges[k] for k in keys))]
+
+
+def param_samples(n, base=None, seed=None, **ranges):
+    """n random parameter sets, each value drawn from its range. Duplicates are dropped."""
+    base = wall_detection.make_params(**(base or {}))
+    rng = random.Random(seed)
+    seen = set(); samples = []
+    for _ in range(n * 10): # Bounded retries when the space is small
+        if len(samples) >= n: break
+        candidate = dict(base, **{k: rng.choice(list(v)) for k, v in ranges.items()})
+        key = tuple(sorted(candidate.items()))
+        if key in seen: continue
+        seen.add(key); samples.append(candidate)
+    return samples
+
+
+def _stage_key(params, keys):
+    return tuple(params[k] for k in keys)
+
+
+def score_walls(polygons, lines, edges):
+    """Quality metrics for one detection result."""
+    segments = []
+    for poly in polygons:
+        pts = poly.reshape(-1, 2)
+        segments.append(np.hstack([pts, np.roll(pts, -1, axis=0)]))
+    if lines:
+        segments.append(np.asarray(lines, dtype=np.int32).reshape(-1, 4))
+    segments = np.concatenate(segments) if segments else np.empty((0, 4), dtype=np.int32)
+
+    wall_count = len(segments)
+    if wall_count:
+        lengths = np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+        fragment_ratio = float(np.count_nonzero(lengths < FRAGMENT_LENGTH)) / wall_count
+    else:
+        fragment_ratio = 0.0
+
+    # Fraction of edge pixels that lie under a detected wall
+    edge_pixels = cv2.countNonZero(edges)
+    if edge_pixels and wall_count:
+        mask = np.zeros(edges.shape[:2], dtype=np.uint8)
+        cv2.polylines(mask, [s.reshape(2, 1, 2) for s in segments.astype(np.int32)], False, 255, COVERAGE_THICKNESS)
+        edge_coverage = cv2.countNonZero(cv2.bitwise_and(edges, mask)) / edge_pixels
+    else:
+        edge_coverage = 0.0
+
+    return {"wall_count": wall_count, "edge_coverage": edge_coverage, "fragment_ratio": fragment_ratio}
+
+
+def dominates(a, b, objectives):
+    """True if metrics a Pareto-dominate metrics b."""
+    better = False
+    for name, direction in objectives.items():
+        va, vb = a[name], b[name]
+        if direction == "min": va, vb = -va, -vb
+        if va < vb: return False
+        if va > vb: better = True
+    return better
+
+
+def pareto_front(results, objectives=DEFAULT_OBJECTIVES):
+    return [r for r in results if not any(dominates(o["metrics"], r["metrics"], objectives) for o in results if o is not r)]
+
+
+def auto_tune(img, candidates, objectives=DEFAULT_OBJECTIVES, workers=None, score_fn=score_walls):
+    """Evaluates all candidate parameter sets against img in parallel.
+
+    Shared stages are computed once: preprocessing per unique PREPROCESS_KEYS, and
+    edges / contours / raw line segments per unique EDGE_KEYS. The image is shared
+    between worker threads (OpenCV releases the GIL), so nothing is copied per candidate.
+    Returns (results, pareto), each result being {"params", "metrics"}.
+    """
+    workers = workers or available_cores()
+    local = threading.local()
+
+    def get_lsd(backend):
+        # LSD instances aren't safe to share between threads
+        if not hasattr(local, "detectors"):
+            local.detectors = {}
+        if backend not in local.detectors:
+            local.detectors[backend] = wall_detection.create_line_detector(backend)
+        return local.detectors[backend]
+
+    edge_groups = {}
+    for params in candidates:
+        edge_groups.setdefault(_stage_key(params, EDGE_KEYS), []).append(params)
+    preprocess_params = {}
+    for group in edge_groups.values():
+        preprocess_params.setdefault(_stage_key(group[0], PREPROCESS_KEYS), group[0])
+
+    def run_preprocess(params):
+        return wall_detection.preprocess(img, params)
+
+    def run_edge_group(group, blurred):
+        edges = wall_detection.filter_components(wall_detection.detect_edges(blurred, group[0]), group[0])
+        contours_raw = wall_detection.find_contours(edges)
+        backend = group[0]["line_backend"]
+        raw_lines = wall_detection.detect_line_segments(edges, get_lsd(backend), backend)
+        group_results = []
+        for params in group:
+            polygons = wall_detection.approximate_polygons(contours_raw, params)
+            lines = wall_detection.finish_lines(raw_lines, params)
+            group_results.append({"params": params, "metrics": score_fn(polygons, lines, edges)})
+        return group_results
+
+    # The worker threads share OpenCV's thread pool, split the cores between them
+    with opencv_threads(threads_per_worker(workers)), ThreadPoolExecutor(max_workers=workers) as pool:
+        keys = list(preprocess_params)
+        blurred_by_key = dict(zip(keys, pool.map(run_preprocess, (preprocess_params[k] for k in keys))))
+        futures = [pool.submit(run_edge_group, group, blurred_by_key[_stage_key(group[0], PREPROCESS_KEYS)])
+                   for group in edge_groups.values()]
+        results = [r for f in futures for r in f.result()]
+
+    return results, pareto_front(results, objectives)
+
+
+def benchmark_line_backends(img, params=None, backends=None, repeats=3, score_fn=score_walls):
+    """Runs every line backend on the same edge map. Returns one result per backend:
+    {"backend", "seconds" (best of repeats), "segments", "mean_length", "metrics"}."""
+    params = wall_detection.make_params(**(params or {}))
+    edges = wall_detection.filter_components(
+        wall_detection.detect_edges(wall_detection.preprocess(img, params), params), params)
+    results = []
+    for backend in backends or line_backends.available_backends():
+        detector = wall_detection.create_line_detector(backend)
+        best = None
+        for _ in range(max(1, repeats)):
+            start = time.perf_counter()
+            lines = wall_detection.detect_line_segments(edges, detector, backend)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        segments = np.asarray(lines, dtype=np.float64).reshape(-1, 4)
+        lengths = np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+        results.append({"backend": backend, "seconds": best, "segments": len(lines),
+                        "mean_length": float(lengths.mean()) if len(lengths) else 0.0,
+                        "metrics": score_fn([], lines, edges)})
+    return results
+
+
+def _parse_range(text):
+    """'a:b:step' (inclusive) or 'a,b,c' -> list of numbers."""
+    as_number = lambda v: float(v) if "." in v else int(v)
+    if ":" in text:
+        start, stop, step = (as_number(v) for v in text.split(":"))
+        if all(isinstance(v, int) for v in (start, stop, step)):
+            return list(range(start, stop + 1, step))
+        return np.arange(start, stop + step / 2, step).tolist()
+    return [as_number(v) for v in text.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel parameter sweep / auto-tune for wall detection.")
+    parser.add_argument("image")
+    parser.add_argument("--max-size", type=int, default=1600, help="Downscale the map to fit this size (0 = full size)")
+    parser.add_argument("--samples", type=int, default=0, help="Random sample this many sets instead of the full grid")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--benchmark-lines", action="store_true",
+                        help="Compare the line detector backends on this image instead of sweeping")
+    parser.add_argument("--line-backend", dest="line_backend", type=lambda v: v.split(","), default=None,
+                        help="Comma separated line backends (%s)" % ", ".join(line_backends.BACKENDS))
+    for name in SWEEP_KEYS:
+        parser.add_argument("--" + name.replace("_", "-"), dest=name, type=_parse_range, default=None,
+                            help="Range as start:stop:step or a comma separated list")
+    args = parser.parse_args()
+
+    img = cv2.imread(args.image)
+    if img is None: raise SystemExit(f"Could not read image {args.image}")
+    if args.max_size:
+        scale = min(args.max_size / img.shape[1], args.max_size / img.shape[0], 1.0)
+        if scale < 1.0:
+            img = cv2.resize(img, (max(1, int(img.shape[1] * scale)), max(1, int(img.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+
+    if args.benchmark_lines:
+        print(f"Line backends on {img.shape[1]}x{img.shape[0]} image:")
+        for r in benchmark_line_backends(img, backends=args.line_backend):
+            m = r["metrics"]
+            print(f"  {r['backend']:<9} {r['seconds'] * 1000:8.1f} ms  segments={r['segments']} "
+                  f"mean length={r['mean_length']:.1f}  coverage={m['edge_coverage']:.3f} fragments={m['fragment_ratio']:.3f}")
+        raise SystemExit(0)
+
+    ranges = {name: getattr(args, name) for name in SWEEP_KEYS + ("line_backend",) if getattr(args, name) is not None}
+    if not ranges:
+        ranges = {"canny1": list(range(20, 201, 20)), "canny2": list(range(60, 401, 40)), "close_morph": [0, 3, 5, 7]}
+    candidates = param_samples(args.samples, seed=args.seed, **ranges) if args.samples else param_grid(**ranges)
+
+    print(f"Evaluating {len(candidates)} parameter sets on {img.shape[1]}x{img.shape[0]} image...")
+    start = time.perf_counter()
+    results, pareto = auto_tune(img, candidates, workers=args.workers)
+    print(f"Done in {time.perf_counter() - start:.2f}s. Pareto-best settings ({len(pareto)}):")
+    for r in sorted(pareto, key=lambda r: -r["metrics"]["edge_coverage"]):
+        m = r["metrics"]
+        swept = ", ".join(f"{k}={r['params'][k]}" for k in ranges)
+        print(f"  {swept}  ->  coverage={m['edge_coverage']:.3f} walls={m['wall_count']} fragments={m['fragment_ratio']:.3f}")
@@ -1,75 +1,206 @@
+import bisect
+import itertools
 import json
 
-import cv2
+import numpy as np
+
+from lazy_imports import LazyModule
+from wall_budget import budget_walls
+from wall_dedup import dedup_walls
+from wall_graph import fuse_walls
+from wall_io import load_walls
+from wall_topology import clean_topology
+
+cv2 = LazyModule("cv2") # Only needed to read the map size
+
+# prepare_walls() clean-up used when walls go to Foundry (websocket send, scene export)
+# and the caller doesn't pick its own
+DEFAULT_CLEANUP = {"dedup_tolerance": 1.0, "split_tolerance": 2.0}
+# Polygon points closer than this (px) to the previous kept point are dropped on export
+MIN_DISTANCE = 20
 
 
 def load_file(path):
+    """Loads wall data from a JSON export (streamed) or a binary .fvw export (memory-mapped)."""
     try:
-        with open(path, 'r') as file:
-            data = json.load(file)
-        return data
+        return load_walls(path)
     except Exception as e:
         print(f"Error loading JSON file: {e}")
         return None
 
 
+def _keep_far_points(points, starts, min_distance):
+    """Mask of points kept by the min_distance filter, for all polygons at once.
+
+    A point is kept if it is further than min_distance from the last *kept* point
+    of its polygon (the first point is always kept). Consecutive distances are
+    vectorized; only the runs that follow a dropped point are walked in Python.
+    """
+    n = len(points)
+    keep = np.ones(n, dtype=bool)
+    if n < 2: return keep
+    step_sq = np.sum(np.diff(points, axis=0).astype(np.float64) ** 2, axis=1)
+    min_sq = float(min_distance) ** 2
+    is_start = np.zeros(n, dtype=bool)
+    is_start[starts] = True
+    # Points too close to their predecessor (never the first point of a polygon)
+    close = np.flatnonzero(step_sq <= min_sq) + 1
+    close = close[~is_start[close]]
+    if not len(close): return keep
+
+    poly_end = np.empty(n, dtype=np.int64) # Exclusive end index of each point's polygon
+    bounds = np.append(starts, n)
+    poly_end[:] = np.repeat(bounds[1:], np.diff(bounds))
+    poly_end = poly_end.tolist()
+
+    xs = points[:, 0].tolist(); ys = points[:, 1].tolist() # Plain floats for the scalar loop
+    close_list = close.tolist()
+    c = 0
+    while c < len(close_list):
+        i = close_list[c]
+        # The predecessor of i is kept here, and i is within min_distance of it
+        lx, ly = xs[i - 1], ys[i - 1]
+        end = poly_end[i]
+        keep[i] = False
+        j = i + 1
+        while j < end and (xs[j] - lx) ** 2 + (ys[j] - ly) ** 2 <= min_sq:
+            keep[j] = False
+            j += 1
+        # Everything from j up to the next "close" point is kept, skip ahead
+        c = bisect.bisect_right(close_list, j, c + 1)
+    return keep
+
+
+def load_polygon_lines_array(json_file, min_distance=5, proportion_x=1, proportion_y=1):
+    """Vectorized polygon/line -> wall conversion. Returns an Nx4 array of [x1, y1, x2, y2].
+
+    Same walls, in the same order, as load_polygon_lines: each polygon is filtered
+    with min_distance, closed, and everything is scaled by proportion_x/y.
+    """
+    scale = np.array([proportion_x, proportion_y, proportion_x, proportion_y])
+    parts = []
+
+    polygons = [p for p in json_file.get("polygons", []) if len(p)]
+    if polygons:
+        lengths = np.array([len(p) for p in polygons], dtype=np.int64)
+        if isinstance(polygons[0], np.ndarray):
+            points = np.concatenate([p.reshape(-1, 2) for p in polygons])
+        else:
+            points = np.array(list(itertools.chain.from_iterable(polygons))).reshape(-1, 2)
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        keep = _keep_far_points(points, starts, min_distance)
+
+        kept = points[keep]
+        kept_poly = np.repeat(np.arange(len(polygons)), lengths)[keep]
+        # Next point of each kept point, wrapping to the first one of its polygon
+        nxt = np.arange(1, len(kept) + 1)
+        last_of_poly = np.append(kept_poly[1:] != kept_poly[:-1], True)
+        first_of_poly = np.flatnonzero(np.insert(kept_poly[1:] != kept_poly[:-1], 0, True))
+        nxt[last_of_poly] = first_of_poly
+        parts.append(np.hstack([kept, kept[nxt]]))
+
+    lines = json_file.get("lines", [])
+    if len(lines):
+        parts.append(np.asarray(lines).reshape(-1, 4))
+
+    if not parts:
+        return np.empty((0, 4))
+    return np.concatenate(parts) * scale
+
+
 def load_polygon_lines(json_file, min_distance=5,proportion_x=1, proportion_y=1):
-    lines = []
     print("json file keys", json_file.keys())
-    for polygon in json_file.get("polygons", {}):
-        merged_points = []
-        for point in polygon:
-            if not merged_points:
-                merged_points.append(point)
-            else:
-                last_point = merged_points[-1]
-                distance = ((point[0] - last_point[0]) ** 2 + (point[1] - last_point[1]) ** 2) ** 0.5
-                if distance > min_distance:
-                    merged_points.append(point)
-        for i in range(len(merged_points)):
-            x1, y1 = merged_points[i]
-            x2, y2 = merged_points[(i + 1) % len(merged_points)]
-            line = [[x1*proportion_x, y1*proportion_y], [x2*proportion_x, y2*proportion_y]]
-            lines.append(line)
-    print("prepqre lines")
-    for line in json_file.get("lines", []):
-        x1, y1 , x2, y2 = line
-        line = [[x1*proportion_x, y1*proportion_y], [x2*proportion_x, y2*proportion_y]]
-        lines.append(line)
-    print("number of lines", len(lines))
-    return lines
-
-
-def prepare_packet(json_file,scnene_id,proportion_x=1, proportion_y=1):
+    walls = load_polygon_lines_array(json_file, min_distance, proportion_x, proportion_y)
+    print("number of lines", len(walls))
+    return walls.reshape(-1, 2, 2).tolist()
+
+
+def wall_document(c, wall_id=None):
+    """Foundry Wall document data for wall coordinates c = [x1, y1, x2, y2]."""
+    return {"light": 20,
+            "sight": 20,
+            "sound": 20,
+            "move": 20,
+            "c": c,
+            "_id": wall_id, "dir": 0,
+            "door": 0,
+            "ds": 0,
+            "threshold": {"light": None, "sight": None, "sound": None, "attenuation": False},
+            "flags": {}}
+
+
+def wall_message(c, scnene_id):
+    """One Foundry "create Wall" document message for wall coordinates c = [x1, y1, x2, y2]."""
+    return {"type": "Wall", "action": "create", "operation": {"data": [wall_document(c)],
+        "modifiedTime": 1743865107186,
+        "render": True,
+        "renderSheet": False,
+        "parentUuid":
+            "Scene."+scnene_id,}}
+
+
+def prepare_walls(json_file, proportion_x=1, proportion_y=1, min_distance=MIN_DISTANCE, fuse_tolerance=None,
+                  split_tolerance=None, dedup_tolerance=None, parallel_distance=None, max_walls=None):
+    """Wall array (Nx4) for a wall JSON, with the optional clean-up stages applied.
+
+    dedup_tolerance: if set, duplicate walls and walls contained in another one
+    within this distance are dropped; parallel_distance additionally drops walls
+    running alongside a longer one closer than that (see wall_dedup.dedup_walls).
+    split_tolerance: if set, walls are split at crossings and T-junctions closer
+    than this distance are snapped (see wall_topology.clean_topology).
+    fuse_tolerance: if set, chains of nearly collinear walls are fused (see
+    wall_graph.fuse_walls), endpoints snapped and error bounded by this distance.
+    max_walls: if set, the result is simplified down to at most this many walls
+    (see wall_budget.budget_walls) and the geometric error is printed.
+    """
+    walls = load_polygon_lines_array(json_file, min_distance, proportion_x, proportion_y)
+    print("number of lines", len(walls))
+    if dedup_tolerance or parallel_distance:
+        walls = dedup_walls(walls, tolerance=dedup_tolerance or 1.0, parallel_distance=parallel_distance)
+        print("number of lines after dedup", len(walls))
+    if split_tolerance:
+        walls = clean_topology(walls, tolerance=split_tolerance)
+        print("number of lines after splitting", len(walls))
+    if fuse_tolerance:
+        walls = fuse_walls(walls, snap_tolerance=fuse_tolerance, simplify_tolerance=fuse_tolerance)
+        print("number of lines after fusing", len(walls))
+    if max_walls:
+        walls, report = budget_walls(walls, max_walls)
+        print("number of lines after budget", len(walls), "max deviation %.2f px, removed area %.1f px^2" %
+              (report["max_deviation"], report["total_area"]))
+        if report["dropped_walls"]:
+            print("Warning: budget dropped", report["dropped_walls"], "walls (%.1f px)" % report["dropped_length"])
+    return walls
+
+
+def prepare_packet(json_file,scnene_id,proportion_x=1, proportion_y=1, **cleanup):
+    """cleanup: optional prepare_walls() stage settings (fuse_tolerance, split_tolerance, ...)."""
     all_messages = []
-    min_distance = 20
-    lines = load_polygon_lines(json_file,min_distance,proportion_x, proportion_y)
-    min_x = min([line[0][0] for line in lines])
-    min_y = min([line[0][1] for line in lines])
-    max_x = max([line[1][0] for line in lines])
-    max_y = max([line[1][1] for line in lines])
-    for i in range(5):
-        print(f"Line {i}: {lines[i]}")  # Print the first 5 lines for debugging
-    for line in lines:
-        message = {"type": "Wall", "action": "create", "operation": {"data": [
-            {"light": 20,
-             "sight": 20,
-             "sound": 20,
-             "move": 20,
-             "c": [line[0][0], line[0][1] , line[1][0], line[1][1]],
-             "_id": None, "dir": 0,
-             "door": 0,
-             "ds": 0,
-             "threshold": {"light": None, "sight": None, "sound": None, "attenuation": False},
-             "flags": {}}],
-            "modifiedTime": 1743865107186,
-            "render": True,
-            "renderSheet": False,
-            "parentUuid":
-                "Scene."+scnene_id,}}
-        all_messages.append(message)
+    print("json file keys", json_file.keys())
+    walls = prepare_walls(json_file, proportion_x, proportion_y, **cleanup)
+    for i, line in enumerate(walls[:5].tolist()):
+        print(f"Line {i}: {line}")  # Print the first 5 lines for debugging
+    for c in walls.tolist():
+        all_messages.append(wall_message(c, scnene_id))
     return all_messages
 
+
+_C_PLACEHOLDER = "__WALL_C__"
+
+
+def iter_packet_frames(walls, scene_id, event="modifyDocument"):
+    """Lazily yields wire-ready frames, json.dumps([event, wall_message(c, scene_id)]) per wall.
+
+    The constant part of the message is serialized once; only the coordinates are
+    formatted per wall, so memory stays flat regardless of the wall count.
+    """
+    template = json.dumps([event, wall_message(_C_PLACEHOLDER, scene_id)], ensure_ascii=False)
+    prefix, suffix = template.split(json.dumps(_C_PLACEHOLDER))
+    # json encodes ints with str() and finite floats with float.__repr__
+    for c in np.asarray(walls).reshape(-1, 4).tolist():
+        yield f"{prefix}[{', '.join(map(repr, c))}]{suffix}"
+
+
 def get_image_proportion(orignialimage_path,map_dim_x,map_dim_y):
     # Load the original image
     image = cv2.imread(orignialimage_path)
@@ -85,12 +216,7 @@ def get_image_proportion(orignialimage_path,map_dim_x,map_dim_y):
 
     return proportion_x, proportion_y
 
-def send_packet_from_json(wall_data, scene_id, orignialimage_path=None, map_dim_x=None, map_dim_y=None):
-
-    proportion_x, proportion_y = 1, 1
-    if orignialimage_path and map_dim_x and map_dim_y:
-        proportion_x, proportion_y = get_image_proportion(orignialimage_path,map_dim_x,map_dim_y)
-
+def _resolve_wall_data(wall_data):
     json_file = None
     if isinstance(wall_data, str):
         print(f"Loading JSON file from {wall_data}")
@@ -101,6 +227,19 @@ def send_packet_from_json(wall_data, scene_id, orignialimage_path=None, map_dim_
     if json_file is None:
         print("Failed to load JSON file.")
         raise ValueError("Invalid JSON data provided.")
+    return json_file
+
+
+def _resolve_proportion(orignialimage_path=None, map_dim_x=None, map_dim_y=None):
+    if orignialimage_path and map_dim_x and map_dim_y:
+        return get_image_proportion(orignialimage_path,map_dim_x,map_dim_y)
+    return 1, 1
+
+
+def send_packet_from_json(wall_data, scene_id, orignialimage_path=None, map_dim_x=None, map_dim_y=None):
+
+    proportion_x, proportion_y = _resolve_proportion(orignialimage_path, map_dim_x, map_dim_y)
+    json_file = _resolve_wall_data(wall_data)
     all_messages = prepare_packet(json_file,scene_id,proportion_x, proportion_y)
     return all_messages
 
@@ -111,6 +250,25 @@ def packet_from_scene(wall_data,original_image,scene,scale_x,scale_y):
     return send_packet_from_json(wall_data, scene_id, original_image, width, height)
 
 
+def packet_frames_from_json(wall_data, scene_id, orignialimage_path=None, map_dim_x=None, map_dim_y=None,
+                            **cleanup):
+    """Streaming counterpart of send_packet_from_json: yields serialized modifyDocument frames.
+
+    cleanup: optional prepare_walls() stage settings (fuse_tolerance, split_tolerance, ...).
+    """
+    proportion_x, proportion_y = _resolve_proportion(orignialimage_path, map_dim_x, map_dim_y)
+    json_file = _resolve_wall_data(wall_data)
+    walls = prepare_walls(json_file, proportion_x, proportion_y, **cleanup)
+    return iter_packet_frames(walls, scene_id)
+
+
+def packet_frames_from_scene(wall_data,original_image,scene,scale_x,scale_y, **cleanup):
+    scene_id = scene.get("_id")
+    width = scene.get("width")*scale_x
+    height = scene.get("height")*scale_y
+    return packet_frames_from_json(wall_data, scene_id, original_image, width, height, **cleanup)
+
+
 
 
 if __name__ == "__main__":
@@ -0,0 +1,152 @@
+from collections import namedtuple
+
+import numpy as np
+
+import wall_detection
+
+# rect is (x0, y0, x1, y1) in image pixels, x1/y1 exclusive. overrides holds the
+# detection parameters that differ from the global ones inside this region.
+Region = namedtuple("Region", ["rect", "overrides"])
+
+
+def region_padding(params):
+    """Context needed around a rectangle so the pipeline sees the same pixels as a full run.
+
+    Every neighbourhood operation (close, top-hat, blur, Sobel in Canny) can pull in
+    pixels up to its kernel size away, so the padding is their sum.
+    """
+    pad = params["close_morph"] + params["kernel_size"] + 3
+    if params["morph_size"] > 0:
+        pad += 9
+    return pad
+
+
+def clip_rect(rect, shape):
+    h, w = shape[:2]
+    x0, y0, x1, y1 = rect
+    x0, x1 = sorted((int(x0), int(x1)))
+    y0, y1 = sorted((int(y0), int(y1)))
+    return max(0, x0), max(0, y0), min(w, x1), min(h, y1)
+
+
+def _polygon_centers(polygons):
+    if not polygons:
+        return np.empty((0, 2))
+    lengths = np.array([len(p) for p in polygons])
+    points = np.concatenate([np.asarray(p).reshape(-1, 2) for p in polygons]).astype(np.float64)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    return np.add.reduceat(points, starts, axis=0) / lengths[:, None]
+
+
+def _line_centers(lines):
+    if not len(lines):
+        return np.empty((0, 2))
+    lines = np.asarray(lines, dtype=np.float64).reshape(-1, 4)
+    return (lines[:, :2] + lines[:, 2:]) / 2
+
+
+def _inside(centers, rect):
+    x0, y0, x1, y1 = rect
+    return (centers[:, 0] >= x0) & (centers[:, 0] < x1) & (centers[:, 1] >= y0) & (centers[:, 1] < y1)
+
+
+def owned_masks(polygons, lines, rect):
+    """A polygon / line belongs to the rectangle its center (mean point / midpoint) falls in."""
+    return _inside(_polygon_centers(polygons), rect), _inside(_line_centers(lines), rect)
+
+
+def detect_in_rect(img, rect, params, lsd=None):
+    """Runs detection on rect plus padding. Returns (polygons, lines, edges) in image
+    coordinates; only the walls owned by rect are kept and edges covers rect only.
+
+    The edge map inside rect matches a full-image run except for hysteresis /
+    component effects across the padding: Canny can follow a weak chain to a strong
+    pixel outside the crop, and small blob filtering sees blobs cut by the crop as
+    smaller. Contours and lines that run past the padded crop are cut at its border,
+    so walls crossing the region boundary can differ from a full run.
+    """
+    x0, y0, x1, y1 = rect = clip_rect(rect, img.shape)
+    if x1 <= x0 or y1 <= y0:
+        return [], [], None
+    pad = region_padding(params)
+    px0, py0 = max(0, x0 - pad), max(0, y0 - pad)
+    px1, py1 = min(img.shape[1], x1 + pad), min(img.shape[0], y1 + pad)
+    polygons, lines, edges = wall_detection.detect_walls(img[py0:py1, px0:px1], params, lsd=lsd)
+
+    offset = np.array([px0, py0], dtype=np.int32)
+    polygons = [p + offset for p in polygons]
+    lines = [(a + px0, b + py0, c + px0, d + py0) for (a, b, c, d) in lines]
+    poly_mask, line_mask = owned_masks(polygons, lines, rect)
+    polygons = [p for p, keep in zip(polygons, poly_mask) if keep]
+    lines = [l for l, keep in zip(lines, line_mask) if keep]
+    return polygons, lines, edges[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+
+
+def splice(polygons, lines, rect, new_polygons, new_lines):
+    """Replaces the walls owned by rect with the new ones."""
+    poly_mask, line_mask = owned_masks(polygons, lines, rect)
+    polygons = [p for p, owned in zip(polygons, poly_mask) if not owned] + list(new_polygons)
+    lines = [l for l, owned in zip(lines, line_mask) if not owned] + list(new_lines)
+    return polygons, lines
+
+
+class RegionDetector:
+    """Per-region parameter overrides on top of a full-image detection.
+
+    Region results are cached per (rect, effective parameters), so changing one
+    region's overrides only re-runs detection inside that (padded) rectangle and
+    the result is spliced into the base wall set. Later regions win where
+    regions overlap. Call reset() when the image changes.
+    """
+
+    def __init__(self, lsd=None):
+        self.lsd = lsd
+        self.regions = []
+        self.reset()
+
+    def reset(self):
+        self._results = {} # region index -> (key, polygons, lines, edges)
+
+    def add_region(self, rect, overrides=None):
+        self.regions.append(Region(tuple(rect), dict(overrides or {})))
+        return len(self.regions) - 1
+
+    def set_overrides(self, index, overrides):
+        self.regions[index] = Region(self.regions[index].rect, dict(overrides))
+
+    def remove_region(self, index):
+        del self.regions[index]
+        # Indices after the removed one shift down
+        self._results = {i - (i > index): r for i, r in self._results.items() if i != index}
+
+    def clear(self):
+        self.regions = []
+        self.reset()
+
+    def region_params(self, index, params):
+        effective = dict(params)
+        effective.update(self.regions[index].overrides)
+        return effective
+
+    def compose(self, img, params, polygons, lines, edges=None):
+        """Splices every region's result into the base (polygons, lines).
+
+        Only regions whose rectangle or effective parameters changed since the last
+        call are re-detected. If edges is given, each region's edge map is pasted
+        into it in place. Returns (polygons, lines, recomputed region count).
+        """
+        recomputed = 0
+        for i, region in enumerate(self.regions):
+            rect = clip_rect(region.rect, img.shape)
+            effective = self.region_params(i, params)
+            key = (rect, tuple(sorted(effective.items())))
+            cached = self._results.get(i)
+            if cached is None or cached[0] != key:
+                cached = self._results[i] = (key,) + detect_in_rect(img, rect, effective, self.lsd)
+                recomputed += 1
+            _, region_polygons, region_lines, region_edges = cached
+            polygons, lines = splice(polygons, lines, rect, region_polygons, region_lines)
+            if edges is not None and region_edges is not None:
+                x0, y0, x1, y1 = rect
+                edges[y0:y1, x0:x1] = region_edges
+        return polygons, lines, recomputed
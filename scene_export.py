@@ -0,0 +1,141 @@
+import argparse
+import itertools
+import json
+import os
+import secrets
+import string
+
+import numpy as np
+
+from lazy_imports import LazyModule
+from prepare_wall_packet import (DEFAULT_CLEANUP, _resolve_proportion, _resolve_wall_data, prepare_walls,
+                                 wall_document)
+
+# Offline alternative to sending walls over the websocket: the walls are
+# embedded in a Scene (or Adventure) document that Foundry imports in one go
+# ("Import Data" on a scene, or an adventure in a compendium).
+
+cv2 = LazyModule("cv2") # Only needed to read the map size
+
+_ID_CHARS = string.ascii_letters + string.digits
+_PLACEHOLDER = "__WALLS__"
+_C_PLACEHOLDER = "__WALL_C__"
+_ID_PLACEHOLDER = "__WALL_ID__"
+
+
+def random_id(length=16):
+    """Document id in Foundry's format (16 alphanumeric characters)."""
+    return "".join(secrets.choice(_ID_CHARS) for _ in range(length))
+
+
+def iter_wall_documents(walls):
+    """Serialized wall_document() per wall, each with a fresh id.
+
+    Like prepare_wall_packet.iter_packet_frames, the constant part is
+    serialized once and only the coordinates / id are formatted per wall.
+    """
+    template = json.dumps(wall_document(_C_PLACEHOLDER, _ID_PLACEHOLDER), ensure_ascii=False)
+    head, rest = template.split(json.dumps(_C_PLACEHOLDER))
+    middle, tail = rest.split(json.dumps(_ID_PLACEHOLDER))
+    for c in np.asarray(walls).reshape(-1, 4).tolist():
+        yield f"{head}[{', '.join(map(repr, c))}]{middle}\"{random_id()}\"{tail}"
+
+
+def new_scene(name, width, height, background=None):
+    """Minimal new Scene document. No padding, so wall coordinates line up with the image."""
+    scene = {"_id": random_id(), "name": name, "width": int(round(width)), "height": int(round(height)),
+             "padding": 0, "walls": [], "flags": {}}
+    if background:
+        scene["background"] = {"src": background}
+    return scene
+
+
+def scene_walls(wall_data, original_image, scene, scale_x=1, scale_y=1, **cleanup):
+    """Walls for scene, scaled exactly like packet_from_scene (scene size x scale / image size).
+
+    cleanup: optional prepare_walls() stage settings (fuse_tolerance, split_tolerance, ...).
+    """
+    width = scene.get("width") * scale_x
+    height = scene.get("height") * scale_y
+    proportion_x, proportion_y = _resolve_proportion(original_image, width, height)
+    return prepare_walls(_resolve_wall_data(wall_data), proportion_x, proportion_y, **cleanup)
+
+
+def adventure_document(name, scenes):
+    """Adventure document wrapping scenes, for import through an adventure compendium."""
+    return {"_id": random_id(), "name": name, "img": None, "caption": "", "description": "",
+            "scenes": scenes, "actors": [], "items": [], "journal": [], "tables": [], "macros": [],
+            "cards": [], "playlists": [], "combats": [], "folders": [], "sort": 0, "flags": {}}
+
+
+def write_scene(path, scene, walls, keep_walls=False, adventure=None):
+    """Writes scene with walls embedded (replacing its walls unless keep_walls).
+
+    adventure: if set, the scene is wrapped in an Adventure document of that name.
+    The walls are spliced in as pre-serialized text, the rest of the document goes
+    through json.dumps. Returns the number of walls written.
+    """
+    existing = [json.dumps(w, ensure_ascii=False) for w in scene.get("walls", [])] if keep_walls else []
+    doc = dict(scene, walls=_PLACEHOLDER)
+    if adventure:
+        doc = adventure_document(adventure, [doc])
+    head, tail = json.dumps(doc, ensure_ascii=False, indent=2).split(json.dumps(_PLACEHOLDER))
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(head + "[")
+        for count, text in enumerate(itertools.chain(existing, iter_wall_documents(walls)), 1):
+            f.write(("," if count > 1 else "") + "\n" + text)
+        f.write("\n]" + tail)
+    return count
+
+
+def export_scene(wall_data, original_image, path, scene=None, name=None, scale_x=1, scale_y=1, keep_walls=False,
+                 adventure=None, **cleanup):
+    """Wall JSON (path or dict) -> importable Scene / Adventure JSON at path.
+
+    scene: an exported Foundry Scene (dict or JSON path) to add the walls to;
+    without it a new scene the size of the image is created.
+    """
+    if isinstance(scene, str):
+        with open(scene, encoding="utf-8") as f:
+            scene = json.load(f)
+    if scene is None:
+        img = cv2.imread(original_image)
+        if img is None:
+            raise ValueError(f"Image at {original_image} not found or cannot be loaded.")
+        height, width = img.shape[:2]
+        name = name or os.path.splitext(os.path.basename(original_image))[0]
+        scene = new_scene(name, width * scale_x, height * scale_y, os.path.basename(original_image))
+        scale_x = scale_y = 1 # Already applied to the scene size
+    elif name:
+        scene = dict(scene, name=name)
+    walls = scene_walls(wall_data, original_image, scene, scale_x, scale_y, **cleanup)
+    count = write_scene(path, scene, walls, keep_walls, adventure)
+    print(f"Wrote {count} walls to scene '{scene.get('name')}' in {path}")
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write detected walls as a Foundry Scene / Adventure document.")
+    parser.add_argument("walls", help="Wall JSON or .fvw export")
+    parser.add_argument("image", help="Original map image (for the scaling)")
+    parser.add_argument("--out", default=None, help="Output JSON (default: <image name>_scene.json)")
+    parser.add_argument("--scene", default=None, help="Exported Foundry scene JSON to add the walls to")
+    parser.add_argument("--keep-walls", action="store_true", help="Keep the walls already in --scene")
+    parser.add_argument("--name", default=None, help="Scene name")
+    parser.add_argument("--scale-x", type=float, default=1.0)
+    parser.add_argument("--scale-y", type=float, default=1.0)
+    parser.add_argument("--adventure", default=None, metavar="NAME", help="Wrap the scene in an Adventure document")
+    parser.add_argument("--fuse-tolerance", type=float, default=None)
+    parser.add_argument("--split-tolerance", type=float, default=DEFAULT_CLEANUP.get("split_tolerance"),
+                        help="Split walls at crossings and snap T-junctions within this distance (0 = off)")
+    parser.add_argument("--dedup-tolerance", type=float, default=DEFAULT_CLEANUP.get("dedup_tolerance"),
+                        help="Drop duplicate / contained walls within this distance (0 = keep them)")
+    parser.add_argument("--max-walls", type=int, default=None)
+    args = parser.parse_args()
+
+    cleanup = {k: getattr(args, k) for k in ("fuse_tolerance", "split_tolerance", "dedup_tolerance", "max_walls")
+               if getattr(args, k) is not None}
+    out = args.out or os.path.splitext(args.image)[0] + "_scene.json"
+    export_scene(args.walls, args.image, out, scene=args.scene, name=args.name, scale_x=args.scale_x,
+                 scale_y=args.scale_y, keep_walls=args.keep_walls, adventure=args.adventure, **cleanup)
@@ -5,7 +5,7 @@ from time import sleep
 import websocket
 from rel import rel
 
-from prepare_wall_packet import send_packet_from_json, packet_from_scene
+from prepare_wall_packet import DEFAULT_CLEANUP, send_packet_from_json, packet_frames_from_scene
 
 time_recive = False
 lqst_message_num = "0"
@@ -20,6 +20,8 @@ default_param = {
     "scale_dim_y": 5460 * 1.33,
     "scene_name": "test scene 2"
 }
+# prepare_walls() clean-up for the walls sent (dedup, split, fuse, max_walls)
+wall_cleanup = dict(DEFAULT_CLEANUP)
 
 
 def on_message(ws, message):
@@ -60,14 +62,13 @@ def on_message(ws, message):
                         break
                 if wahnted_scenes:
                     try:
-                        all_packet = packet_from_scene(default_param["json_path"], default_param["orignialimage_path"],
-                                                       wahnted_scenes
-                                                       , default_param["scale_dim_x"],
-                                                       default_param["scale_dim_y"])
-                        for carac in all_packet:
-                            dump_data = ["modifyDocument", carac]
-                            dup = json.dumps(dump_data, ensure_ascii=False)
-                            send(ws, dup)
+                        # Frames are serialized lazily from a precomputed template
+                        all_frames = packet_frames_from_scene(default_param["json_path"], default_param["orignialimage_path"],
+                                                              wahnted_scenes
+                                                              , default_param["scale_dim_x"],
+                                                              default_param["scale_dim_y"], **wall_cleanup)
+                        for frame in all_frames:
+                            send(ws, frame)
                     except Exception as e:
                         print(f"Error preparing packet: {e}")
                         print("stack strace", e.__traceback__)
@@ -168,9 +169,12 @@ def load_env():
             os.environ[key.upper()] = value
 
 
-def send_token(session, image_path, data, scene_name, scale_dim_x=1, scale_dim_y=1):
+def send_token(session, image_path, data, scene_name, scale_dim_x=1, scale_dim_y=1, cleanup=None):
+    """cleanup: prepare_walls() clean-up settings, DEFAULT_CLEANUP if None ({} sends the walls as detected)."""
+    global wall_cleanup
     # Load environment variables from .env file
     load_env()
+    wall_cleanup = dict(DEFAULT_CLEANUP if cleanup is None else cleanup)
     if not session:
         session = os.getenv('SESSION')
     default_param["json_path"] = data
@@ -0,0 +1,179 @@
+import os
+import tempfile
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Picklable description of a published image. Only this travels to the workers,
+# never the pixels themselves.
+ImageHandle = namedtuple("ImageHandle", ["kind", "name", "shape", "dtype"])
+
+KIND_SHM = "shm"
+KIND_MMAP = "mmap"
+
+
+class SharedImage:
+    """Publishes a decoded image once so worker processes can map it without copying.
+
+    kind="shm" uses multiprocessing.shared_memory, kind="mmap" a memory-mapped
+    temp file (useful where /dev/shm is small, e.g. in containers).
+    The publisher keeps a reference count: every job using the image should
+    acquire() before dispatch and release() when done. The backing memory is
+    freed once close() has been called and the last reference is released.
+    """
+
+    def __init__(self, img, kind=KIND_SHM, mmap_dir=None):
+        img = np.ascontiguousarray(img)
+        self._lock = threading.Lock()
+        self._refs = 0
+        self._closed = False
+        self._shm = None
+        self._path = None
+        if kind == KIND_SHM:
+            self._shm = shared_memory.SharedMemory(create=True, size=max(1, img.nbytes))
+            buf = np.ndarray(img.shape, dtype=img.dtype, buffer=self._shm.buf)
+            name = self._shm.name
+        elif kind == KIND_MMAP:
+            fd, self._path = tempfile.mkstemp(dir=mmap_dir, suffix=".img")
+            os.close(fd)
+            buf = np.memmap(self._path, dtype=img.dtype, mode="w+", shape=img.shape)
+            name = self._path
+        else:
+            raise ValueError(f"Unknown shared image kind: {kind}")
+        buf[...] = img # The one and only copy
+        if kind == KIND_MMAP: buf.flush()
+        del buf
+        self.handle = ImageHandle(kind, name, img.shape, img.dtype.str)
+
+    def view(self):
+        """Read-only view of the published image in this process."""
+        return _map_handle(self.handle, self._shm)[0]
+
+    def acquire(self):
+        with self._lock:
+            if self._closed and self._refs == 0:
+                raise RuntimeError("Shared image already released.")
+            self._refs += 1
+        return self.handle
+
+    def release(self, *_):
+        """Drops one reference. Extra args are ignored so it can be used as a future callback."""
+        with self._lock:
+            self._refs -= 1
+            free = self._closed and self._refs <= 0
+        if free: self._free()
+
+    def close(self):
+        """Marks the image as no longer needed by the publisher."""
+        with self._lock:
+            if self._closed: return
+            self._closed = True
+            free = self._refs <= 0
+        if free: self._free()
+
+    def _free(self):
+        if self._shm is not None:
+            self._shm.close()
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+            self._shm = None
+        if self._path is not None:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+            self._path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _map_handle(handle, shm=None):
+    """Returns (read-only ndarray, backing object) for a handle."""
+    if handle.kind == KIND_SHM:
+        if shm is None:
+            try:
+                shm = shared_memory.SharedMemory(name=handle.name, track=False) # Python 3.13+
+            except TypeError:
+                # Workers started by multiprocessing share the parent's resource tracker,
+                # so attaching here doesn't cause an early unlink.
+                shm = shared_memory.SharedMemory(name=handle.name)
+        arr = np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=shm.buf)
+        backing = shm
+    else:
+        arr = np.memmap(handle.name, dtype=np.dtype(handle.dtype), mode="r", shape=tuple(handle.shape))
+        backing = arr
+    arr.flags.writeable = False
+    return arr, backing
+
+
+# --- Worker side: per-process attachment cache, reference counted ---
+
+_attached = {} # name -> [array, backing, refcount]
+_attached_lock = threading.Lock()
+
+
+def attach_image(handle):
+    """Attaches to a published image in a worker. Pair every call with detach_image()."""
+    with _attached_lock:
+        entry = _attached.get(handle.name)
+        if entry is None:
+            arr, backing = _map_handle(handle)
+            entry = _attached[handle.name] = [arr, backing, 0]
+        entry[2] += 1
+        return entry[0]
+
+
+def detach_image(handle):
+    with _attached_lock:
+        entry = _attached.get(handle.name)
+        if entry is None: return
+        entry[2] -= 1
+        if entry[2] > 0: return
+        del _attached[handle.name]
+    backing = entry[1]
+    entry.clear() # Drop our view before closing the mapping
+    if isinstance(backing, shared_memory.SharedMemory):
+        try:
+            backing.close()
+        except BufferError:
+            pass # A caller still holds a view; the mapping goes away with the process
+
+
+def _run_on_shared(fn, handle, item):
+    img = attach_image(handle)
+    try:
+        return fn(img, item)
+    finally:
+        del img
+        detach_image(handle)
+
+
+def map_shared(fn, img, items, workers=None, kind=KIND_SHM, executor=None):
+    """Runs fn(img, item) for each item in worker processes, publishing img only once.
+
+    fn must be a module-level (picklable) function and must treat img as read-only.
+    Results are returned in the order of items.
+    """
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+    shared = SharedImage(img, kind=kind)
+    try:
+        futures = []
+        for item in items:
+            future = executor.submit(_run_on_shared, fn, shared.acquire(), item)
+            future.add_done_callback(shared.release)
+            futures.append(future)
+        return [f.result() for f in futures]
+    finally:
+        shared.close()
+        if own_executor: executor.shutdown()
@@ -0,0 +1,130 @@
+import heapq
+
+import numpy as np
+
+from wall_graph import snap_endpoints, build_adjacency, walk_chains
+
+
+def _triangle_area(a, b, c):
+    return 0.5 * np.abs((b[..., 0] - a[..., 0]) * (c[..., 1] - a[..., 1]) -
+                        (b[..., 1] - a[..., 1]) * (c[..., 0] - a[..., 0]))
+
+
+def _point_segment_distance(p, a, b):
+    d = b - a
+    len_sq = np.maximum(np.sum(d * d, axis=1), 1e-12)
+    t = np.clip(np.sum((p - a) * d, axis=1) / len_sq, 0, 1)
+    return np.hypot(*(p - (a + d * t[:, None])).T)
+
+
+def budget_walls(segments, max_walls, snap_tolerance=0.5):
+    """Simplifies the wall network until it has at most max_walls walls.
+
+    Walls are chained through shared endpoints (within snap_tolerance) and chain
+    vertices are removed Visvalingam-style: one priority queue over every chain,
+    always dropping the vertex whose removal sweeps the smallest triangle area.
+    Junctions and dead ends are never moved. If the budget still isn't met once
+    every chain is down to its end points, the shortest walls are dropped.
+
+    Returns (walls, report). walls is an (M, 4) array; report holds walls_in (as
+    passed), graph_walls (after snapping, before simplifying), walls_out,
+    removed_vertices, total_area (sum of the removed triangles), max_deviation
+    (largest distance from an original vertex to the simplified walls),
+    dropped_walls and dropped_length.
+    """
+    if max_walls < 1:
+        raise ValueError("max_walls must be at least 1")
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+    report = {"walls_in": len(segments), "graph_walls": len(segments), "walls_out": len(segments),
+              "removed_vertices": 0, "total_area": 0.0, "max_deviation": 0.0, "dropped_walls": 0,
+              "dropped_length": 0.0}
+    if len(segments) <= max_walls:
+        return segments, report
+
+    nodes, edges = snap_endpoints(segments, snap_tolerance)
+    chains = walk_chains(build_adjacency(len(nodes), edges))
+
+    # Flatten every chain into one vertex list with prev/next links.
+    # Open chains are fixed at both ends; cycles wrap around.
+    node_ids, prev, nxt, chain_of, removable = [], [], [], [], []
+    min_live = []
+    for c, (chain, closed) in enumerate(chains):
+        start, n = len(node_ids), len(chain)
+        node_ids.extend(chain)
+        chain_of.extend([c] * n)
+        idx = list(range(start, start + n))
+        if closed:
+            prev.extend([idx[-1]] + idx[:-1]); nxt.extend(idx[1:] + [idx[0]])
+            removable.extend([True] * n)
+            min_live.append(3)
+        else:
+            prev.extend([-1] + idx[:-1]); nxt.extend(idx[1:] + [-1])
+            removable.extend([False] + [True] * (n - 2) + [False])
+            min_live.append(4 if chain[0] == chain[-1] else 2) # A loop off a junction keeps a triangle
+    pts = nodes[np.array(node_ids, dtype=np.int64)]
+    prev = np.array(prev, dtype=np.int64); nxt = np.array(nxt, dtype=np.int64)
+    chain_of = np.array(chain_of, dtype=np.int64)
+    removable = np.array(removable, dtype=bool)
+    live = np.bincount(chain_of, minlength=len(chains))
+    closed_chain = np.array([closed for _, closed in chains], dtype=bool)
+    walls = int(np.sum(live - 1 + closed_chain))
+    report["graph_walls"] = walls # After snapping / chaining, walls_in stays the caller's count
+
+    cand = np.flatnonzero(removable)
+    areas = _triangle_area(pts[prev[cand]], pts[cand], pts[nxt[cand]])
+    heap = list(zip(areas.tolist(), cand.tolist(), [0] * len(cand)))
+    heapq.heapify(heap)
+
+    prev_l = prev.tolist(); nxt_l = nxt.tolist(); chain_l = chain_of.tolist(); live_l = live.tolist()
+    stamp_l = [0] * len(pts); kept_l = [True] * len(pts); removable_l = removable.tolist()
+    pts_l = pts.tolist()
+    total_area = 0.0; removed = 0
+    while walls > max_walls and heap:
+        area, v, s = heapq.heappop(heap)
+        if not kept_l[v] or s != stamp_l[v]: continue
+        c = chain_l[v]
+        if live_l[c] <= min_live[c]: continue
+        p, q = prev_l[v], nxt_l[v]
+        nxt_l[p] = q; prev_l[q] = p
+        kept_l[v] = False
+        live_l[c] -= 1; walls -= 1; removed += 1
+        total_area += area
+        # The neighbours now span a different triangle
+        for u in (p, q):
+            if not removable_l[u] or not kept_l[u]: continue
+            stamp_l[u] += 1
+            (ax, ay), (bx, by), (cx, cy) = pts_l[prev_l[u]], pts_l[u], pts_l[nxt_l[u]]
+            a = 0.5 * abs((bx - ax) * (cy - ay) - (by - ay) * (cx - ax))
+            heapq.heappush(heap, (a, u, stamp_l[u]))
+
+    nxt = np.array(nxt_l, dtype=np.int64); kept = np.array(kept_l, dtype=bool)
+    if removed:
+        # Each removed vertex is covered by the wall starting at the closest kept vertex before it
+        idx = np.arange(len(pts))
+        prev_kept = np.maximum.accumulate(np.where(kept, idx, -1))
+        chain_start = np.flatnonzero(np.r_[True, chain_of[1:] != chain_of[:-1]])
+        last_kept = np.full(len(chains), -1, dtype=np.int64)
+        np.maximum.at(last_kept, chain_of[kept], idx[kept])
+        wrapped = prev_kept < chain_start[chain_of] # Start of a cycle was removed
+        prev_kept = np.where(wrapped, last_kept[chain_of], prev_kept)
+        r = np.flatnonzero(~kept)
+        a = prev_kept[r]
+        dev = _point_segment_distance(pts[r], pts[a], pts[nxt[a]])
+        report["max_deviation"] = float(dev.max())
+
+    start = np.flatnonzero(kept & (nxt >= 0))
+    out = np.hstack([pts[start], pts[nxt[start]]])
+    out = out[np.any(out[:, :2] != out[:, 2:], axis=1)]
+
+    if len(out) > max_walls:
+        # Nothing left to simplify: drop the shortest walls
+        lengths = np.hypot(out[:, 2] - out[:, 0], out[:, 3] - out[:, 1])
+        order = np.argsort(-lengths, kind="stable")
+        report["dropped_walls"] = len(out) - max_walls
+        report["dropped_length"] = float(lengths[order[max_walls:]].sum())
+        out = out[np.sort(order[:max_walls])]
+
+    report["walls_out"] = len(out)
+    report["removed_vertices"] = removed
+    report["total_area"] = float(total_area)
+    return out, report
@@ -0,0 +1,78 @@
+import numpy as np
+
+from wall_topology import candidate_pairs, EPS
+
+
+def drop_exact_duplicates(segments, decimals=3):
+    """Removes walls that repeat another one, in either direction. Keeps first occurrences."""
+    p0 = segments[:, :2]; p1 = segments[:, 2:]
+    swap = (p0[:, 0] > p1[:, 0]) | ((p0[:, 0] == p1[:, 0]) & (p0[:, 1] > p1[:, 1]))
+    canon = np.where(swap[:, None], np.hstack([p1, p0]), segments)
+    _, first = np.unique(np.round(canon, decimals), axis=0, return_index=True)
+    return segments[np.sort(first)]
+
+
+def covered_mask(segments, a, b, distance, max_angle_deg=10.0, min_overlap=0.9, slack=0.0):
+    """Marks walls that another, longer wall already covers.
+
+    Wall i is covered by wall j when they are within max_angle_deg of parallel,
+    both ends of i are within distance of j's line, and at least min_overlap of
+    i's length projects onto j (extended by slack at both ends). With a small
+    distance this drops walls contained in another one; with a larger one it
+    also drops one side of thick walls.
+    """
+    lengths = np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+    # Orient every pair as (short, long); ties go to the lower index being kept
+    a_short = (lengths[a] < lengths[b]) | ((lengths[a] == lengths[b]) & (a > b))
+    short = np.where(a_short, a, b)
+    long_ = np.where(a_short, b, a)
+
+    d_s = segments[short, 2:] - segments[short, :2]
+    d_l = segments[long_, 2:] - segments[long_, :2]
+    len_s = np.maximum(lengths[short], EPS)
+    len_l = np.maximum(lengths[long_], EPS)
+    cos = np.abs(np.sum(d_s * d_l, axis=1)) / (len_s * len_l)
+    parallel = cos >= np.cos(np.radians(max_angle_deg))
+
+    # Perpendicular distance of both ends of the short wall to the long wall's line
+    normal = np.stack([-d_l[:, 1], d_l[:, 0]], axis=1) / len_l[:, None]
+    dist0 = np.abs(np.sum((segments[short, :2] - segments[long_, :2]) * normal, axis=1))
+    dist1 = np.abs(np.sum((segments[short, 2:] - segments[long_, :2]) * normal, axis=1))
+    close = (dist0 <= distance) & (dist1 <= distance)
+
+    # Fraction of the short wall's projection that falls inside the long wall
+    unit = d_l / len_l[:, None]
+    t0 = np.sum((segments[short, :2] - segments[long_, :2]) * unit, axis=1)
+    t1 = np.sum((segments[short, 2:] - segments[long_, :2]) * unit, axis=1)
+    lo, hi = np.minimum(t0, t1), np.maximum(t0, t1)
+    overlap = np.clip(np.minimum(hi, len_l + slack) - np.maximum(lo, -slack), 0, None) / np.maximum(hi - lo, EPS)
+
+    mask = np.zeros(len(segments), dtype=bool)
+    mask[short[parallel & close & (overlap >= min_overlap)]] = True
+    return mask
+
+
+def dedup_walls(segments, tolerance=1.0, parallel_distance=None, max_angle_deg=10.0, min_overlap=0.9):
+    """Drops duplicate and overlapping walls before export.
+
+    Exact duplicates go first, then walls contained in another wall within
+    tolerance, then (if parallel_distance is set) walls running parallel to a
+    longer wall closer than parallel_distance, e.g. both edges of a thick wall.
+    Candidate pairs come from the same uniform grid as wall_topology.
+    Returns an (M, 4) array.
+    """
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+    if len(segments) < 2:
+        return segments
+    segments = drop_exact_duplicates(segments)
+    distance = max(tolerance, parallel_distance or 0)
+    lengths = np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+    cell_size = max(float(np.median(lengths)), 2.0 * distance, 1.0)
+    a, b = candidate_pairs(segments, cell_size)
+    if not len(a):
+        return segments
+    drop = covered_mask(segments, a, b, tolerance, max_angle_deg=max_angle_deg, min_overlap=1.0 - EPS,
+                        slack=tolerance)
+    if parallel_distance:
+        drop |= covered_mask(segments, a, b, parallel_distance, max_angle_deg=max_angle_deg, min_overlap=min_overlap)
+    return segments[~drop]
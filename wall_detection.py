@@ -0,0 +1,406 @@
+import cv2
+import numpy as np
+
+import line_backends
+from lazy_imports import LazyModule, module_available
+
+# Optional dependencies are only looked up here; they are imported on first use
+# (merging), which keeps scipy's ~200 ms import out of startup.
+SHAPELY_AVAILABLE = module_available("shapely")
+if not SHAPELY_AVAILABLE:
+    print("Warning: Shapely library not found. Polygon merging will be disabled.")
+shapely_geometry = LazyModule("shapely.geometry")
+shapely_ops = LazyModule("shapely.ops")
+
+KDTREE_AVAILABLE = module_available("scipy")
+if not KDTREE_AVAILABLE:
+    print("Warning: scipy.spatial.KDTree not found. Line merging might be slower.")
+scipy_spatial = LazyModule("scipy.spatial")
+
+
+# Bump this whenever the detection output for a given image/params changes,
+# anything keyed on detection results (e.g. the on-disk cache) depends on it.
+DETECTION_VERSION = 1
+
+# Detection parameters in pipeline units (the GUI sliders are converted to these)
+DEFAULT_PARAMS = {
+    "close_morph": 5,       # Cross kernel size for MORPH_CLOSE (0 = disabled)
+    "morph_size": 0,        # Top-hat kernel size (0 = disabled)
+    "kernel_size": 5,       # Gaussian blur kernel size (odd)
+    "canny1": 50,
+    "canny2": 150,
+    "min_component": 0,     # Edge blobs with fewer pixels than this are dropped (0 = disabled)
+    "min_extent": 0,        # Edge blobs whose bounding box is smaller than this on both sides are dropped
+    "epsilon": 0.0,         # approxPolyDP epsilon as a fraction of the perimeter
+    "min_area": 1,
+    "line_backend": "lsd",  # Line detector, see line_backends.BACKENDS
+    "merge_lines": False,
+    "line_thresh": 20,
+    "merge_polygons": False,
+    "poly_thresh": 20,
+}
+
+MIN_LINE_LENGTH = 5 # Filter very short lines (e.g., less than 5 pixels)
+
+
+def make_params(**overrides):
+    """Returns a full parameter dict, DEFAULT_PARAMS updated with overrides."""
+    params = dict(DEFAULT_PARAMS)
+    for key, value in overrides.items():
+        if key not in DEFAULT_PARAMS:
+            raise KeyError(f"Unknown detection parameter: {key}")
+        params[key] = value
+    return params
+
+
+def create_line_detector(backend="lsd"):
+    """Line detector backend by name. Falls back to Hough on OpenCV builds without LSD."""
+    try:
+        detector = line_backends.create_backend(backend)
+    except (cv2.error, AttributeError) as e:
+        if backend != "lsd": raise
+        print(f"Warning: LSD not available in this OpenCV build ({e}). Using Hough lines instead.")
+        detector = line_backends.HoughBackend()
+    detector.requested = backend
+    return detector
+
+
+class BufferPool:
+    """Reusable output arrays for the pipeline stages.
+
+    Stages write into these through OpenCV's dst= parameters, so repeated runs on
+    the same image size (slider interaction) don't allocate full-size arrays.
+    A buffer is only valid until the next run that uses the same pool.
+    """
+
+    def __init__(self):
+        self._buffers = {}
+
+    def get(self, name, shape, dtype=np.uint8):
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = self._buffers[name] = np.empty(shape, dtype=dtype)
+        return buf
+
+    def clear(self):
+        self._buffers.clear()
+
+
+def _buffer(buffers, name, shape):
+    return buffers.get(name, shape) if buffers is not None else None
+
+
+# --- Pipeline Stages ---
+
+def preprocess(img, params, buffers=None):
+    """Morphology + grayscale + blur. Returns the blurred grayscale image.
+
+    img is only read, never modified, so disabled stages just pass it through.
+    """
+    close_morph = params["close_morph"]
+    if close_morph > 0:
+        structuring = cv2.getStructuringElement(cv2.MORPH_CROSS, (close_morph, close_morph))
+        strutuing_img = cv2.morphologyEx(img, cv2.MORPH_CLOSE, structuring,
+                                         dst=_buffer(buffers, "closed", img.shape))
+    else:
+        strutuing_img = img
+    # From here on each intermediate is dropped once the next one exists (unless it is a
+    # pooled buffer), so big maps only hold two image-sized arrays at a time
+    shape = img.shape
+    del img
+
+    if params["morph_size"] > 0:
+        M = cv2.getStructuringElement(cv2.MORPH_RECT, (9, 9))
+        hat = cv2.morphologyEx(strutuing_img, cv2.MORPH_TOPHAT, M, dst=_buffer(buffers, "hat", shape))
+    else:
+        hat = strutuing_img
+    del strutuing_img
+
+    if hat.ndim == 3:
+        gray = cv2.cvtColor(hat, cv2.COLOR_BGR2GRAY, dst=_buffer(buffers, "gray", shape[:2]))
+    else:
+        gray = hat
+    del hat
+    kernel_size = params["kernel_size"]
+    return cv2.GaussianBlur(gray, (kernel_size, kernel_size), 0, dst=_buffer(buffers, "blurred", shape[:2]))
+
+
+def detect_edges(blurred, params, buffers=None):
+    return cv2.Canny(blurred, params["canny1"], params["canny2"], edges=_buffer(buffers, "edges", blurred.shape))
+
+
+def filter_components(edges, params):
+    """Removes small connected edge blobs (texture noise) in place. Returns edges.
+
+    A blob is dropped when it has fewer than min_component pixels or its bounding
+    box is smaller than min_extent in both directions. Runs before contour and line
+    extraction, so the noise never reaches the per-contour Python loop or LSD.
+    """
+    min_component = params["min_component"]
+    min_extent = params["min_extent"]
+    if min_component <= 0 and min_extent <= 0:
+        return edges
+    n_labels, labels, stats, _ = cv2.connectedComponentsWithStats(edges, connectivity=8, ltype=cv2.CV_32S)
+    small = (stats[:, cv2.CC_STAT_AREA] < min_component) | \
+            (np.maximum(stats[:, cv2.CC_STAT_WIDTH], stats[:, cv2.CC_STAT_HEIGHT]) < min_extent)
+    small[0] = False # Background
+    if not small.any():
+        return edges
+    lut = np.where(small, 0, 255).astype(np.uint8)
+    lut[0] = 0
+    np.take(lut, labels, out=edges)
+    return edges
+
+
+def find_contours(edges):
+    contours_raw, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return contours_raw
+
+
+def contour_candidates(contours_raw, min_area):
+    """Indices of the contours that can still give a polygon, without touching them one by one.
+
+    A contour needs at least 3 points, and its bounding box must be larger than
+    min_area: the approximated polygon only uses contour points, so its area can't
+    exceed the box. Rejecting on that is exact, never a heuristic.
+    """
+    counts = np.fromiter(map(len, contours_raw), dtype=np.int64, count=len(contours_raw))
+    candidates = np.flatnonzero(counts >= 3) # Need at least 3 points for a polygon
+    if not len(candidates) or min_area < 0:
+        return candidates
+    points = np.concatenate([contours_raw[i] for i in candidates.tolist()]).reshape(-1, 2)
+    starts = np.concatenate(([0], np.cumsum(counts[candidates])[:-1]))
+    width = np.maximum.reduceat(points[:, 0], starts) - np.minimum.reduceat(points[:, 0], starts)
+    height = np.maximum.reduceat(points[:, 1], starts) - np.minimum.reduceat(points[:, 1], starts)
+    return candidates[width.astype(np.int64) * height > min_area]
+
+
+def approximate_contours(contours_raw, params):
+    """approxPolyDP + area filter for every contour. Returns (points, starts): the vertices of
+    all polygons in one (N, 1, 2) int32 buffer, polygon i being points[starts[i]:starts[i + 1]].
+    """
+    epsilon_percent, min_area = params["epsilon"], params["min_area"]
+    kept = []
+    for i in contour_candidates(contours_raw, min_area).tolist():
+        cnt = contours_raw[i]
+        perimeter = cv2.arcLength(cnt, True)
+        if perimeter <= 0: continue # Avoid division by zero for epsilon calc
+
+        # Calculate epsilon based on perimeter
+        approx = cv2.approxPolyDP(cnt, epsilon_percent * perimeter, True) # True for closed polygons
+
+        # Check area and validity AFTER approximation
+        if len(approx) >= 3 and cv2.contourArea(approx) > min_area:
+            kept.append(approx)
+    if not kept:
+        return np.empty((0, 1, 2), dtype=np.int32), np.zeros(1, dtype=np.int64)
+    starts = np.zeros(len(kept) + 1, dtype=np.int64)
+    starts[1:] = np.cumsum(np.fromiter(map(len, kept), dtype=np.int64, count=len(kept)))
+    return np.concatenate(kept), starts
+
+
+def approximate_polygons(contours_raw, params):
+    """Approximates raw contours as polygons and filters them by area (then merges, if enabled).
+
+    The polygons are views into approximate_contours' shared point buffer.
+    """
+    points, starts = approximate_contours(contours_raw, params)
+    bounds = starts.tolist()
+    poly_list = [points[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+    if params["merge_polygons"] and SHAPELY_AVAILABLE:
+        poly_list = merge_polygons(poly_list, params["poly_thresh"])
+    return poly_list
+
+
+def extract_polygons(edges, params):
+    """Finds external contours on the edge map and approximates them as polygons."""
+    return approximate_polygons(find_contours(edges), params)
+
+
+def detect_line_segments(edges, lsd=None, backend="lsd"):
+    """Runs a line detector on the edge map. Returns a list of (x1, y1, x2, y2).
+
+    lsd: detector from create_line_detector(), reused if it was created for backend.
+    """
+    if lsd is None or getattr(lsd, "requested", lsd.name) != backend:
+        lsd = create_line_detector(backend)
+    line_list = []
+    min_line_length_sq = MIN_LINE_LENGTH**2
+    for dline in lsd.detect(edges):
+        x1, y1, x2, y2 = map(int, dline)
+        if (x2-x1)**2 + (y2-y1)**2 >= min_line_length_sq:
+            line_list.append((x1, y1, x2, y2))
+    return line_list
+
+
+def finish_lines(line_list, params):
+    if params["merge_lines"]:
+        return merge_lines(line_list, params["line_thresh"])
+    return line_list
+
+
+def extract_lines(edges, params, lsd=None):
+    return finish_lines(detect_line_segments(edges, lsd, params["line_backend"]), params)
+
+
+def detect_walls(img, params, lsd=None, edge_stage=None, buffers=None):
+    """Full detection pipeline. Returns (polygons, lines, edges).
+
+    edge_stage: optional gradient_canny.CachedEdgeStage reused across calls on the
+    same image, so threshold-only changes skip preprocessing and gradients.
+    buffers: optional BufferPool; the returned edges then live in the pool.
+    """
+    if edge_stage is not None:
+        edges = edge_stage.edges(img, params)
+    else:
+        blurred = preprocess(img, params, buffers)
+        edges = detect_edges(blurred, params, buffers)
+    edges = filter_components(edges, params)
+    # findContours doesn't modify its input since OpenCV 3.2, so both stages share the edge map
+    polygons = extract_polygons(edges, params)
+    lines = extract_lines(edges, params, lsd)
+    return polygons, lines, edges
+
+
+# --- Merge Logic ---
+
+def merge_lines(lines, threshold):
+    n = len(lines); parent = list(range(n))
+    if n <= 1: return lines
+    def find(i):
+        if parent[i] == i: return i
+        parent[i] = find(parent[i]); return parent[i]
+    def union(i, j):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j: parent[root_j] = root_i
+    endpoints = []; threshold_sq = threshold * threshold
+    for i, (x1, y1, x2, y2) in enumerate(lines):
+        endpoints.extend([(x1, y1, i), (x2, y2, i)])
+    global KDTREE_AVAILABLE # Allow modification
+    if KDTREE_AVAILABLE:
+        try:
+            pts = np.array([(pt[0], pt[1]) for pt in endpoints])
+            if len(pts) < 2: return lines # KDTree needs at least 2 points
+            tree = scipy_spatial.KDTree(pts); pairs = tree.query_pairs(r=threshold)
+            for i, j in pairs:
+                li, lj = endpoints[i][2], endpoints[j][2]
+                if li != lj: union(li, lj)
+        except Exception as e: print(f"KDTree error: {e}. Fallback."); KDTREE_AVAILABLE = False
+    # Fallback or if KDTree is not available
+    if not KDTREE_AVAILABLE:
+        for i in range(len(endpoints)):
+            x1, y1, li = endpoints[i]
+            for j in range(i + 1, len(endpoints)):
+                x2, y2, lj = endpoints[j]
+                if li != lj and ((x1 - x2)**2 + (y1 - y2)**2 < threshold_sq): union(li, lj)
+    # Group lines and find representative line for each group
+    groups = {}; merged_lines = []
+    for i in range(n): groups.setdefault(find(i), []).append(i)
+    for group_indices in groups.values():
+        if not group_indices: continue
+        group_points = []
+        for idx in group_indices: group_points.extend([(lines[idx][0], lines[idx][1]), (lines[idx][2], lines[idx][3])])
+        if not group_points: continue
+        max_dist_sq = -1; best_pair = (group_points[0], group_points[0])
+        # Use convex hull to find the most distant points in the group as the new line ends
+        if len(group_points) > 1:
+            hull_points = cv2.convexHull(np.array(group_points, dtype=np.float32))
+            if hull_points is not None and len(hull_points) > 1:
+                 # Ensure hull_points is a list of points [[x,y], [x,y], ...]
+                 hull_pts_list = hull_points.squeeze().tolist()
+                 if isinstance(hull_pts_list[0], (int, float)): # Handle single point hull case
+                    pts_to_check = [hull_pts_list] if len(hull_pts_list) == 2 else []
+                 elif isinstance(hull_pts_list[0], list):
+                     pts_to_check = hull_pts_list
+                 else: pts_to_check = [] # Unexpected format
+
+                 for i in range(len(pts_to_check)):
+                     for j in range(i + 1, len(pts_to_check)):
+                         p1, p2 = pts_to_check[i], pts_to_check[j]
+                         dist_sq = (p1[0] - p2[0])**2 + (p1[1] - p2[1])**2
+                         if dist_sq > max_dist_sq: max_dist_sq = dist_sq; best_pair = (tuple(p1), tuple(p2))
+            else: # Fallback if convex hull fails (e.g., collinear points)
+                 for i in range(len(group_points)):
+                     for j in range(i + 1, len(group_points)):
+                         p1, p2 = group_points[i], group_points[j]
+                         dist_sq = (p1[0] - p2[0])**2 + (p1[1] - p2[1])**2
+                         if dist_sq > max_dist_sq: max_dist_sq = dist_sq; best_pair = (p1, p2)
+
+        merged_line = tuple(map(int, best_pair[0])) + tuple(map(int, best_pair[1]))
+        # Ensure line has non-zero length after merging/rounding
+        if merged_line[0] != merged_line[2] or merged_line[1] != merged_line[3]:
+            merged_lines.append(merged_line)
+    return merged_lines
+
+
+def merge_polygons(polygons, threshold):
+    global SHAPELY_AVAILABLE # Allow modification
+    if not SHAPELY_AVAILABLE or len(polygons) <= 1: return polygons
+    try:
+        shapely_geometry.load(); shapely_ops.load() # First use imports shapely
+    except ImportError as e:
+        print(f"Warning: Shapely could not be imported ({e}). Polygon merging disabled."); SHAPELY_AVAILABLE = False
+        return polygons
+    shapely_polys = []
+    for poly_np in polygons:
+         pts = poly_np.squeeze()
+         if pts.ndim == 2 and pts.shape[0] >= 3: # Check shape before creating Polygon
+             try:
+                 p = shapely_geometry.Polygon(pts)
+                 if not p.is_valid: p = p.buffer(0) # Attempt to fix invalid polygon
+                 if p.is_valid and not p.is_empty: shapely_polys.append(p)
+             except Exception as e: print(f"Shapely poly creation error: {e} for points {pts}"); continue
+         # else: print(f"Skipping invalid polygon shape: ndim={pts.ndim}, shape={pts.shape}") # Debugging
+    if not shapely_polys: return []
+    try:
+        # Buffer polygons outward
+        buffered = [p.buffer(threshold, join_style=2) for p in shapely_polys if p.is_valid] # Use LINESTRING join style
+        if not buffered: return []
+
+        # Merge overlapping buffered polygons
+        merged_buffered = shapely_ops.unary_union(buffered)
+        if merged_buffered.is_empty: return []
+
+        final_polys_shapely = []
+        geoms_to_process = []
+        # Handle different geometry types resulting from union
+        if merged_buffered.geom_type == 'Polygon': geoms_to_process = [merged_buffered]
+        elif merged_buffered.geom_type == 'MultiPolygon': geoms_to_process = list(merged_buffered.geoms)
+        elif merged_buffered.geom_type == 'GeometryCollection':
+            # Extract only Polygons or MultiPolygons from the collection
+            geoms_to_process = [g for g in merged_buffered.geoms if g.geom_type in ('Polygon', 'MultiPolygon')]
+        # else: print(f"Unexpected geometry type after union: {merged_buffered.geom_type}") # Debugging
+
+        # Buffer inward and collect final valid polygons
+        for geom in geoms_to_process:
+             # Debuffer (buffer inward)
+             debuffered = geom.buffer(-threshold, join_style=2)
+             if debuffered.is_empty: continue
+
+             if debuffered.geom_type == 'Polygon':
+                 if debuffered.is_valid and not debuffered.is_empty:
+                     final_polys_shapely.append(debuffered)
+             elif debuffered.geom_type == 'MultiPolygon':
+                  # Add valid polygons from the multipolygon
+                 final_polys_shapely.extend(p for p in debuffered.geoms if p.geom_type == 'Polygon' and p.is_valid and not p.is_empty)
+             # else: print(f"Unexpected geometry type after debuffer: {debuffered.geom_type}") # Debugging
+
+
+        merged_contours_np = []
+        min_final_area = 1.0 # Minimum area for a polygon to be kept after merging/debuffering
+        for p in final_polys_shapely:
+            if p.is_valid and not p.is_empty and p.geom_type == 'Polygon' and p.area > min_final_area:
+                # Get exterior coordinates, convert to int32, reshape for OpenCV
+                coords = np.array(p.exterior.coords, dtype=np.int32)
+                # Ensure we have enough points and correct shape
+                if len(coords) >= 4: # Need at least 3 points + closing point from shapely
+                   # Reshape to OpenCV contour format: (N, 1, 2)
+                   # Exclude the last point (duplicate of the first) from shapely
+                   merged_contours_np.append(coords[:-1].reshape((-1, 1, 2)))
+                # else: print(f"Skipping polygon with < 4 coords after merge: {len(coords)}") # Debugging
+        return merged_contours_np
+
+    except Exception as e:
+        print(f"Shapely merge/buffer error: {e}");
+        return polygons # Return original polygons on error
@@ -0,0 +1,267 @@
+import math
+from collections import namedtuple
+
+import numpy as np
+
+from prepare_wall_packet import load_polygon_lines_array
+
+GRID_CELL = 32      # Grid index cell size (px)
+PICK_RADIUS = 6     # Max distance (px) for clicking a wall
+SNAP_RADIUS = 8     # Drawn wall endpoints snap to existing endpoints this close
+MIN_SPLIT = 1.0     # Splits closer than this to an endpoint are ignored
+
+# One undoable edit: ids that were switched off and on. Coordinates are never
+# modified, so an edit (and the whole history) only ever holds ids.
+Edit = namedtuple("Edit", ["removed", "added"])
+
+_NO_IDS = np.empty(0, dtype=np.int64)
+
+
+class SegmentGrid:
+    """Uniform grid over line segments: cell -> ids of the segments crossing it.
+
+    Segments are rasterized into cells by sampling every cell / 2 along them,
+    and queries are padded by cell / 4 so no crossing segment is missed (a
+    segment can only skip a cell over less than cell / 2). Lookups cost O(cells
+    touched + candidates), independent of the total wall count.
+    """
+
+    def __init__(self, cell=GRID_CELL):
+        self.cell = cell
+        self.cells = {} # (cx, cy) -> list of ids
+
+    def insert(self, ids, coords):
+        ids = np.asarray(ids, dtype=np.int64)
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 4)
+        if not len(ids): return
+        step = self.cell / 2
+        lengths = np.hypot(coords[:, 2] - coords[:, 0], coords[:, 3] - coords[:, 1])
+        samples = np.ceil(lengths / step).astype(np.int64) + 1
+        owner = np.repeat(np.arange(len(ids)), samples)
+        # Position of each sample along its segment, 0..1
+        first = np.repeat(np.cumsum(samples) - samples, samples)
+        t = (np.arange(len(owner)) - first) / np.maximum(samples[owner] - 1, 1)
+        c = coords[owner]
+        cx = np.floor((c[:, 0] + t * (c[:, 2] - c[:, 0])) / self.cell).astype(np.int64)
+        cy = np.floor((c[:, 1] + t * (c[:, 3] - c[:, 1])) / self.cell).astype(np.int64)
+        # One entry per (segment, cell)
+        entries = np.unique(np.column_stack([cx, cy, ids[owner]]), axis=0)
+        if len(entries) == 0: return
+        keys = entries[:, :2]
+        bounds = np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1
+        starts = np.concatenate(([0], bounds)).tolist()
+        ends = np.concatenate((bounds, [len(entries)])).tolist()
+        cells = self.cells
+        for (kx, ky), s, e in zip(keys[starts].tolist(), starts, ends):
+            cells.setdefault((kx, ky), []).extend(entries[s:e, 2].tolist())
+
+    def candidates(self, x0, y0, x1, y1):
+        """Ids of the segments that may intersect the rectangle (unique, unfiltered)."""
+        pad = self.cell / 4
+        c = self.cell
+        cx0, cx1 = math.floor((min(x0, x1) - pad) / c), math.floor((max(x0, x1) + pad) / c)
+        cy0, cy1 = math.floor((min(y0, y1) - pad) / c), math.floor((max(y0, y1) + pad) / c)
+        found = []
+        cells = self.cells
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(cells):
+            # Huge query: walk the occupied cells instead of the covered ones
+            for (kx, ky), ids in cells.items():
+                if cx0 <= kx <= cx1 and cy0 <= ky <= cy1:
+                    found.extend(ids)
+        else:
+            for kx in range(cx0, cx1 + 1):
+                for ky in range(cy0, cy1 + 1):
+                    ids = cells.get((kx, ky))
+                    if ids: found.extend(ids)
+        if not found:
+            return _NO_IDS
+        return np.unique(np.asarray(found, dtype=np.int64))
+
+
+def segments_in_rect(coords, x0, y0, x1, y1):
+    """Mask of the segments (N x 4) that intersect the rectangle (Liang-Barsky clipping)."""
+    x0, x1 = min(x0, x1), max(x0, x1)
+    y0, y1 = min(y0, y1), max(y0, y1)
+    sx, sy = coords[:, 0], coords[:, 1]
+    dx, dy = coords[:, 2] - sx, coords[:, 3] - sy
+    t0 = np.zeros(len(coords))
+    t1 = np.ones(len(coords))
+    ok = np.ones(len(coords), dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for p, q in ((-dx, sx - x0), (dx, x1 - sx), (-dy, sy - y0), (dy, y1 - sy)):
+            parallel = p == 0
+            ok &= ~(parallel & (q < 0))
+            r = q / p
+            t0 = np.where(~parallel & (p < 0), np.maximum(t0, r), t0)
+            t1 = np.where(~parallel & (p > 0), np.minimum(t1, r), t1)
+    return ok & (t0 <= t1)
+
+
+def point_segment_distance(coords, x, y):
+    sx, sy = coords[:, 0], coords[:, 1]
+    dx, dy = coords[:, 2] - sx, coords[:, 3] - sy
+    length_sq = dx * dx + dy * dy
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.clip(((x - sx) * dx + (y - sy) * dy) / length_sq, 0, 1)
+    t = np.where(length_sq > 0, t, 0)
+    return np.hypot(sx + t * dx - x, sy + t * dy - y)
+
+
+class WallEditor:
+    """Editable wall segments with a grid index and undo / redo.
+
+    Segments live in an append-only coordinate array and are switched on and
+    off through an alive mask: delete clears ids, add / split append rows. The
+    undo history therefore only stores ids (Edit tuples) and shares the
+    coordinate array, it never copies it. Ids are stable for the editor's life.
+    """
+
+    def __init__(self, segments, cell=GRID_CELL):
+        segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+        self._coords = segments.copy()
+        self.count = len(segments)
+        self.alive = np.ones(self.count, dtype=bool)
+        self.grid = SegmentGrid(cell)
+        self.grid.insert(np.arange(self.count), self._coords)
+        self.undo_stack = []
+        self.redo_stack = []
+
+    @classmethod
+    def from_walls(cls, polygons, lines, cell=GRID_CELL, min_distance=0, scale=(1, 1)):
+        """Editor over detection output: polygon outlines become closed chains of segments.
+
+        Polygon points are thinned with min_distance the way the export does it, in
+        export coordinates (image coordinates * scale, rounded), so the editor holds
+        the walls an unedited export would send.
+        """
+        sx, sy = scale
+        polygons = [np.rint(np.asarray(p).reshape(-1, 2) * (sx, sy)) for p in polygons]
+        polygons = [p for p in polygons if len(p) >= 3] # The export drops these too
+        lines = np.rint(np.asarray(lines, dtype=np.float64).reshape(-1, 4) * (sx, sy, sx, sy))
+        segments = load_polygon_lines_array({"polygons": polygons, "lines": lines}, min_distance)
+        segments /= (sx, sy, sx, sy)
+        # Single-point polygons close onto themselves
+        segments = segments[(segments[:, 0] != segments[:, 2]) | (segments[:, 1] != segments[:, 3])]
+        return cls(segments, cell)
+
+    @property
+    def coords(self):
+        return self._coords[:self.count]
+
+    def segments(self):
+        """(M, 4) array of the current walls."""
+        return self.coords[self.alive[:self.count]]
+
+    def segments_by_id(self, ids):
+        return self.coords[np.asarray(ids, dtype=np.int64)]
+
+    def __len__(self):
+        return int(np.count_nonzero(self.alive[:self.count]))
+
+    @property
+    def edited(self):
+        return bool(self.undo_stack)
+
+    # --- Queries ---
+
+    def ids_in_rect(self, x0, y0, x1, y1):
+        """Ids of the current walls intersecting the rectangle."""
+        ids = self.grid.candidates(x0, y0, x1, y1)
+        ids = ids[self.alive[ids]]
+        return ids[segments_in_rect(self.coords[ids], x0, y0, x1, y1)]
+
+    def nearest(self, x, y, radius=PICK_RADIUS):
+        """Id of the closest current wall within radius of (x, y), or None."""
+        ids = self.grid.candidates(x - radius, y - radius, x + radius, y + radius)
+        ids = ids[self.alive[ids]]
+        if not len(ids): return None
+        dist = point_segment_distance(self.coords[ids], x, y)
+        best = int(np.argmin(dist))
+        return int(ids[best]) if dist[best] <= radius else None
+
+    def snap(self, x, y, radius=SNAP_RADIUS):
+        """Closest endpoint of a current wall within radius, else (x, y)."""
+        ids = self.grid.candidates(x - radius, y - radius, x + radius, y + radius)
+        ids = ids[self.alive[ids]]
+        if not len(ids): return x, y
+        points = self.coords[ids].reshape(-1, 2)
+        dist = np.hypot(points[:, 0] - x, points[:, 1] - y)
+        best = int(np.argmin(dist))
+        if dist[best] > radius: return x, y
+        return float(points[best, 0]), float(points[best, 1])
+
+    def bounds(self, ids):
+        """Bounding box (x0, y0, x1, y1) of the given walls, or None."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(ids): return None
+        c = self.coords[ids]
+        xs, ys = c[:, 0::2], c[:, 1::2]
+        return float(xs.min()), float(ys.min()), float(xs.max()), float(ys.max())
+
+    # --- Edits ---
+
+    def _append(self, segments):
+        segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+        needed = self.count + len(segments)
+        if needed > len(self._coords):
+            # Grow geometrically; old rows are copied once, never per edit
+            capacity = max(needed, 2 * len(self._coords), 64)
+            coords = np.empty((capacity, 4))
+            coords[:self.count] = self._coords[:self.count]
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:self.count] = self.alive[:self.count]
+            self._coords, self.alive = coords, alive
+        ids = np.arange(self.count, needed)
+        self._coords[ids] = segments
+        self.count = needed
+        self.grid.insert(ids, segments)
+        return ids
+
+    def _apply(self, edit):
+        self.alive[edit.removed] = False
+        self.alive[edit.added] = True
+
+    def _commit(self, edit):
+        self._apply(edit)
+        self.undo_stack.append(edit)
+        self.redo_stack.clear() # Rows added by undone edits stay in the arrays, just unreachable
+        return edit
+
+    def delete(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        ids = np.unique(ids[self.alive[ids]])
+        if not len(ids): return None
+        return self._commit(Edit(ids, _NO_IDS))
+
+    def add(self, segments):
+        segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+        segments = segments[(segments[:, 0] != segments[:, 2]) | (segments[:, 1] != segments[:, 3])]
+        if not len(segments): return None
+        return self._commit(Edit(_NO_IDS, self._append(segments)))
+
+    def split(self, wall_id, x, y):
+        """Splits a wall in two at the point of it closest to (x, y)."""
+        if wall_id is None or not self.alive[wall_id]: return None
+        x1, y1, x2, y2 = self.coords[wall_id].tolist()
+        dx, dy = x2 - x1, y2 - y1
+        length = math.hypot(dx, dy)
+        if length < 2 * MIN_SPLIT: return None
+        t = ((x - x1) * dx + (y - y1) * dy) / (length * length)
+        t = min(max(t, MIN_SPLIT / length), 1 - MIN_SPLIT / length)
+        px, py = round(x1 + t * dx, 1), round(y1 + t * dy, 1)
+        added = self._append([(x1, y1, px, py), (px, py, x2, y2)])
+        return self._commit(Edit(np.array([wall_id], dtype=np.int64), added))
+
+    def undo(self):
+        if not self.undo_stack: return None
+        edit = self.undo_stack.pop()
+        self._apply(Edit(edit.added, edit.removed))
+        self.redo_stack.append(edit)
+        return edit
+
+    def redo(self):
+        if not self.redo_stack: return None
+        edit = self.redo_stack.pop()
+        self._apply(edit)
+        self.undo_stack.append(edit)
+        return edit
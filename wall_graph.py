@@ -0,0 +1,190 @@
+import numpy as np
+
+from lazy_imports import LazyModule
+
+cv2 = LazyModule("cv2") # Only needed for chain simplification
+
+# Half of the 3x3 cell neighbourhood: every pair of neighbouring cells is visited once
+_NEIGHBOUR_OFFSETS = ((0, 0), (1, 0), (0, 1), (1, 1), (1, -1))
+
+
+def cell_pairs(cells, offsets=_NEIGHBOUR_OFFSETS):
+    """Spatial hash over integer cell coords. Yields (a, b) point index arrays for every
+    pair of points that share a cell or sit in neighbouring cells (each pair once)."""
+    if not len(cells):
+        return
+    order = np.lexsort((cells[:, 1], cells[:, 0]))
+    sorted_cells = cells[order]
+    new_cell = np.ones(len(order), dtype=bool)
+    new_cell[1:] = np.any(sorted_cells[1:] != sorted_cells[:-1], axis=1)
+    starts = np.flatnonzero(new_cell)
+    counts = np.diff(np.append(starts, len(order)))
+    uniq = sorted_cells[starts]
+    # Pack cell coords into one sortable int64 key for lookups
+    base = uniq.min(axis=0) - 1
+    span = int(uniq[:, 1].max() - base[1] + 2)
+    keys = (uniq[:, 0] - base[0]) * span + (uniq[:, 1] - base[1])
+
+    for dx, dy in offsets:
+        nkeys = (uniq[:, 0] + dx - base[0]) * span + (uniq[:, 1] + dy - base[1])
+        pos = np.searchsorted(keys, nkeys)
+        pos_c = np.minimum(pos, len(keys) - 1)
+        found = keys[pos_c] == nkeys
+        ca = np.flatnonzero(found)
+        cb = pos_c[found]
+        if not len(ca): continue
+        na, nb = counts[ca], counts[cb]
+        sizes = na * nb
+        total = int(sizes.sum())
+        if not total: continue
+        pair = np.repeat(np.arange(len(ca)), sizes)
+        local = np.arange(total) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        ii = local // nb[pair]
+        jj = local % nb[pair]
+        a = order[starts[ca][pair] + ii]
+        b = order[starts[cb][pair] + jj]
+        if dx == 0 and dy == 0:
+            keep = ii < jj
+            a, b = a[keep], b[keep]
+        yield a, b
+
+
+def connected_components(n, a, b):
+    """Connected component label per node for the undirected edges (a, b)."""
+    labels = np.arange(n)
+    if not len(a): return labels
+    while True:
+        # Min-label propagation; clusters are small so this converges in a few rounds
+        m = np.minimum(labels[a], labels[b])
+        new = labels.copy()
+        np.minimum.at(new, a, m)
+        np.minimum.at(new, b, m)
+        new = new[new] # Pointer jumping
+        if np.array_equal(new, labels): return labels
+        labels = new
+
+
+def snap_endpoints(segments, tolerance):
+    """Merges segment endpoints closer than tolerance (or identical, for 0) into shared nodes.
+
+    Returns (nodes, edges): node coordinates (K, 2) at the mean of each cluster and
+    an (N, 2) array of node indices per segment.
+    """
+    pts = segments.reshape(-1, 2).astype(np.float64)
+    n = len(pts)
+    if tolerance > 0 and n:
+        cells = np.floor(pts / tolerance).astype(np.int64)
+        tol_sq = tolerance * tolerance
+        pair_a, pair_b = [], []
+        for a, b in cell_pairs(cells):
+            close = np.sum((pts[a] - pts[b]) ** 2, axis=1) <= tol_sq
+            pair_a.append(a[close]); pair_b.append(b[close])
+        a = np.concatenate(pair_a) if pair_a else np.empty(0, dtype=np.int64)
+        b = np.concatenate(pair_b) if pair_b else np.empty(0, dtype=np.int64)
+        labels = connected_components(n, a, b)
+    elif n:
+        # No tolerance: only exactly coincident endpoints share a node
+        order = np.lexsort((pts[:, 1], pts[:, 0]))
+        new_point = np.ones(n, dtype=bool)
+        new_point[1:] = np.any(pts[order[1:]] != pts[order[:-1]], axis=1)
+        labels = np.empty(n, dtype=np.int64)
+        labels[order] = order[np.flatnonzero(new_point)][np.cumsum(new_point) - 1]
+    else:
+        labels = np.arange(n)
+    uniq, node_of = np.unique(labels, return_inverse=True)
+    counts = np.bincount(node_of)
+    nodes = np.stack([np.bincount(node_of, weights=pts[:, 0]) / counts,
+                      np.bincount(node_of, weights=pts[:, 1]) / counts], axis=1)
+    return nodes, node_of.reshape(-1, 2)
+
+
+def build_adjacency(n_nodes, edges):
+    """Deduplicated undirected adjacency lists (self loops dropped)."""
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    edges = np.unique(np.sort(edges, axis=1), axis=0)
+    adjacency = [[] for _ in range(n_nodes)]
+    for u, v in edges.tolist():
+        adjacency[u].append(v)
+        adjacency[v].append(u)
+    return adjacency
+
+
+def walk_chains(adjacency):
+    """Splits the graph into maximal chains whose inner nodes all have degree 2.
+
+    Returns a list of (node_list, closed) tuples; closed chains are pure cycles.
+    """
+    visited = set() # Undirected edges already walked, as (min, max)
+    chains = []
+
+    def walk(start, nxt):
+        chain = [start]
+        prev, cur = start, nxt
+        visited.add((min(prev, cur), max(prev, cur)))
+        while True:
+            chain.append(cur)
+            if len(adjacency[cur]) != 2 or cur == start:
+                return chain
+            a, b = adjacency[cur]
+            step = b if a == prev else a
+            edge = (min(cur, step), max(cur, step))
+            if edge in visited:
+                return chain
+            visited.add(edge)
+            prev, cur = cur, step
+
+    # Open chains start and end at junctions / dead ends
+    for node, neighbours in enumerate(adjacency):
+        if len(neighbours) == 2: continue
+        for nxt in neighbours:
+            if (min(node, nxt), max(node, nxt)) in visited: continue
+            chains.append((walk(node, nxt), False))
+    # Whatever is left are isolated cycles of degree-2 nodes
+    for node, neighbours in enumerate(adjacency):
+        if len(neighbours) != 2: continue
+        nxt = neighbours[0]
+        if (min(node, nxt), max(node, nxt)) in visited: continue
+        chain = walk(node, nxt)
+        chains.append((chain[:-1] if chain[-1] == chain[0] else chain, True))
+    return chains
+
+
+def simplify_chain(points, tolerance, closed):
+    """Douglas-Peucker on one chain; the result stays within tolerance of the input."""
+    if tolerance <= 0 or len(points) <= 2:
+        return points
+    approx = cv2.approxPolyDP(points.astype(np.float32).reshape(-1, 1, 2), tolerance, closed)
+    return approx.reshape(-1, 2).astype(np.float64)
+
+
+def fuse_walls(segments, snap_tolerance=2.0, simplify_tolerance=1.0):
+    """Fuses nearly collinear chains of wall segments into fewer walls.
+
+    Endpoints within snap_tolerance are merged (spatial hash), the resulting graph
+    is split into degree-2 chains, and each chain is re-simplified so that no
+    emitted wall deviates more than simplify_tolerance from the snapped geometry.
+    Returns an (M, 4) array of [x1, y1, x2, y2].
+    """
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+    if not len(segments):
+        return segments
+    nodes, edges = snap_endpoints(segments, snap_tolerance)
+    adjacency = build_adjacency(len(nodes), edges)
+    out = []
+    for chain, closed in walk_chains(adjacency):
+        if not closed and chain[0] == chain[-1] and len(chain) > 3:
+            # Loop hanging off a junction: the junction must survive, so split the loop in two
+            mid = len(chain) // 2
+            pieces = [chain[:mid + 1], chain[mid:]]
+        else:
+            pieces = [chain]
+        for piece in pieces:
+            pts = simplify_chain(nodes[piece], simplify_tolerance, closed)
+            if closed and len(pts) >= 3:
+                pts = np.vstack([pts, pts[:1]])
+            if len(pts) >= 2:
+                out.append(np.hstack([pts[:-1], pts[1:]]))
+    if not out:
+        return np.empty((0, 4))
+    fused = np.concatenate(out)
+    return fused[np.any(fused[:, :2] != fused[:, 2:], axis=1)]
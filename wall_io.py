@@ -0,0 +1,196 @@
+import json
+import re
+import struct
+
+import numpy as np
+
+# --- Compact binary format (.fvw) ---
+# Little endian header, then the metadata JSON (padded to 4 bytes), then three
+# int32 blocks: polygon offsets (P + 1), polygon points (M x 2), lines (L x 4).
+# Everything after the header is int32, so the blocks can be memory-mapped as is.
+BINARY_MAGIC = b"FVTW"
+BINARY_VERSION = 1
+BINARY_EXT = ".fvw"
+_HEADER = struct.Struct("<4sIIIII") # magic, version, meta bytes, polygons, points, lines
+
+JSON_CHUNK = 1 << 16
+_ARRAY_KEYS = ("polygons", "lines")
+
+
+def _flatten_polygons(polygons):
+    offsets = np.zeros(len(polygons) + 1, dtype=np.int64)
+    if len(polygons):
+        offsets[1:] = np.cumsum([len(p) for p in polygons])
+        points = np.concatenate([np.asarray(p, dtype=np.float64).reshape(-1, 2) for p in polygons])
+    else:
+        points = np.empty((0, 2))
+    return points, offsets
+
+
+def save_walls_binary(path, data, metadata=None):
+    """Writes {"polygons", "lines"} as packed int32 (coordinates rounded to whole pixels)."""
+    points, offsets = _flatten_polygons(data.get("polygons", []))
+    lines = np.asarray(data.get("lines", []), dtype=np.float64).reshape(-1, 4)
+    meta = json.dumps(metadata or {}).encode()
+    meta += b" " * (-len(meta) % 4)
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(meta), len(offsets) - 1, len(points), len(lines)))
+        f.write(meta)
+        f.write(offsets.astype("<i4").tobytes())
+        f.write(np.rint(points).astype("<i4").tobytes())
+        f.write(np.rint(lines).astype("<i4").tobytes())
+
+
+def is_binary_walls(path):
+    with open(path, "rb") as f:
+        return f.read(len(BINARY_MAGIC)) == BINARY_MAGIC
+
+
+def load_walls_binary(path):
+    """Memory-maps a .fvw file. Polygons are (N, 2) views into the mapping, lines an (L, 4) view."""
+    with open(path, "rb") as f:
+        magic, version, meta_len, n_polygons, n_points, n_lines = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != BINARY_MAGIC:
+            raise ValueError(f"{path} is not a wall binary file.")
+        if version > BINARY_VERSION:
+            raise ValueError(f"Unsupported wall binary version {version}.")
+        metadata = json.loads(f.read(meta_len) or b"{}")
+    count = (n_polygons + 1) + n_points * 2 + n_lines * 4
+    block = np.memmap(path, dtype="<i4", mode="r", offset=_HEADER.size + meta_len, shape=(count,))
+    offsets = block[:n_polygons + 1]
+    points = block[n_polygons + 1:n_polygons + 1 + n_points * 2].reshape(-1, 2)
+    lines = block[n_polygons + 1 + n_points * 2:].reshape(-1, 4)
+    bounds = offsets.tolist()
+    polygons = [points[bounds[i]:bounds[i + 1]] for i in range(n_polygons)]
+    return {"metadata": metadata, "polygons": polygons, "lines": lines}
+
+
+# --- Streaming JSON for the existing {"metadata", "walls": {"polygons", "lines"}} schema ---
+
+def _tolist(item):
+    return item.tolist() if hasattr(item, "tolist") else list(item)
+
+
+def write_walls_json(path, data, metadata=None):
+    """Writes the export JSON one polygon / line per line, without building the whole document.
+
+    path can also be an open text stream (e.g. an HTTP response), which is left open.
+    """
+    if hasattr(path, "write"):
+        _write_walls_json(path, data, metadata)
+        return
+    with open(path, "w") as f:
+        _write_walls_json(f, data, metadata)
+
+
+def _write_walls_json(f, data, metadata):
+    f.write('{\n    "metadata": ')
+    f.write(json.dumps(metadata or {}))
+    f.write(',\n    "walls": {')
+    keys = [k for k in _ARRAY_KEYS if k in data]
+    for k, key in enumerate(keys):
+        f.write(',' if k else '')
+        f.write(f'\n        "{key}": [')
+        for i, item in enumerate(data[key]):
+            f.write(',\n            ' if i else '\n            ')
+            f.write(json.dumps(_tolist(item), separators=(",", ":")))
+        f.write('\n        ]' if len(data[key]) else ']')
+    f.write('\n    }\n}\n')
+
+
+def iter_walls_json(path, chunk_size=JSON_CHUNK):
+    """Streams (key, value) pairs out of a wall JSON file.
+
+    Every item of a "polygons" / "lines" array is yielded on its own as
+    ("polygons", item) / ("lines", item), and "metadata" as one value, wherever
+    they sit in the document (top level or under "walls"). Only one chunk plus
+    the current item is held in memory.
+    """
+    decoder = json.JSONDecoder()
+    key_re = re.compile(r'"(polygons|lines|metadata)"\s*:\s*')
+    skip_re = re.compile(r'[\s,]*')
+    with open(path, "r") as f:
+        buf = ""; pos = 0; eof = False
+
+        def fill():
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk: eof = True
+            buf = buf[pos:] + chunk; pos = 0
+
+        def decode():
+            # Decodes one value at pos, reading more until it is complete
+            nonlocal pos
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buf, pos)
+                    if end < len(buf) or eof: # A number could continue in the next chunk
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof: raise
+                fill()
+
+        def skip_ws():
+            nonlocal pos
+            while True:
+                pos = skip_re.match(buf, pos).end()
+                if pos < len(buf) or eof: return
+                fill()
+
+        fill()
+        while True:
+            match = key_re.search(buf, pos)
+            if match is None or match.end() == len(buf):
+                if eof: return
+                # Keep a tail in case a key is split across chunks
+                pos = match.start() if match else max(pos, len(buf) - 32)
+                fill()
+                continue
+            key = match.group(1)
+            pos = match.end()
+            if key == "metadata":
+                yield key, decode()
+                continue
+            skip_ws()
+            if pos >= len(buf): return
+            if buf[pos] != "[": # e.g. "lines": null
+                continue
+            pos += 1
+            while True:
+                skip_ws()
+                if pos >= len(buf): return
+                if buf[pos] == "]":
+                    pos += 1
+                    break
+                yield key, decode()
+
+
+def load_walls_json(path):
+    """Streaming load of a wall JSON into numpy: polygons as (N, 2) arrays, lines as (L, 4)."""
+    result = {"metadata": {}, "polygons": [], "lines": []}
+    lines = []
+    for key, value in iter_walls_json(path):
+        if key == "polygons":
+            result["polygons"].append(np.asarray(value).reshape(-1, 2))
+        elif key == "lines":
+            lines.append(value)
+        else:
+            result["metadata"] = value
+    result["lines"] = np.asarray(lines, dtype=np.float64).reshape(-1, 4)
+    return result
+
+
+def save_walls(path, data, metadata=None):
+    """Picks the format from the extension: .fvw is binary, anything else streaming JSON."""
+    if path.lower().endswith(BINARY_EXT):
+        save_walls_binary(path, data, metadata)
+    else:
+        write_walls_json(path, data, metadata)
+
+
+def load_walls(path):
+    """Loads either format (detected from the file content)."""
+    if is_binary_walls(path):
+        return load_walls_binary(path)
+    return load_walls_json(path)
@@ -0,0 +1,173 @@
+import numpy as np
+
+EPS = 1e-9
+SNAP_ROUNDS = 50 # Re-projection rounds for chained T-junctions (a host that is snapped itself)
+
+
+def _segment_cells(segments, cell_size):
+    """(segment index, cell key) pairs for every grid cell near each segment.
+
+    Segments are sampled every half cell and each sample claims its 3x3 block of
+    cells, a superset of the cells within cell_size / 2 of the segment.
+    """
+    p0 = segments[:, :2]; p1 = segments[:, 2:]
+    lengths = np.hypot(*(p1 - p0).T)
+    samples = np.maximum(2, np.ceil(lengths / (cell_size / 2)).astype(np.int64) + 1)
+    seg = np.repeat(np.arange(len(segments)), samples)
+    t = (np.arange(samples.sum()) - np.repeat(np.cumsum(samples) - samples, samples)) / np.repeat(samples - 1, samples)
+    pts = p0[seg] + (p1 - p0)[seg] * t[:, None]
+    cells = np.floor(pts / cell_size).astype(np.int64)
+    seg = np.repeat(seg, 9)
+    offsets = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+    cells = (cells[:, None, :] + offsets[None, :, :]).reshape(-1, 2)
+    cells -= cells.min(axis=0)
+    keys = cells[:, 0] * (int(cells[:, 1].max()) + 1) + cells[:, 1]
+    # Drop repeated (cell, segment) entries; sorted by cell as a side effect
+    n = len(segments)
+    packed = np.unique(keys * n + seg)
+    return packed % n, packed // n
+
+
+def candidate_pairs(segments, cell_size):
+    """Unique (i, j), i < j, segment pairs that share at least one grid cell.
+
+    Any two segments closer than cell_size / 2 are guaranteed to be returned.
+    """
+    seg, keys = _segment_cells(segments, cell_size)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    counts = np.diff(np.r_[starts, len(keys)])
+    sizes = counts * counts
+    total = int(sizes.sum())
+    if not total:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    # All i < j pairs inside each cell bucket
+    bucket = np.repeat(np.arange(len(starts)), sizes)
+    k = np.arange(total) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    n = counts[bucket]
+    i, j = k // n, k % n
+    upper = i < j
+    bucket, i, j = bucket[upper], i[upper], j[upper]
+    a = seg[starts[bucket] + i]
+    b = seg[starts[bucket] + j]
+    n_seg = len(segments)
+    packed = np.unique(np.minimum(a, b) * n_seg + np.maximum(a, b))
+    return packed // n_seg, packed % n_seg
+
+
+def _project(points, segments):
+    """Parameter t of the projection of each point on its segment, and the distance to it."""
+    p0 = segments[:, :2]; d = segments[:, 2:] - p0
+    len_sq = np.maximum(np.sum(d * d, axis=1), EPS)
+    t = np.sum((points - p0) * d, axis=1) / len_sq
+    proj = p0 + d * np.clip(t, 0, 1)[:, None]
+    return t, np.hypot(*(points - proj).T)
+
+
+def snap_t_junctions(segments, a, b, tolerance):
+    """Moves segment endpoints that stop within tolerance of another segment's interior
+    onto it. Returns the updated segments and (segment, t, x, y) split points.
+
+    Split points are computed on the hosts after every endpoint was snapped, so
+    they lie on the final geometry even when a host was snapped itself."""
+    segments = segments.copy()
+    # Every endpoint of a against segment b and vice versa
+    ep_seg = np.concatenate([a, a, b, b])
+    ep_end = np.concatenate([np.zeros_like(a), np.ones_like(a), np.zeros_like(b), np.ones_like(b)])
+    target = np.concatenate([b, b, a, a])
+    points = segments[ep_seg].reshape(-1, 2, 2)[np.arange(len(ep_seg)), ep_end]
+    t, dist = _project(points, segments[target])
+    tgt_len = np.hypot(*(segments[target, 2:] - segments[target, :2]).T)
+    # Near the interior of the target, and not already close to one of its endpoints
+    margin = tolerance / np.maximum(tgt_len, EPS)
+    hit = (dist <= tolerance) & (t > margin) & (t < 1 - margin)
+    if not hit.any():
+        return segments, np.empty((0, 4))
+    ep_seg, ep_end, target, t, dist = ep_seg[hit], ep_end[hit], target[hit], t[hit], dist[hit]
+    # One snap per endpoint: the nearest target wins
+    order = np.lexsort((dist, ep_end, ep_seg))
+    first = np.r_[True, (np.diff(ep_seg[order]) != 0) | (np.diff(ep_end[order]) != 0)]
+    sel = order[first]
+    ep_seg, ep_end, target, dist = ep_seg[sel], ep_end[sel], target[sel], dist[sel]
+    # Two walls snapping onto each other would chase each other's endpoints:
+    # only the wall with the closer snap keeps it
+    n = len(segments)
+    keys, reverse = ep_seg * n + target, target * n + ep_seg
+    uniq, inv = np.unique(keys, return_inverse=True)
+    best = np.full(len(uniq), np.inf)
+    np.minimum.at(best, inv, dist)
+    pos = np.minimum(np.searchsorted(uniq, reverse), len(uniq) - 1)
+    partner = np.where(uniq[pos] == reverse, best[pos], np.inf)
+    keep = (dist < partner) | ((dist == partner) & (ep_seg < target))
+    ep_seg, ep_end, target = ep_seg[keep], ep_end[keep], target[keep]
+    if not len(ep_seg):
+        return segments, np.empty((0, 4))
+    # Snap every endpoint, then project again on the snapped hosts: a host whose own
+    # endpoint moved would otherwise be split at points off its final geometry
+    x_col, y_col = ep_end * 2, ep_end * 2 + 1
+    for _ in range(SNAP_ROUNDS):
+        points = np.column_stack([segments[ep_seg, x_col], segments[ep_seg, y_col]])
+        t, _ = _project(points, segments[target])
+        p0 = segments[target, :2]
+        proj = p0 + (segments[target, 2:] - p0) * np.clip(t, 0, 1)[:, None]
+        segments[ep_seg, x_col] = proj[:, 0]
+        segments[ep_seg, y_col] = proj[:, 1]
+        if np.abs(proj - points).max() <= EPS: break
+    # Split parameters on the final host geometry, at the snapped endpoint coordinates
+    points = np.column_stack([segments[ep_seg, x_col], segments[ep_seg, y_col]])
+    t, _ = _project(points, segments[target])
+    return segments, np.column_stack([target, t, points])
+
+
+def crossings(segments, a, b):
+    """Proper crossings (interior of both segments). Returns (segment, t, x, y) split points."""
+    p = segments[a, :2]; r = segments[a, 2:] - p
+    q = segments[b, :2]; s = segments[b, 2:] - q
+    denom = r[:, 0] * s[:, 1] - r[:, 1] * s[:, 0]
+    qp = q - p
+    parallel = np.abs(denom) < EPS
+    denom = np.where(parallel, 1.0, denom)
+    t = (qp[:, 0] * s[:, 1] - qp[:, 1] * s[:, 0]) / denom
+    u = (qp[:, 0] * r[:, 1] - qp[:, 1] * r[:, 0]) / denom
+    hit = ~parallel & (t > EPS) & (t < 1 - EPS) & (u > EPS) & (u < 1 - EPS)
+    a, b, t, u = a[hit], b[hit], t[hit], u[hit]
+    pts = p[hit] + r[hit] * t[:, None]
+    # Both segments get the exact same split coordinates
+    return np.vstack([np.column_stack([a, t, pts]), np.column_stack([b, u, pts])])
+
+
+def split_segments(segments, splits):
+    """Cuts each segment at its split points (segment, t, x, y)."""
+    n = len(segments)
+    ends = np.vstack([
+        np.column_stack([np.arange(n), np.zeros(n), segments[:, :2]]),
+        np.column_stack([np.arange(n), np.ones(n), segments[:, 2:]]),
+        splits.reshape(-1, 4),
+    ])
+    ends = ends[np.lexsort((ends[:, 1], ends[:, 0]))]
+    same = ends[1:, 0] == ends[:-1, 0]
+    out = np.hstack([ends[:-1, 2:], ends[1:, 2:]])[same]
+    return out[np.any(np.abs(out[:, :2] - out[:, 2:]) > EPS, axis=1)]
+
+
+def clean_topology(segments, tolerance=2.0, cell_size=None):
+    """Produces a topologically clean wall network.
+
+    Endpoints that stop (or overshoot) within tolerance of another wall are snapped
+    onto it (T-junctions), then every pair of crossing walls is split at the
+    crossing so the walls share an endpoint. Candidate pairs come from a uniform
+    grid, so the cost is O(n + k) for n walls and k candidate pairs instead of
+    checking every pair. Returns an (M, 4) array.
+    """
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 4)
+    if len(segments) < 2:
+        return segments
+    if cell_size is None:
+        lengths = np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+        cell_size = max(float(np.median(lengths)), 2.0 * tolerance, 1.0)
+    cell_size = max(cell_size, 2.0 * tolerance)
+    a, b = candidate_pairs(segments, cell_size)
+    if not len(a):
+        return segments
+    segments, t_splits = snap_t_junctions(segments, a, b, tolerance)
+    x_splits = crossings(segments, a, b)
+    return split_segments(segments, np.vstack([t_splits, x_splits]))
@@ -0,0 +1,316 @@
+import argparse
+import hashlib
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import wall_detection
+import wall_io
+from core_budget import available_cores, threads_per_worker
+from detection_cache import DEFAULT_CACHE_DIR, cache_key
+from detection_service import init_worker, run_job, spec_from_query
+from memory_budget import parse_size
+
+# Watches folders for new / changed maps and runs detection on them in the background.
+#
+# Each poll is a stat() scan only; a file is hashed once its size and mtime have
+# stopped changing for SETTLE_TIME (so half-copied files are left alone), and
+# (content hash, parameters, job settings) combinations that were already processed
+# are skipped, also across restarts through the index kept next to the outputs.
+
+POLL_INTERVAL = 1.0     # Seconds between folder scans
+SETTLE_TIME = 1.0       # A file must be unchanged this long before it is processed
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff")
+OUTPUT_DIR = "walls"    # Default output folder, inside the (first) watched folder
+INDEX_NAME = ".wall_index.json"
+UPLOAD_TIMEOUT = 300
+
+
+def file_digest(path, chunk_size=1 << 20):
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def scan_images(folders, skip_dirs=(), recursive=False):
+    """{path: (size, mtime_ns)} for every image in folders. Only stats, never opens files."""
+    found = {}
+    skip = {os.path.realpath(d) for d in skip_dirs}
+    pending = [os.path.abspath(f) for f in folders]
+    while pending:
+        folder = pending.pop()
+        try:
+            entries = list(os.scandir(folder))
+        except OSError as e:
+            print(f"Warning: cannot scan {folder}: {e}")
+            continue
+        for entry in entries:
+            if entry.name.startswith("."): continue
+            try:
+                if entry.is_dir():
+                    if recursive and os.path.realpath(entry.path) not in skip:
+                        pending.append(entry.path)
+                elif entry.name.lower().endswith(IMAGE_EXTS):
+                    st = entry.stat()
+                    found[entry.path] = (st.st_size, st.st_mtime_ns)
+            except OSError:
+                continue # Removed while scanning
+    return found
+
+
+class WatchIndex:
+    """What has been processed: file stats -> content hash, job key -> output, and
+    output -> the job key it holds the walls of.
+
+    Saved as JSON next to the outputs (temp file + rename, like the detection cache).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {} # path -> [size, mtime_ns, digest]
+        self.done = {}  # FolderWatcher.job_key(digest) -> {"source", "output", "time"}
+        self.outputs = {} # output path -> job key it was written / copied for
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+            self.done = data.get("done", {})
+            self.outputs = data.get("outputs", {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Warning: could not read {path} ({e}), starting with an empty index.")
+
+    def digest(self, path, stat):
+        """Content hash of path, rehashing only when its size or mtime changed."""
+        known = self.files.get(path)
+        if known and tuple(known[:2]) == tuple(stat):
+            return known[2]
+        digest = file_digest(path)
+        self.files[path] = [stat[0], stat[1], digest]
+        return digest
+
+    def is_done(self, key):
+        entry = self.done.get(key)
+        return entry is not None and os.path.exists(entry["output"])
+
+    def save(self):
+        folder = os.path.dirname(self.path)
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"files": self.files, "done": self.done, "outputs": self.outputs}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"Warning: could not save the watch index: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+def upload_walls(image_path, output_path, scene_name, scale_x=1, scale_y=1):
+    """Sends one map's walls to Foundry with send_token, in a child process.
+
+    send_token keeps its connection state in module globals and exits when the
+    socket closes, so every upload gets a fresh interpreter.
+    """
+    code = ("import sys, send_token; send_token.default_param['scene_name'] = sys.argv[3]; "
+            "send_token.send_token(None, sys.argv[1], sys.argv[2], sys.argv[3], float(sys.argv[4]), float(sys.argv[5]))")
+    proc = subprocess.run([sys.executable, "-c", code, image_path, output_path, scene_name, str(scale_x), str(scale_y)],
+                          cwd=os.path.dirname(os.path.abspath(__file__)), timeout=UPLOAD_TIMEOUT)
+    return proc.returncode
+
+
+class FolderWatcher:
+    """Polls folders and runs new or changed maps through a process pool.
+
+    Outputs are written as <out_dir>/<relative path>/<name>_walls<ext>. With
+    upload=True every finished map is also sent to the Foundry scene named after
+    the file (uploads run one at a time, in the background). memory_budget (bytes)
+    caps the RSS of all workers together, see memory_budget.budget_detect.
+    """
+
+    def __init__(self, folders, params, out_dir=None, max_size=0, workers=None, ext=".json", upload=False,
+                 recursive=False, poll_interval=POLL_INTERVAL, settle_time=SETTLE_TIME, cache_dir=DEFAULT_CACHE_DIR,
+                 memory_budget=None):
+        self.folders = [os.path.abspath(f) for f in folders]
+        self.params = wall_detection.make_params(**params)
+        self.out_dir = os.path.abspath(out_dir or os.path.join(self.folders[0], OUTPUT_DIR))
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.max_size = max_size
+        self.ext = ext
+        self.recursive = recursive
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.index = WatchIndex(os.path.join(self.out_dir, INDEX_NAME))
+        workers = workers or available_cores()
+        self.job_budget = memory_budget // workers if memory_budget else None
+        # Everything besides the image and params that changes an output
+        self.job_settings = {"max_size": max_size, "job_budget": self.job_budget, "ext": ext}
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                            initargs=(cache_dir, threads_per_worker(workers)))
+        self.settling = {} # path -> (stat, first seen with that stat)
+        self.running = {}  # key -> (paths, future); identical maps share one job
+        self.failed = set() # Keys that failed, not retried until the file changes
+        self.uploads = None
+        if upload:
+            self.uploads = queue.Queue()
+            threading.Thread(target=self._upload_loop, daemon=True).start()
+
+    def output_path(self, path):
+        root = next((f for f in self.folders if path.startswith(f + os.sep)), os.path.dirname(path))
+        rel = os.path.relpath(path, root)
+        if len(self.folders) > 1:
+            rel = os.path.join(os.path.basename(root), rel)
+        return os.path.join(self.out_dir, os.path.splitext(rel)[0] + "_walls" + self.ext)
+
+    def job_key(self, digest):
+        """Key of the job for an image: content hash + detection params + job settings."""
+        return cache_key(digest, {"params": self.params, "job": self.job_settings})
+
+    def poll_once(self):
+        """One scan: starts jobs for files that settled. Returns the number of jobs started."""
+        now = time.monotonic()
+        started = 0
+        current = scan_images(self.folders, [self.out_dir], self.recursive)
+        for path in list(self.settling):
+            if path not in current:
+                del self.settling[path]
+        for path, stat in current.items():
+            known = self.index.files.get(path)
+            if known and tuple(known[:2]) == stat and path not in self.settling:
+                # Unchanged since it was hashed; only look again if the job isn't done
+                key = self.job_key(known[2])
+                if key in self.running or key in self.failed or self.index.is_done(key): continue
+            seen = self.settling.get(path)
+            if seen is None or seen[0] != stat:
+                self.settling[path] = (stat, now) # New or still being written: (re)start the debounce
+                continue
+            if now - seen[1] < self.settle_time: continue
+            del self.settling[path]
+            started += self._start(path, stat)
+        return started
+
+    def _start(self, path, stat):
+        try:
+            digest = self.index.digest(path, stat)
+        except OSError as e:
+            print(f"Warning: cannot read {path}: {e}")
+            return 0
+        key = self.job_key(digest)
+        if key in self.failed: return 0
+        if key in self.running:
+            if path not in self.running[key][0]:
+                self.running[key][0].append(path)
+            return 0
+        if self.index.is_done(key):
+            done = self.index.done[key]["output"]
+            print(f"Skipping {path}: already processed with these parameters ({done})")
+            self._copy_output(key, done, self.output_path(path))
+            self.index.save()
+            return 0
+        spec = {"path": path, "params": self.params, "max_size": self.max_size, "memory_budget": self.job_budget}
+        self.running[key] = ([path], self.executor.submit(run_job, spec))
+        print(f"Queued {path}")
+        return 1
+
+    def collect(self):
+        """Writes the outputs of finished jobs. Returns the number collected."""
+        finished = [(key, paths, future) for key, (paths, future) in self.running.items() if future.done()]
+        for key, paths, future in finished:
+            del self.running[key]
+            path = paths[0]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Detection failed for {path}: {type(e).__name__}: {e}")
+                self.failed.add(key)
+                self.index.save() # Keep the hash so an unchanged file isn't rehashed
+                continue
+            output = self.output_path(path)
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+            wall_io.save_walls(output, result, result["metadata"])
+            self.index.done[key] = {"source": path, "output": output, "time": time.time()}
+            self.index.outputs[output] = key
+            print(f"Walls for {path}: {len(result['polygons'])} polygons, {len(result['lines'])} lines "
+                  f"({result['metadata']['seconds']:.2f}s) -> {output}")
+            for other in paths[1:]:
+                self._copy_output(key, output, self.output_path(other))
+            if self.uploads is not None:
+                for other in paths:
+                    self.uploads.put((other, self.output_path(other)))
+        if finished:
+            self.index.save()
+        return len(finished)
+
+    def _copy_output(self, key, source, target):
+        # Same content as a map that was already processed: reuse its walls.
+        # A target left over from another job (older file, params or settings) is replaced
+        if target == source: return
+        if self.index.outputs.get(target) == key and os.path.exists(target): return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(source, target)
+        self.index.outputs[target] = key
+
+    def _upload_loop(self):
+        while True:
+            path, output = self.uploads.get()
+            scene = os.path.splitext(os.path.basename(path))[0]
+            try:
+                code = upload_walls(path, output, scene)
+                if code: print(f"Upload of {output} to scene '{scene}' exited with code {code}")
+            except (OSError, subprocess.TimeoutExpired) as e:
+                print(f"Upload of {output} failed: {e}")
+
+    def run(self):
+        print(f"Watching {', '.join(self.folders)} -> {self.out_dir} (every {self.poll_interval}s)")
+        try:
+            while True:
+                self.collect()
+                self.poll_once()
+                # Check finished jobs more often than the folders while work is in flight
+                time.sleep(min(self.poll_interval, 0.2) if self.running else self.poll_interval)
+        except KeyboardInterrupt:
+            print("Stopping watcher.")
+        finally:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Watch folders and detect walls on every new or changed map.")
+    parser.add_argument("folders", nargs="+")
+    parser.add_argument("--out", default=None, help=f"Output folder (default: <first folder>/{OUTPUT_DIR})")
+    parser.add_argument("--recursive", action="store_true")
+    parser.add_argument("--format", choices=("json", "fvw"), default="json")
+    parser.add_argument("--max-size", type=int, default=0, help="Downscale maps to fit this size for detection (0 = full size)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--poll", type=float, default=POLL_INTERVAL, help="Seconds between scans")
+    parser.add_argument("--settle", type=float, default=SETTLE_TIME, help="Seconds a file must be unchanged")
+    parser.add_argument("--param", action="append", default=[], metavar="NAME=VALUE",
+                        help="Detection parameter, e.g. --param canny1=40 (repeatable)")
+    parser.add_argument("--upload", action="store_true", help="Send every result to the Foundry scene named after the map")
+    parser.add_argument("--no-cache", action="store_true", help="Don't use the on-disk detection cache")
+    parser.add_argument("--memory-budget", default=None, metavar="SIZE",
+                        help="RSS budget of all workers together, e.g. 2G; maps are scaled / tiled to fit")
+    args = parser.parse_args()
+
+    try:
+        params = spec_from_query({k: [v] for k, v in (p.split("=", 1) for p in args.param)})["params"]
+        memory_budget = parse_size(args.memory_budget) if args.memory_budget else None
+    except (ValueError, KeyError) as e:
+        raise SystemExit(f"Bad argument: {e}")
+    watcher = FolderWatcher(args.folders, params, out_dir=args.out, max_size=args.max_size, workers=args.workers,
+                            ext=".json" if args.format == "json" else wall_io.BINARY_EXT, upload=args.upload,
+                            recursive=args.recursive, poll_interval=args.poll, settle_time=args.settle,
+                            cache_dir=None if args.no_cache else DEFAULT_CACHE_DIR, memory_budget=memory_budget)
+    watcher.run()